@@ -14,6 +14,7 @@ from routers import (
     analytics,
     auth,
     banners,
+    catalog,
     categories,
     chat,
     delivery,
@@ -23,12 +24,24 @@ from routers import (
     products,
     promo_codes,
     public_pages,
+    push_campaigns,
     reviews,
     sync,
     uploads,
     users,
 )
+from services.analytics import start_analytics_flusher, stop_analytics_flusher
+from services.event_store import start_rollup_job, stop_rollup_job
+from services.http_clients import close_http_clients, start_http_clients
+from services.image_cache import flush_pending_hits
+from services.notifications import start_receipt_poller, stop_receipt_poller
+from services.push_campaigns import stop_campaigns
+from services.nova_poshta import start_reference_refresh, stop_reference_refresh
 from services.images import UPLOADS_DIR
+from services.storage import get_storage
+from services.compression import CompressionMiddleware
+from services.json_response import FastJSONResponse
+from services.metrics import MetricsMiddleware
 from services.security import add_admin_guard_middleware, install_admin_route_guard
 
 load_dotenv()
@@ -42,17 +55,19 @@ os.makedirs("uploads", exist_ok=True)
 
 # --- APP ---
 install_admin_route_guard()
-app = FastAPI()
+app = FastAPI(default_response_class=FastJSONResponse)
 add_admin_guard_middleware(app)
 app.include_router(health.router)
 app.include_router(public_pages.router)
 app.include_router(delivery.router)
 app.include_router(uploads.router)
 app.include_router(analytics.router)
+app.include_router(catalog.router)
 app.include_router(categories.router)
 app.include_router(banners.router)
 app.include_router(reviews.router)
 app.include_router(promo_codes.router)
+app.include_router(push_campaigns.router)
 app.include_router(chat.router)
 app.include_router(posts.router)
 app.include_router(orders.router)
@@ -70,16 +85,38 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"]
 )
+app.add_middleware(CompressionMiddleware)
+# Outermost: times the whole stack, compression included.
+app.add_middleware(MetricsMiddleware)
 
-app.mount("/uploads", StaticFiles(directory=UPLOADS_DIR), name="uploads")
+if get_storage().is_local:
+    app.mount("/uploads", StaticFiles(directory=UPLOADS_DIR), name="uploads")
+else:
+    app.include_router(uploads.originals_router)
 
 # --- INITIALIZATION ---
 # --- SYNC CONFIG ---
 @app.on_event("startup")
-def startup_event():
+async def startup_event():
     fix_db_schema()
+    start_http_clients()
+    start_reference_refresh()
+    start_receipt_poller()
+    start_analytics_flusher()
+    start_rollup_job()
     logger.info("Server started successfully")
 
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    flush_pending_hits()
+    await stop_reference_refresh()
+    await stop_receipt_poller()
+    await stop_campaigns()
+    await stop_analytics_flusher()
+    await stop_rollup_job()
+    await close_http_clients()
+
 # --- ONEBOX ---
 
 
@@ -181,6 +181,7 @@ class OrderRequest(BaseModel):
     total_spent: Optional[float] = None
     push_token: Optional[str] = None
     return_url: Optional[str] = None
+    promo_code: Optional[str] = None
 
     model_config = ConfigDict(populate_by_name=True)
 
@@ -228,6 +229,21 @@ class PushTokenRequest(BaseModel):
     send_welcome: bool = False
 
 
+class PushSegment(BaseModel):
+    city: Optional[str] = None
+    cashback_levels: Optional[List[int]] = None
+    has_bonuses: Optional[bool] = None
+    last_order_after: Optional[str] = None
+    last_order_before: Optional[str] = None
+
+
+class PushCampaignCreate(BaseModel):
+    title: str
+    body: str
+    data: Dict[str, Any] = {}
+    segment: PushSegment = PushSegment()
+
+
 class UserResponse(BaseModel):
     phone: Optional[str] = None
     bonus_balance: int = 0
@@ -2,17 +2,84 @@
 
 from __future__ import annotations
 
-from fastapi import APIRouter, BackgroundTasks
+from datetime import datetime, timedelta
+from typing import Optional
+
+from fastapi import APIRouter, HTTPException
 
 from models.schemas import AnalyticsEventReq
-from services.analytics import track_analytics_event
+from services import event_store
+from services.analytics import enqueue_event, get_pipeline_stats
 
 
 router = APIRouter(prefix="/api", tags=["analytics"])
 
 
 @router.post("/track")
-async def track_event_endpoint(evt: AnalyticsEventReq, background_tasks: BackgroundTasks):
-    """Proxy endpoint for server-side analytics tracking."""
-    background_tasks.add_task(track_analytics_event, evt.event_name, evt.properties, evt.user_data)
+async def track_event_endpoint(evt: AnalyticsEventReq):
+    """Proxy endpoint for server-side analytics tracking (buffered, delivered in batches)."""
+    enqueue_event(evt.event_name, evt.properties, evt.user_data)
     return {"status": "ok"}
+
+
+@router.get("/admin/analytics/pipeline")
+def analytics_pipeline_stats():
+    """Buffer depth and delivery counters of this worker's analytics pipeline."""
+    return get_pipeline_stats()
+
+
+def _query(func, *args):
+    try:
+        return func(*args)
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=f"Invalid date: {exc}")
+
+
+@router.get("/admin/analytics/events")
+def analytics_event_series(
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    event_name: Optional[str] = None,
+    granularity: str = "hour",
+):
+    """Event counts per hour/day from the rollups (default: today)."""
+    return _query(event_store.event_series, date_from, date_to, event_name, granularity)
+
+
+@router.get("/admin/analytics/products")
+def analytics_top_products(
+    event_name: str = "AddToCart",
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    limit: int = 20,
+):
+    """Products with the most ``event_name`` events in the range."""
+    return _query(event_store.top_products, date_from, date_to, event_name, max(1, min(limit, 200)))
+
+
+@router.get("/admin/analytics/products/{product_id}")
+def analytics_product_events(product_id: str, date_from: Optional[str] = None, date_to: Optional[str] = None):
+    """Per-event counts for one product, e.g. add-to-cart events today."""
+    return _query(event_store.product_event_counts, product_id, date_from, date_to)
+
+
+@router.get("/admin/analytics/funnel")
+def analytics_funnel(
+    steps: str = "AddToCart,InitiateCheckout,purchase",
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+):
+    """Totals per funnel step and step-to-step conversion."""
+    step_list = [step.strip() for step in steps.split(",") if step.strip()]
+    if not step_list:
+        raise HTTPException(status_code=400, detail="steps are required")
+    return _query(event_store.funnel, step_list, date_from, date_to)
+
+
+@router.post("/admin/analytics/rollup")
+def analytics_rollup(hours: int = 24):
+    """Recompute the hourly rollups for the last ``hours`` hours (backfill)."""
+    hours = max(1, min(hours, 24 * 90))
+    if not event_store.rollup(datetime.now() - timedelta(hours=hours)):
+        raise HTTPException(status_code=409, detail="Rollup is already running")
+    return {"status": "ok", "hours": hours}
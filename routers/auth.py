@@ -14,6 +14,7 @@ from google.auth.transport import requests as google_requests
 from db import get_db_connection
 from models.schemas import SocialAuthRequest, UserAuth
 from services.auth import create_access_token
+from services.loyalty import REASON_SIGNUP, apply_bonus_delta
 
 
 router = APIRouter()
@@ -36,7 +37,8 @@ def auth_user(ua: UserAuth):
     if not user:
         # Pегистрация с бонусом 150 грн
         logger.info("New user registration: phone=%s bonus=%s", clean_phone, 150)
-        conn.execute("INSERT INTO users (phone, bonus_balance, total_spent, cashback_percent, created_at) VALUES (?, 150, 0, 0, ?)", (clean_phone, datetime.now().isoformat()))
+        conn.execute("INSERT INTO users (phone, bonus_balance, total_spent, cashback_percent, created_at) VALUES (?, 0, 0, 0, ?)", (clean_phone, datetime.now().isoformat()))
+        apply_bonus_delta(conn, clean_phone, 150, REASON_SIGNUP, f"signup:{clean_phone}")
         conn.commit()
         user = conn.execute("SELECT * FROM users WHERE phone=?", (clean_phone,)).fetchone()
     
@@ -197,17 +199,17 @@ def auth_social_login(body: SocialAuthRequest):
         """INSERT INTO users (
             phone, name, bonus_balance, total_spent, cashback_percent, created_at, email,
             google_id, facebook_id, is_bonus_claimed
-        ) VALUES (%s, %s, %s, 0, 0, %s, %s, %s, %s, TRUE)""",
+        ) VALUES (%s, %s, 0, 0, 0, %s, %s, %s, %s, TRUE)""",
         (
             phone_key,
             name_from_token,
-            bonus,
             datetime.now().isoformat(),
             email or None,
             social_id if provider == "google" else None,
             social_id if provider == "facebook" else None,
         ),
     )
+    apply_bonus_delta(conn, phone_key, bonus, REASON_SIGNUP, f"signup:{phone_key}")
     conn.commit()
     user = conn.execute("SELECT * FROM users WHERE phone = %s", (phone_key,)).fetchone()
     conn.close()
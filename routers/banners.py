@@ -6,6 +6,7 @@ from fastapi import APIRouter
 
 from db import get_db_connection
 from models.schemas import BannerCreate
+from services.images import release_uploaded_image
 
 
 router = APIRouter()
@@ -32,7 +33,9 @@ async def create_banner(banner: BannerCreate):
 @router.delete("/banners/{id}")
 async def delete_banner(id: int):
     conn = get_db_connection()
-    conn.execute("DELETE FROM banners WHERE id=?", (id,))
+    row = conn.execute("DELETE FROM banners WHERE id=? RETURNING image_url", (id,)).fetchone()
     conn.commit()
     conn.close()
+    if row:
+        release_uploaded_image(row["image_url"])
     return {"status": "ok"}
@@ -0,0 +1,28 @@
+"""Catalog delta-sync routes for the mobile app's offline cache."""
+
+from __future__ import annotations
+
+from fastapi import APIRouter, Request, Response
+
+from services.catalog_sync import catalog_changes, catalog_snapshot
+from services.json_response import FastJSONResponse
+
+
+router = APIRouter()
+
+
+@router.get("/api/catalog/snapshot")
+def get_catalog_snapshot(request: Request):
+    """Весь каталог (товары, категории, баннеры) с его версией — для первой установки."""
+    version, body = catalog_snapshot()
+    etag = f'"catalog-{version}"'
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
+@router.get("/api/catalog/changes")
+def get_catalog_changes(since: int = 0):
+    """Изменения каталога после версии since; reset=true — перезагрузить snapshot."""
+    return FastJSONResponse(catalog_changes(since))
@@ -8,7 +8,7 @@ from fastapi import APIRouter, File, Form, HTTPException, UploadFile
 
 from db import get_db_connection
 from models.schemas import CategoryResponse
-from services.images import save_uploaded_image
+from services.images import release_uploaded_image, save_uploaded_image
 
 
 router = APIRouter()
@@ -88,15 +88,19 @@ def delete_category_banner(category_id: int, image_url: str):
             detail=f"Категория с id или external_id={category_id} не найдена. Используйте внутренний id из GET /all-categories.",
         )
     try:
-        conn.execute("DELETE FROM category_banners WHERE category_id = ? AND image_url = ?", (internal_id, image_url))
-        conn.execute("UPDATE categories SET banner_url = NULL WHERE id = ? AND banner_url = ?", (internal_id, image_url))
+        cur = conn.execute("DELETE FROM category_banners WHERE category_id = ? AND image_url = ?", (internal_id, image_url))
+        released = cur.rowcount
+        cur = conn.execute("UPDATE categories SET banner_url = NULL WHERE id = ? AND banner_url = ?", (internal_id, image_url))
+        released += cur.rowcount
         conn.commit()
-        return {"success": True}
     except Exception as exc:
         conn.rollback()
         raise HTTPException(status_code=500, detail=str(exc))
     finally:
         conn.close()
+    for _ in range(released):
+        release_uploaded_image(image_url)
+    return {"success": True}
 
 
 @router.post("/categories")
@@ -119,19 +123,26 @@ async def update_category(id: int, name: str = Form(...), banner: UploadFile = F
     if not row:
         conn.close()
         raise HTTPException(status_code=404, detail="Category not found")
-    banner_url = row.get("banner_url") if row else None
+    old_banner_url = row.get("banner_url") if row else None
+    banner_url = old_banner_url
     if banner and banner.filename:
         banner_url = await save_uploaded_image(banner)
     conn.execute("UPDATE categories SET name=?, banner_url=? WHERE id=?", (name, banner_url, id))
     conn.commit()
     conn.close()
+    if old_banner_url and old_banner_url != banner_url:
+        release_uploaded_image(old_banner_url)
     return {"status": "ok"}
 
 
 @router.delete("/categories/{category_id}")
 def delete_category(category_id: int):
     conn = get_db_connection()
-    conn.execute("DELETE FROM categories WHERE id = ?", (category_id,))
+    banner_rows = conn.execute("SELECT image_url FROM category_banners WHERE category_id = ?", (category_id,)).fetchall()
+    row = conn.execute("DELETE FROM categories WHERE id = ? RETURNING banner_url", (category_id,)).fetchone()
     conn.commit()
     conn.close()
+    if row:
+        for url in [row["banner_url"]] + [banner_row["image_url"] for banner_row in banner_rows]:
+            release_uploaded_image(url)
     return {"success": True, "message": "Категория удалена"}
@@ -2,7 +2,6 @@
 
 from __future__ import annotations
 
-import json
 import logging
 import os
 import re
@@ -11,6 +10,7 @@ from typing import List
 from fastapi import APIRouter
 from models.schemas import ChatRequest, ChatResponse
 from db import get_db_connection
+from services.json_columns import image_urls
 from services.products import get_products_by_ids
 
 
@@ -368,7 +368,7 @@ async def chat_endpoint(request: ChatRequest):
         # Загружаем только нужные поля (быстрее и меньше памяти)
         all_products_rows = conn.execute(
             """
-            SELECT id, name, category, price, old_price, image, images,
+            SELECT id, name, category, price, old_price, image,
                    description, usage, composition
             FROM products
             """
@@ -528,12 +528,8 @@ IDs: [39151, 39206, 39202]»
         def _as_chat_product(p: dict) -> dict:
             image = p.get("image")
             if not image:
-                try:
-                    images = json.loads(p.get("images") or "[]")
-                    if isinstance(images, list) and images:
-                        image = images[0]
-                except Exception:
-                    image = None
+                images = image_urls(p.get("images"))
+                image = images[0] if images else None
 
             return {
                 "id": p.get("id"),
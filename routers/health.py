@@ -2,7 +2,12 @@
 
 from __future__ import annotations
 
-from fastapi import APIRouter
+from typing import Optional
+
+from fastapi import APIRouter, Header, HTTPException, Response
+
+from services.http_clients import get_http_metrics
+from services.metrics import METRICS_TOKEN, PROMETHEUS_CONTENT_TYPE, metrics_authorized, render_metrics
 
 
 router = APIRouter(tags=["health"])
@@ -12,3 +17,19 @@ router = APIRouter(tags=["health"])
 def health_check():
     """Basic production health check."""
     return {"status": "ok", "message": "Server is running"}
+
+
+@router.get("/api/admin/http-clients/stats")
+def http_clients_stats():
+    """Per-upstream latency, retry and error counters of this worker's outbound clients."""
+    return get_http_metrics()
+
+
+@router.get("/metrics", include_in_schema=False)
+def prometheus_metrics(authorization: Optional[str] = Header(None)):
+    """Request, SQL and upstream metrics in Prometheus text format (bearer METRICS_TOKEN)."""
+    if not METRICS_TOKEN:
+        raise HTTPException(status_code=403, detail="Metrics endpoint is disabled")
+    if not metrics_authorized(authorization):
+        raise HTTPException(status_code=403, detail="Forbidden")
+    return Response(content=render_metrics(), media_type=PROMETHEUS_CONTENT_TYPE)
@@ -2,22 +2,27 @@
 
 from __future__ import annotations
 
-import csv
 import logging
-import json
 import os
 from datetime import datetime
-from io import StringIO
+from typing import Optional
 
-import httpx
 from fastapi import APIRouter, BackgroundTasks, HTTPException, Request
 from fastapi.responses import StreamingResponse
 
 from db import DATABASE_URL, get_db_connection
 from models.schemas import BatchDelete, OrderRequest, OrderStatusUpdate
+from services.exports import export_chunks, iter_query
+from services.http_clients import get_http_client
+from services.json_columns import order_item_list, to_jsonb
+from services.json_response import FastJSONResponse
+from services.loyalty import apply_order_cashback, redeem_order_bonuses
 from services.notifications import send_expo_push
 from services.onebox_api import OneBoxDbSession, Product, create_onebox_order
-from services.users import calculate_cashback_percent, clean_warehouse_value, normalize_phone
+from services.order_items import backfill_order_items, insert_order_items, product_sales
+from services.orders import build_order_filters, list_orders_page
+from services.promo_codes import PromoCodeError, redeem_promo_code
+from services.users import clean_warehouse_value, normalize_phone
 
 
 router = APIRouter()
@@ -36,13 +41,36 @@ def get_orders_api():
         d["total_price"] = total
         d["totalPrice"] = total
         d["totalprice"] = total
-        try:
-            d["items"] = json.loads(d["items"])
-        except (json.JSONDecodeError, TypeError, KeyError):
-            d["items"] = []
+        d["items"] = order_item_list(d.get("items"))
         res.append(d)
     conn.close()
-    return res
+    return FastJSONResponse(res)
+
+@router.get("/api/admin/orders")
+def list_admin_orders(
+    limit: int = 50,
+    cursor: Optional[int] = None,
+    status: Optional[str] = None,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    phone: Optional[str] = None,
+    payment_method: Optional[str] = None,
+    delivery_method: Optional[str] = None,
+    include_items: bool = False,
+):
+    """Страница заказов для админки (новые первыми): {"orders": [...], "next_cursor": id | null}."""
+    return FastJSONResponse(list_orders_page(
+        limit=limit,
+        cursor=cursor,
+        status=status,
+        date_from=date_from,
+        date_to=date_to,
+        phone=phone,
+        payment_method=payment_method,
+        delivery_method=delivery_method,
+        include_items=include_items,
+    ))
+
 
 @router.get("/api/orders/{order_id}")
 def get_order_by_id(order_id: int):
@@ -54,10 +82,7 @@ def get_order_by_id(order_id: int):
         raise HTTPException(status_code=404, detail="Order not found")
     d = dict(row)
     d["total_price"] = d.get("total_price") or d.get("total") or d.get("totalprice") or d.get("totalPrice") or 0
-    try:
-        d["items"] = json.loads(d["items"]) if d.get("items") else []
-    except Exception:
-        d["items"] = []
+    d["items"] = order_item_list(d.get("items"))
     return d
 
 @router.post("/create_order")
@@ -138,7 +163,7 @@ async def create_order(order: OrderRequest, background_tasks: BackgroundTasks):
             logger.info("Updated user profile: phone=%s", user_phone)
         
         # Сериализуем items в JSON
-        items_json = json.dumps([{
+        items_data = [{
             "id": item.id,
             "product_id": (item.product_id or item.id),
             "name": item.name,
@@ -147,7 +172,8 @@ async def create_order(order: OrderRequest, background_tasks: BackgroundTasks):
             "packSize": item.packSize,
             "unit": item.unit,
             "variant_info": item.variant_info
-        } for item in order.items])
+        } for item in order.items]
+        items_json = to_jsonb(items_data)
         
         # У заказ зберігаємо тільки значення (без префіксу "Нова Пошта:" / "Укрпошта:")
         warehouse_for_order = (clean_warehouse_value(order.warehouse) or order.warehouse or "").strip()
@@ -156,14 +182,22 @@ async def create_order(order: OrderRequest, background_tasks: BackgroundTasks):
         order_warehouse = warehouse_for_order if not is_ukrposhta_order else ""
         order_user_ukrposhta = warehouse_for_order if is_ukrposhta_order else ""
 
+        # Промокод: использование списывается условным UPDATE в транзакции заказа (без перерасхода max_uses).
+        promo_code = None
+        if order.promo_code and order.promo_code.strip():
+            try:
+                promo_code = redeem_promo_code(cur, order.promo_code)["code"]
+            except PromoCodeError as exc:
+                raise HTTPException(status_code=exc.status_code, detail=str(exc))
+
         # Создаем заказ
         push_token = getattr(order, 'push_token', None) or None
         row = cur.execute("""
             INSERT INTO orders (
                 name, phone, user_phone, email, contact_preference, city, city_ref, warehouse, warehouse_ref,
                 delivery_method, user_ukrposhta, push_token,
-                items, total_price, payment_method, bonus_used, status, date
-            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                items, total_price, payment_method, bonus_used, promo_code, status, date
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
             RETURNING id
         """, (
             order.name,
@@ -182,27 +216,25 @@ async def create_order(order: OrderRequest, background_tasks: BackgroundTasks):
             order.totalPrice,
             order.payment_method,
             order.bonus_used,
+            promo_code,
             "Pending",
             datetime.now().strftime("%Y-%m-%d %H:%M:%S")
         )).fetchone()
         order_id = (row or {}).get("id")
-        conn.commit()
+        insert_order_items(cur, order_id, items_data)
         
         # Списание бонусов только при «Оплата при отриманні» (наложенный платёж). При оплате картой — в payment_callback после успешной оплаты.
+        # Списание идёт в той же транзакции, что и заказ (запись в bonus_transactions).
         is_fully_paid_by_bonuses = order.use_bonuses and order.bonus_used > 0 and float(order.totalPrice or 0) <= 0
 
         if (order.payment_method == "cash" or is_fully_paid_by_bonuses) and order.use_bonuses and order.bonus_used > 0:
-            cur.execute("""
-                UPDATE users 
-                SET bonus_balance = GREATEST(bonus_balance - ?, 0) 
-                WHERE phone = ?
-            """, (order.bonus_used, user_phone))
+            redeem_order_bonuses(cur, order_id, user_phone, order.bonus_used)
             if is_fully_paid_by_bonuses:
                 paid_status = "\u041e\u043f\u043b\u0430\u0447\u0435\u043d\u043e"
                 cur.execute("UPDATE orders SET status=? WHERE id=?", (paid_status, order_id))
-
-            conn.commit()
             logger.info("Bonuses deducted immediately: phone=%s amount=%s order_id=%s", user_phone, order.bonus_used, order_id)
+
+        conn.commit()
         
         conn.close()
         
@@ -272,21 +304,21 @@ async def create_order(order: OrderRequest, background_tasks: BackgroundTasks):
                     "redirectUrl": order.return_url or "https://dikoros.ua",
                 }
                 try:
-                    async with httpx.AsyncClient() as client:
-                        mono_resp = await client.post(
-                            "https://api.monobank.ua/api/merchant/invoice/create",
-                            headers={"X-Token": token},
-                            json=payload,
-                            timeout=15.0
-                        )
-                        mono_resp.raise_for_status()
-                        mono_data = mono_resp.json()
-                        page_url = mono_data.get("pageUrl")
-                        if page_url:
-                            response_data["pageUrl"] = page_url
-                            logger.info("Monobank invoice created: order_id=%s", order_id)
-                        else:
-                            logger.warning("Monobank response without pageUrl: %s", mono_data)
+                    client = get_http_client("monobank")
+                    mono_resp = await client.post(
+                        "https://api.monobank.ua/api/merchant/invoice/create",
+                        headers={"X-Token": token},
+                        json=payload,
+                        timeout=15.0
+                    )
+                    mono_resp.raise_for_status()
+                    mono_data = mono_resp.json()
+                    page_url = mono_data.get("pageUrl")
+                    if page_url:
+                        response_data["pageUrl"] = page_url
+                        logger.info("Monobank invoice created: order_id=%s", order_id)
+                    else:
+                        logger.warning("Monobank response without pageUrl: %s", mono_data)
                 except Exception as mono_err:
                     logger.warning("Monobank request failed: %s", mono_err)
             else:
@@ -294,6 +326,15 @@ async def create_order(order: OrderRequest, background_tasks: BackgroundTasks):
         
         return response_data
         
+    except HTTPException:
+        # Ошибки валидации (бонусы, промокод) отдаём клиенту как есть, заказ не создаётся.
+        if conn is not None:
+            try:
+                conn.rollback()
+                conn.close()
+            except Exception:
+                pass
+        raise
     except Exception as e:
         logger.exception("Failed to create order")
         if conn is not None:
@@ -331,27 +372,24 @@ async def payment_callback_monobank(request: Request):
     conn = get_db_connection()
     try:
         cur = conn.cursor()
-        order = cur.execute("SELECT user_phone, bonus_used, status FROM orders WHERE id=?", (order_id,)).fetchone()
+        # Условный UPDATE: повторный вебхук не пройдёт, даже если придёт параллельно.
+        order = cur.execute(
+            "UPDATE orders SET status=? WHERE id=? AND status IS DISTINCT FROM ? RETURNING user_phone, bonus_used",
+            ("Оплачено", order_id, "Оплачено"),
+        ).fetchone()
         if not order:
-            return {"status": "error", "reason": "order not found"}
+            exists = cur.execute("SELECT 1 FROM orders WHERE id=?", (order_id,)).fetchone()
+            if not exists:
+                return {"status": "error", "reason": "order not found"}
+            return {"status": "ok", "reason": "already processed"}
 
         order_dict = dict(order)
-        old_status = order_dict.get("status")
         user_phone = order_dict.get("user_phone")
         bonus_used = order_dict.get("bonus_used") or 0
 
-        if old_status == "Оплачено":
-            return {"status": "ok", "reason": "already processed"}
-
-        if user_phone and bonus_used > 0:
-            cur.execute("""
-                UPDATE users
-                SET bonus_balance = GREATEST(bonus_balance - ?, 0)
-                WHERE phone = ?
-            """, (bonus_used, user_phone))
+        if redeem_order_bonuses(cur, order_id, user_phone, bonus_used):
             logger.info("Bonuses deducted after card payment: phone=%s amount=%s", user_phone, bonus_used)
 
-        cur.execute("UPDATE orders SET status=? WHERE id=?", ("Оплачено", order_id))
         conn.commit()
     finally:
         conn.close()
@@ -363,18 +401,18 @@ async def payment_callback_monobank(request: Request):
 ORDER_STATUSES_FOR_PUSH = {"Отправлен", "В обработке", "Доставлен", "Виконано", "Выполнен", "Completed", "Delivered"}
 
 
-def _send_order_created_push_task(push_token: str, order_id: int) -> None:
+async def _send_order_created_push_task(push_token: str, order_id: int) -> None:
     """Фонова задача: пуш про успішне оформлення замовлення."""
-    send_expo_push(
+    await send_expo_push(
         push_token,
         title="Замовлення оформлено! 🍄",
         body="Дякуємо за замовлення, ми зв'яжемося з вами найближчим часом!",
     )
 
 
-def _send_order_status_push_task(push_token: str, new_status: str) -> None:
+async def _send_order_status_push_task(push_token: str, new_status: str) -> None:
     """Фонова задача: пуш про зміну статусу замовлення."""
-    send_expo_push(
+    await send_expo_push(
         push_token,
         title="Оновлення замовлення 📦",
         body=f"Ваше замовлення переведено в статус: {new_status}",
@@ -417,10 +455,6 @@ async def update_order_status(id: int, status: OrderStatusUpdate, background_tas
         }
 
         if new_status in final_statuses and old_status not in final_statuses:
-            if order_dict.get("cashback_applied"):
-                conn.commit()
-                return {"status": "ok", "message": "Order status updated"}
-
             user_phone = order_dict.get("user_phone") or order_dict.get("phone")
 
             try:
@@ -431,43 +465,16 @@ async def update_order_status(id: int, status: OrderStatusUpdate, background_tas
                 order_total = 0.0
 
             if user_phone and order_total > 0:
-                user = cur.execute("SELECT * FROM users WHERE phone=?", (user_phone,)).fetchone()
-
-                if user:
-                    user_dict = dict(user)
-
-                    try:
-                        current_total_spent = float(user_dict.get("total_spent") or 0)
-                    except Exception:
-                        current_total_spent = 0.0
-
-                    try:
-                        current_bonus = int(user_dict.get("bonus_balance") or 0)
-                    except Exception:
-                        current_bonus = 0
-
-                    cashback_percent_for_order = calculate_cashback_percent(current_total_spent)
-                    new_total_spent = current_total_spent + order_total
-                    new_cashback_percent = calculate_cashback_percent(new_total_spent)
-
-                    cashback_amount = int((order_total * cashback_percent_for_order) / 100)
-                    new_bonus_balance = current_bonus + cashback_amount
-
-                    cur.execute("""
-                        UPDATE users
-                        SET bonus_balance=?, total_spent=?, cashback_percent=?
-                        WHERE phone=?
-                    """, (new_bonus_balance, new_total_spent, new_cashback_percent, user_phone))
-
-                    cur.execute("UPDATE orders SET cashback_applied = TRUE WHERE id = ?", (id,))
-
+                # cashback_applied захватывается условным UPDATE — кэшбэк начисляется один раз.
+                cashback = apply_order_cashback(cur, id, user_phone, order_total)
+                if cashback:
                     logger.info(
                         "Cashback applied: order_id=%s user_phone=%s order_total=%s cashback_amount=%s new_bonus_balance=%s",
                         id,
                         user_phone,
                         order_total,
-                        cashback_amount,
-                        new_bonus_balance,
+                        cashback["delta"],
+                        cashback["balance"],
                     )
 
         conn.commit()
@@ -521,29 +528,57 @@ async def delete_orders_batch(batch: BatchDelete):
 async def delete_orders_batch_api(batch: BatchDelete):
     return await delete_orders_batch(batch)
 
+def _export_order_row(r: dict) -> list:
+    return [
+        r.get('id'),
+        r.get('date'),
+        r.get('name'),
+        r.get('phone'),
+        r.get('total_price') or r.get('totalPrice') or r.get('totalprice') or r.get('total'),
+        r.get('status'),
+        to_jsonb(r.get('items')),
+    ]
+
+
 @router.get("/orders/export")
-def export_orders():
-    conn = get_db_connection()
-    rows = conn.execute("SELECT * FROM orders ORDER BY id DESC").fetchall()
-    conn.close()
-    
-    output = StringIO()
-    writer = csv.writer(output)
-    writer.writerow(['ID', 'Date', 'Name', 'Phone', 'Total', 'Status', 'Items'])
-    
-    for r in rows:
-        writer.writerow([
-            r.get('id'),
-            r.get('date'),
-            r.get('name'),
-            r.get('phone'),
-            r.get('total_price') or r.get('totalPrice') or r.get('totalprice') or r.get('total'),
-            r.get('status'),
-            r.get('items'),
-        ])
-    
-    output.seek(0)
-    return StreamingResponse(iter([output.getvalue()]), media_type="text/csv", headers={"Content-Disposition": "attachment; filename=orders.csv"})
+def export_orders(
+    format: str = "csv",
+    status: Optional[str] = None,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    phone: Optional[str] = None,
+    payment_method: Optional[str] = None,
+    delivery_method: Optional[str] = None,
+):
+    """Экспорт заказов (CSV или XLSX) потоком через серверный курсор."""
+    conditions, params = build_order_filters(status, date_from, date_to, phone, payment_method, delivery_method)
+    where_sql = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    rows = iter_query(
+        f"SELECT * FROM orders {where_sql} ORDER BY id DESC",
+        params,
+    )
+    chunks, media_type, ext = export_chunks(
+        format, ['ID', 'Date', 'Name', 'Phone', 'Total', 'Status', 'Items'], rows, _export_order_row, "Orders"
+    )
+    return StreamingResponse(chunks, media_type=media_type, headers={"Content-Disposition": f"attachment; filename=orders.{ext}"})
+
+@router.post("/api/admin/order-items/backfill")
+def start_order_items_backfill(background_tasks: BackgroundTasks):
+    """Заполнить order_items для старых заказов (фоном, пачками)."""
+    background_tasks.add_task(backfill_order_items)
+    return {"status": "started"}
+
+
+@router.get("/api/admin/sales/products")
+def get_product_sales(
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    limit: int = 50,
+    order_by: str = "quantity",
+):
+    """Продажи по товарам из order_items: штуки, выручка, число заказов."""
+    return product_sales(date_from, date_to, max(1, min(limit, 500)), order_by)
+
 
 @router.get("/api/client/orders/{phone}")
 def get_client_orders(phone: str):
@@ -560,10 +595,7 @@ def get_client_orders(phone: str):
         total = d.get("total_price") or d.get("total") or d.get("totalprice") or 0
         d["total_price"] = total
         d["totalPrice"] = total  # для мобильного приложения (camelCase)
-        try:
-            d["items"] = json.loads(d["items"])
-        except (json.JSONDecodeError, TypeError, KeyError):
-            d["items"] = []
+        d["items"] = order_item_list(d.get("items"))
         res.append(d)
     return res
 
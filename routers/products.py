@@ -3,14 +3,18 @@
 from __future__ import annotations
 
 import json
+from collections import Counter
 from typing import Optional
 
 from fastapi import APIRouter, HTTPException, Request
 
 from db import get_db_connection
 from models.schemas import ProductCreate, ProductUpdate
-from services.images import save_uploaded_image
-from services.products import normalize_product_row
+from services.json_columns import image_urls, images_jsonb, to_jsonb
+from services.json_response import FastJSONResponse
+from services.images import release_uploaded_image, save_uploaded_image
+from services.products import PRODUCT_GROUP_KEY_SQL, normalize_product_row
+from services.reviews import combined_rating, product_rating, rating_stats
 
 
 router = APIRouter()
@@ -56,7 +60,7 @@ async def get_products_paginated(page: int = 1, limit: int = 50, category: str =
     if where_clauses:
         where_str = " WHERE " + " AND ".join(where_clauses)
         
-    group_expr = "COALESCE(NULLIF(parent_sku, ''), NULLIF(sku, ''), CAST(id AS TEXT))"
+    group_expr = PRODUCT_GROUP_KEY_SQL
     
     cur.execute(f"SELECT COUNT(DISTINCT {group_expr}) as count FROM products {where_str}", tuple(params))
     row = cur.fetchone()
@@ -101,6 +105,7 @@ async def get_products_paginated(page: int = 1, limit: int = 50, category: str =
         """
         cur.execute(items_sql, tuple(group_keys))
         all_rows = cur.fetchall()
+        ratings = rating_stats(conn, [r['id'] for r in all_rows])
         
         groups_dict = {}
         for r in all_rows:
@@ -168,6 +173,8 @@ async def get_products_paginated(page: int = 1, limit: int = 50, category: str =
                 })
                 
             main_variant['variants'] = formatted_variants
+            # Reviews may be left on any variant of the card
+            main_variant.update(combined_rating(ratings, [v.get('id') for v in variants_sorted]))
             main_variant['price'] = min_price
             main_variant['old_price'] = max_old_price if max_old_price > 0 else None
             
@@ -191,12 +198,12 @@ async def get_products_paginated(page: int = 1, limit: int = 50, category: str =
 
     conn.close()
     
-    return {
+    return FastJSONResponse({
         "products": grouped_products,
         "total_pages": (total_count + limit - 1) // limit if total_count > 0 else 1,
         "current_page": page,
         "categories": sorted(list(set([c for c in all_categories if c])))
-    }
+    })
 
 @router.get("/products/by-external-id")
 def get_product_by_external_id_query(external_id: str):
@@ -230,18 +237,8 @@ def get_product_by_external_id_query(external_id: str):
         """, (normalized,)).fetchone()
         if not row:
             raise HTTPException(status_code=404, detail="Product not found")
-        d = dict(row)
-        d["discount"] = d.get("discount", 0) if d.get("discount") is not None else 0
-        variants_value = d.get("variants")
-        if isinstance(variants_value, str):
-            try:
-                d["variants"] = json.loads(variants_value)
-            except (json.JSONDecodeError, TypeError):
-                d["variants"] = []
-        elif isinstance(variants_value, list):
-            d["variants"] = variants_value
-        else:
-            d["variants"] = []
+        d = normalize_product_row(dict(row))
+        d.update(product_rating(conn, d["id"]))
         d["composition"] = None
         return d
     finally:
@@ -259,18 +256,8 @@ def get_product_by_external_id(external_id: str):
         """, (external_id,)).fetchone()
         if not row:
             raise HTTPException(status_code=404, detail="Product not found")
-        d = dict(row)
-        d["discount"] = d.get("discount", 0) if d.get("discount") is not None else 0
-        variants_value = d.get("variants")
-        if isinstance(variants_value, str):
-            try:
-                d["variants"] = json.loads(variants_value)
-            except (json.JSONDecodeError, TypeError):
-                d["variants"] = []
-        elif isinstance(variants_value, list):
-            d["variants"] = variants_value
-        else:
-            d["variants"] = []
+        d = normalize_product_row(dict(row))
+        d.update(product_rating(conn, d["id"]))
         d["composition"] = None
         return d
     finally:
@@ -297,7 +284,9 @@ def get_product(id: int):
         if not row:
             raise HTTPException(status_code=404, detail="Product not found")
 
-        return normalize_product_row(dict(row))
+        d = normalize_product_row(dict(row))
+        d.update(product_rating(conn, d["id"]))
+        return d
     finally:
         conn.close()
 
@@ -404,13 +393,25 @@ async def create_product(request: Request):
         conn.execute("""
             INSERT INTO products (name, price, category, image, images, description, usage, composition, old_price, discount, unit, variants, option_names, delivery_info, return_info, is_bestseller, is_promotion, is_new)
             VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        """, (name, price, category, image_path, images, description, usage, composition, old_price, discount, unit, variants_json, option_names, delivery_info, return_info, is_bestseller, is_promotion, is_new))
+        """, (name, price, category, image_path, images_jsonb(images), description, usage, composition, old_price, discount, unit, variants_json, option_names, delivery_info, return_info, is_bestseller, is_promotion, is_new))
         conn.commit()
         return {"status": "ok"}
     finally:
         conn.close()
 
 
+def _product_image_refs(image, images) -> list:
+    """Every upload a product row references: the main image and the gallery."""
+    return ([image] if image else []) + image_urls(images)
+
+
+def _release_removed_images(old_refs: list, new_refs: list) -> None:
+    # Multiset difference: each /upload counted one reference per use.
+    for url, count in (Counter(old_refs) - Counter(new_refs)).items():
+        for _ in range(count):
+            release_uploaded_image(url)
+
+
 @router.put("/products/{id}")
 async def update_product(id: int, request: Request):
     conn = get_db_connection()
@@ -492,13 +493,17 @@ async def update_product(id: int, request: Request):
         cur = conn.execute("""
             UPDATE products SET name=?, price=?, category=?, image=?, images=?, description=?, usage=?, composition=?, old_price=?, discount=?, unit=?, variants=?, option_names=?, delivery_info=?, return_info=?, is_bestseller=?, is_promotion=?, is_new=?, is_manually_edited=?
             WHERE id=?
-        """, (name, price, category, image_path, images, description, usage, composition, old_price, discount, unit, variants_json, option_names, delivery_info, return_info, is_bestseller, is_promotion, is_new, True, id))
+        """, (name, price, category, image_path, images_jsonb(images), description, usage, composition, old_price, discount, unit, to_jsonb(variants_json), option_names, delivery_info, return_info, is_bestseller, is_promotion, is_new, True, id))
         conn.commit()
 
         updated_count = getattr(cur, "rowcount", 0)
         if updated_count == 0:
             raise HTTPException(status_code=404, detail="Product not found")
 
+        _release_removed_images(
+            _product_image_refs(row.get("image"), row.get("images")),
+            _product_image_refs(image_path, images),
+        )
         return {"status": "ok"}
     finally:
         conn.close()
@@ -508,13 +513,13 @@ async def update_product(id: int, request: Request):
 async def delete_product(id: int):
     conn = get_db_connection()
     try:
-        cur = conn.execute("DELETE FROM products WHERE id=?", (id,))
+        deleted = conn.execute("DELETE FROM products WHERE id=? RETURNING image, images", (id,)).fetchone()
         conn.commit()
-        deleted_count = getattr(cur, "rowcount", 0)
 
-        if deleted_count == 0:
+        if not deleted:
             raise HTTPException(status_code=404, detail="Product not found")
 
+        _release_removed_images(_product_image_refs(deleted.get("image"), deleted.get("images")), [])
         return {"status": "ok"}
     finally:
         conn.close()
@@ -8,6 +8,7 @@ from fastapi import APIRouter, HTTPException
 
 from db import get_db_connection
 from models.schemas import PromoCodeCreate, PromoCodeValidate
+from services.promo_codes import PromoCodeError, check_promo_code, invalidate_promo_cache, normalize_code
 
 
 router = APIRouter()
@@ -33,7 +34,7 @@ def create_promo_code(promo: PromoCodeCreate):
             VALUES (?, ?, ?, ?, ?, ?, 0, 1)
             """,
             (
-                promo.code.upper(),
+                normalize_code(promo.code),
                 promo.discount_percent,
                 promo.discount_amount,
                 promo.max_uses,
@@ -43,6 +44,7 @@ def create_promo_code(promo: PromoCodeCreate):
         )
         conn.commit()
         conn.close()
+        invalidate_promo_cache()
         return {"status": "ok", "message": "Promo code created"}
     except Exception as exc:
         conn.close()
@@ -51,37 +53,11 @@ def create_promo_code(promo: PromoCodeCreate):
 
 @router.post("/api/promo-codes/validate")
 def validate_promo_code(promo: PromoCodeValidate):
-    """Validate promo code and return discount details."""
-    conn = get_db_connection()
-    code = promo.code.upper()
-
-    row = conn.execute("SELECT * FROM promo_codes WHERE code=?", (code,)).fetchone()
-    conn.close()
-
-    if not row:
-        raise HTTPException(status_code=404, detail="Промокод не знайдено")
-
-    promo_dict = dict(row)
-
-    if not promo_dict.get("active"):
-        raise HTTPException(status_code=400, detail="Промокод неактивний")
-
-    if promo_dict.get("expires_at"):
-        expires = datetime.fromisoformat(promo_dict["expires_at"])
-        if datetime.now() > expires:
-            raise HTTPException(status_code=400, detail="Термін дії промокоду закінчився")
-
-    max_uses = promo_dict.get("max_uses", 0)
-    current_uses = promo_dict.get("current_uses", 0)
-    if max_uses > 0 and current_uses >= max_uses:
-        raise HTTPException(status_code=400, detail="Промокод вичерпано")
-
-    return {
-        "valid": True,
-        "code": code,
-        "discount_percent": promo_dict.get("discount_percent", 0),
-        "discount_amount": promo_dict.get("discount_amount", 0),
-    }
+    """Validate promo code and return discount details (served from the active-code cache)."""
+    try:
+        return check_promo_code(promo.code)
+    except PromoCodeError as exc:
+        raise HTTPException(status_code=exc.status_code, detail=str(exc))
 
 
 @router.delete("/api/promo-codes/{id}")
@@ -91,6 +67,7 @@ def delete_promo_code(id: int):
     conn.execute("DELETE FROM promo_codes WHERE id=?", (id,))
     conn.commit()
     conn.close()
+    invalidate_promo_cache()
     return {"status": "ok"}
 
 
@@ -104,4 +81,5 @@ def toggle_promo_code(id: int):
         conn.execute("UPDATE promo_codes SET active=? WHERE id=?", (new_active, id))
         conn.commit()
     conn.close()
+    invalidate_promo_cache()
     return {"status": "ok"}
@@ -0,0 +1,62 @@
+"""Admin routes for segmented marketing push campaigns."""
+
+from __future__ import annotations
+
+from fastapi import APIRouter, HTTPException
+
+from models.schemas import PushCampaignCreate, PushSegment
+from services import push_campaigns
+
+
+router = APIRouter(prefix="/api/admin/push-campaigns", tags=["push"])
+
+
+@router.post("/preview")
+def preview_push_segment(segment: PushSegment):
+    """Number of distinct push tokens the segment would reach."""
+    return {"total": push_campaigns.count_segment(segment.model_dump())}
+
+
+@router.post("")
+async def create_push_campaign(campaign: PushCampaignCreate):
+    """Create a campaign and start sending it in the background."""
+    if not campaign.title.strip() or not campaign.body.strip():
+        raise HTTPException(status_code=400, detail="title and body are required")
+    created = push_campaigns.create_campaign(
+        campaign.title.strip(),
+        campaign.body.strip(),
+        campaign.data,
+        campaign.segment.model_dump(),
+    )
+    push_campaigns.start_campaign(created["id"])
+    return created
+
+
+@router.get("")
+def list_push_campaigns(limit: int = 50):
+    return push_campaigns.list_campaigns(max(1, min(limit, 200)))
+
+
+@router.get("/{campaign_id}")
+def get_push_campaign(campaign_id: int):
+    """Campaign with progress counters (processed/sent/failed/unregistered of total)."""
+    campaign = push_campaigns.get_campaign(campaign_id)
+    if not campaign:
+        raise HTTPException(status_code=404, detail="Campaign not found")
+    return campaign
+
+
+@router.post("/{campaign_id}/cancel")
+def cancel_push_campaign(campaign_id: int):
+    if not push_campaigns.cancel_campaign(campaign_id):
+        raise HTTPException(status_code=409, detail="Campaign is not pending or running")
+    return {"status": "cancelled"}
+
+
+@router.post("/{campaign_id}/resume")
+async def resume_push_campaign(campaign_id: int):
+    """Continue a failed, interrupted or cancelled campaign from its checkpoint."""
+    if not push_campaigns.resume_campaign(campaign_id):
+        raise HTTPException(status_code=409, detail="Campaign cannot be resumed")
+    push_campaigns.start_campaign(campaign_id)
+    return {"status": "pending"}
@@ -3,11 +3,13 @@
 from __future__ import annotations
 
 from datetime import datetime
+from typing import Optional
 
 from fastapi import APIRouter, HTTPException
 
 from db import get_db_connection
 from models.schemas import ReviewCreate
+from services.reviews import add_rating, list_reviews_page, product_rating, remove_rating
 from services.users import normalize_phone
 
 
@@ -15,29 +17,22 @@ router = APIRouter()
 
 
 @router.get("/api/reviews/{product_id}")
-def get_product_reviews(product_id: int):
-    """Return all reviews for one product with aggregated rating metadata."""
+def get_product_reviews(product_id: int, limit: int = 50, cursor: Optional[int] = None):
+    """Return one page of a product's reviews (newest first) with rating metadata from the aggregate."""
     conn = get_db_connection()
-    rows = conn.execute(
-        """
-        SELECT * FROM reviews
-        WHERE product_id=?
-        ORDER BY created_at DESC
-        """,
-        (product_id,),
-    ).fetchall()
-    conn.close()
+    try:
+        page = list_reviews_page(conn, product_id, limit=limit, cursor=cursor)
+        rating = product_rating(conn, product_id)
+    finally:
+        conn.close()
 
-    reviews = [dict(row) for row in rows]
-    if reviews:
-        avg_rating = sum(review["rating"] for review in reviews) / len(reviews)
-        return {
-            "reviews": reviews,
-            "average_rating": round(avg_rating, 1),
-            "total_count": len(reviews),
-        }
-
-    return {"reviews": [], "average_rating": 0, "total_count": 0}
+    return {
+        "reviews": page["reviews"],
+        "average_rating": rating["average_rating"],
+        "total_count": rating["review_count"],
+        "rating_histogram": rating["rating_histogram"],
+        "next_cursor": page["next_cursor"],
+    }
 
 
 @router.post("/api/reviews")
@@ -76,6 +71,7 @@ async def create_review(review: ReviewCreate):
         ),
     ).fetchone()
     review_id = (row or {}).get("id")
+    add_rating(cur, review.product_id, review.rating)
     conn.commit()
     conn.close()
 
@@ -90,7 +86,10 @@ async def create_review(review: ReviewCreate):
 async def delete_review(id: int):
     """Delete a review."""
     conn = get_db_connection()
-    conn.execute("DELETE FROM reviews WHERE id=?", (id,))
+    cur = conn.cursor()
+    row = cur.execute("DELETE FROM reviews WHERE id=? RETURNING product_id, rating", (id,)).fetchone()
+    if row:
+        remove_rating(cur, row["product_id"], row["rating"])
     conn.commit()
     conn.close()
     return {"status": "ok"}
@@ -2,14 +2,25 @@
 
 from __future__ import annotations
 
-from fastapi import APIRouter, File, Request, UploadFile
-from fastapi.staticfiles import StaticFiles
+import os
 
-from services.images import UPLOADS_DIR, get_resized_uploaded_image, save_uploaded_image
+from fastapi import APIRouter, File, HTTPException, Request, UploadFile
+
+from services.image_cache import get_cache_stats, purge_orphans
+from services.images import (
+    CONTENT_ADDRESSED_RE,
+    IMMUTABLE_CACHE_CONTROL,
+    get_resized_uploaded_image,
+    save_uploaded_image,
+)
+from services.storage import get_storage
 
 
 router = APIRouter(tags=["uploads"])
-uploads_static = StaticFiles(directory=UPLOADS_DIR)
+
+# Serves /uploads/* from object storage. Only included when the storage backend
+# is not the local filesystem; local uploads are mounted as static files.
+originals_router = APIRouter(tags=["uploads"])
 
 
 @router.get("/api/image")
@@ -19,7 +30,7 @@ def get_resized_image(
     w: int = 0,
     h: int = 0,
     q: int = 80,
-    format: str = "jpg",
+    format: str = "auto",
 ):
     """Serve a resized/cached version of an uploaded image."""
     return get_resized_uploaded_image(request=request, src=src, w=w, h=h, q=q, format=format)
@@ -29,3 +40,28 @@ def get_resized_image(
 async def upload_image(file: UploadFile = File(...)):
     """Upload an image file and return its public URL."""
     return {"url": await save_uploaded_image(file)}
+
+
+@router.get("/api/admin/image-cache/stats")
+def get_image_cache_stats():
+    """Return resize cache size, entry count and hit ratio."""
+    return get_cache_stats()
+
+
+@router.post("/api/admin/image-cache/purge")
+def purge_image_cache():
+    """Drop cache entries whose source image or derivative file no longer exists."""
+    return purge_orphans()
+
+
+@originals_router.get("/uploads/{key:path}")
+def get_uploaded_file(key: str):
+    """Serve an original upload from the configured storage backend."""
+    if CONTENT_ADDRESSED_RE.match(os.path.basename(key)):
+        cache_control = IMMUTABLE_CACHE_CONTROL
+    else:
+        cache_control = "public, max-age=86400"
+    try:
+        return get_storage().response(key, headers={"Cache-Control": cache_control})
+    except (FileNotFoundError, ValueError):
+        raise HTTPException(status_code=404, detail="File not found")
@@ -2,10 +2,8 @@
 
 from __future__ import annotations
 
-import csv
 import logging
 import json
-from io import StringIO
 from typing import Optional
 
 from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException
@@ -20,11 +18,15 @@ from models.schemas import (
     UserResponse,
 )
 from services.auth import get_current_user_phone
+from services.exports import export_chunks, iter_query
+from services.json_response import FastJSONResponse
+from services.loyalty import delete_user_ledger, find_balance_mismatches, list_transactions, set_bonus_balance
 from services.notifications import send_expo_push
 from services.users import (
     calculate_cashback_percent,
     clean_warehouse_value,
     normalize_phone,
+    recalculate_all_cashback_percents,
 )
 
 
@@ -94,21 +96,11 @@ def recalculate_cashback():
     """Recalculate cashback_percent for all users based on total_spent."""
     conn = get_db_connection()
     try:
-        cur = conn.cursor()
-        users = cur.execute("SELECT phone, total_spent FROM users").fetchall()
-        updated_count = 0
-
-        for user in users:
-            phone = user["phone"]
-            total_spent = float(user["total_spent"] or 0)
-            cashback_percent = calculate_cashback_percent(total_spent)
-            cur.execute("UPDATE users SET cashback_percent=? WHERE phone=?", (cashback_percent, phone))
-            updated_count += 1
-            logger.info("Updated cashback percent: phone=%s total_spent=%s cashback_percent=%s", phone, total_spent, cashback_percent)
-
-        conn.commit()
+        updated_count = recalculate_all_cashback_percents(conn)
+        logger.info("Recalculated cashback percent: changed=%s", updated_count)
         return {
             "status": "ok",
+            "updated": updated_count,
             "message": f"Updated cashback_percent for {updated_count} users"
         }
     finally:
@@ -153,7 +145,7 @@ def get_users(
     sql = f"SELECT * FROM users {where_sql} {order_sql}"
     rows = cur.execute(sql, tuple(params) if params else ()).fetchall()
     conn.close()
-    return [dict(r) for r in rows]
+    return FastJSONResponse([dict(r) for r in rows])
 
 
 @router.get("/api/admin/users")
@@ -167,16 +159,32 @@ def get_admin_users(
     return get_users(search=search, has_bonuses=has_bonuses, sort_by=sort_by, source=source)
 
 
+def _export_user_row(row: dict) -> list:
+    total = row.get("total_spent") or 0
+    return [
+        row.get("phone") or "",
+        row.get("name") or "",
+        row.get("city") or "",
+        row.get("warehouse") or "",
+        row.get("user_ukrposhta") or "",
+        row.get("email") or "",
+        row.get("contact_preference") or "call",
+        row.get("bonus_balance") or 0,
+        total,
+        calculate_cashback_percent(float(total)),
+        row.get("created_at") or "",
+    ]
+
+
 @router.get("/api/users/export")
 def export_users(
     search: Optional[str] = None,
     has_bonuses: Optional[bool] = None,
     sort_by: Optional[str] = None,
     source: Optional[str] = None,
+    format: str = "csv",
 ):
-    """Экспорт списка клиентов в CSV с учётом фильтров search, has_bonuses, sort_by, source."""
-    conn = get_db_connection()
-    cur = conn.cursor()
+    """Экспорт клиентов (CSV или XLSX) потоком, с учётом фильтров search, has_bonuses, sort_by, source."""
     conditions = []
     params = []
     search_trimmed = (search or "").strip()
@@ -202,38 +210,20 @@ def export_users(
         order_field = sort_by.strip()
     order_sql = f"ORDER BY {order_field} NULLS LAST"
     sql = f"SELECT * FROM users {where_sql} {order_sql}"
-    rows = cur.execute(sql, tuple(params) if params else ()).fetchall()
-    conn.close()
-
-    output = StringIO()
-    output.write("\ufeff")  # BOM для UTF-8 в Excel
-    writer = csv.writer(output)
-    writer.writerow([
-        "Телефон", "Имя", "Город", "Отделение НП", "Укрпошта", "Email", "Способ связи",
-        "Баланс бонусов (₴)", "Всего потрачено (₴)", "Кешбэк %", "Дата регистрации"
-    ])
-    for r in rows:
-        row = dict(r)
-        total = row.get("total_spent") or 0
-        level = 20 if total > 25000 else 15 if total > 10000 else 10 if total > 5000 else 5 if total > 2000 else 0
-        writer.writerow([
-            row.get("phone") or "",
-            row.get("name") or "",
-            row.get("city") or "",
-            row.get("warehouse") or "",
-            row.get("user_ukrposhta") or "",
-            row.get("email") or "",
-            row.get("contact_preference") or "call",
-            row.get("bonus_balance") or 0,
-            total,
-            level,
-            row.get("created_at") or "",
-        ])
-    output.seek(0)
+    chunks, media_type, ext = export_chunks(
+        format,
+        [
+            "Телефон", "Имя", "Город", "Отделение НП", "Укрпошта", "Email", "Способ связи",
+            "Баланс бонусов (₴)", "Всего потрачено (₴)", "Кешбэк %", "Дата регистрации"
+        ],
+        iter_query(sql, params),
+        _export_user_row,
+        "Clients",
+    )
     return StreamingResponse(
-        iter([output.getvalue()]),
-        media_type="text/csv; charset=utf-8",
-        headers={"Content-Disposition": "attachment; filename=clients.csv"},
+        chunks,
+        media_type=media_type,
+        headers={"Content-Disposition": f"attachment; filename=clients.{ext}"},
     )
 
 
@@ -282,9 +272,6 @@ def update_user(phone: str, u: AdminUserUpdate):
         if u.contact_preference is not None:
             update_fields.append("contact_preference = ?")
             update_values.append(u.contact_preference)
-        if u.bonus_balance is not None:
-            update_fields.append("bonus_balance = ?")
-            update_values.append(u.bonus_balance)
         if u.total_spent is not None:
             update_fields.append("total_spent = ?")
             update_values.append(u.total_spent)
@@ -295,10 +282,14 @@ def update_user(phone: str, u: AdminUserUpdate):
                 f"UPDATE users SET {', '.join(update_fields)} WHERE phone = ?",
                 tuple(update_values),
             )
-            conn.commit()
+        # Баланс меняется только через журнал bonus_transactions
+        if u.bonus_balance is not None:
+            set_bonus_balance(cur, clean_phone, int(u.bonus_balance))
+        conn.commit()
 
         if new_phone:
             cur.execute("UPDATE users SET phone = ? WHERE phone = ?", (new_phone, clean_phone))
+            cur.execute("UPDATE bonus_transactions SET user_phone = ? WHERE user_phone = ?", (new_phone, clean_phone))
             conn.commit()
 
         return {"status": "ok"}
@@ -306,6 +297,21 @@ def update_user(phone: str, u: AdminUserUpdate):
         conn.close()
 
 
+@router.get("/api/admin/users/{phone}/bonus-transactions")
+def get_bonus_transactions(phone: str, limit: int = 50):
+    """Журнал бонусов клиента (последние записи первыми)."""
+    clean_phone = normalize_phone(phone)
+    if not clean_phone:
+        raise HTTPException(status_code=400, detail="Invalid phone")
+    return list_transactions(clean_phone, max(1, min(limit, 500)))
+
+
+@router.get("/api/admin/bonus-ledger/mismatches")
+def get_bonus_ledger_mismatches(limit: int = 100):
+    """Клиенты, у которых bonus_balance не совпадает с суммой журнала."""
+    return find_balance_mismatches(max(1, min(limit, 1000)))
+
+
 @router.delete("/api/admin/user/{phone}")
 def delete_admin_user(phone: str):
     """Удаление клиента из базы (админ)."""
@@ -321,6 +327,7 @@ def delete_admin_user(phone: str):
             raise HTTPException(status_code=404, detail="User not found")
 
         cur.execute("DELETE FROM users WHERE phone = ?", (clean_phone,))
+        delete_user_ledger(cur, [clean_phone])
         conn.commit()
         return {"status": "ok"}
     finally:
@@ -342,9 +349,10 @@ def delete_users_batch(batch: BatchDeleteUsers):
 
         placeholders = ",".join("?" for _ in cleaned)
         cur.execute(f"DELETE FROM users WHERE phone IN ({placeholders})", cleaned)
+        deleted_count = getattr(cur, "rowcount", len(cleaned))
+        delete_user_ledger(cur, cleaned)
         conn.commit()
 
-        deleted_count = getattr(cur, "rowcount", len(cleaned))
         return {"status": "ok", "deleted": deleted_count}
     finally:
         conn.close()
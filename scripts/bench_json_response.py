@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""Benchmark: FastAPI's default JSON path vs FastJSONResponse (orjson).
+
+Builds a synthetic /api/products page (1000 cards with variants, Decimal
+prices and datetimes, as psycopg2 returns them), checks both paths produce the
+same JSON and prints the time per page for each.
+
+Run inside docker app container:
+  python3 scripts/bench_json_response.py [--products 1000] [--rounds 20]
+"""
+
+import argparse
+import json
+import sys
+import time
+from datetime import datetime, timedelta
+from decimal import Decimal
+from pathlib import Path
+
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+if str(PROJECT_ROOT) not in sys.path:
+    sys.path.insert(0, str(PROJECT_ROOT))
+
+from fastapi.encoders import jsonable_encoder  # noqa: E402
+from fastapi.responses import JSONResponse  # noqa: E402
+
+from services.json_response import FastJSONResponse  # noqa: E402
+
+
+def _variant(pid: int, n: int) -> dict:
+    return {
+        "id": pid * 10 + n,
+        "sku": f"SKU-{pid}-{n}",
+        "name": f"{n * 50} г",
+        "price": float(100 + n * 35),
+        "old_price": None,
+        "status": "available",
+        "stock": 1,
+        "is_hit": n == 0,
+        "is_new": False,
+        "is_promotion": False,
+    }
+
+
+def build_page(products: int) -> dict:
+    created = datetime(2025, 1, 1, 12, 0, 0)
+    cards = []
+    for pid in range(1, products + 1):
+        cards.append({
+            "id": pid,
+            "name": f"Мухомор червоний сушений, партія {pid}",
+            "price": Decimal("249.90"),
+            "old_price": Decimal("299"),
+            "discount": 0,
+            "category": f"Категорія {pid % 12}",
+            "image": f"https://app.dikoros.ua/uploads/product_{pid}.jpg",
+            "images": ",".join(f"https://app.dikoros.ua/uploads/product_{pid}_{i}.jpg" for i in range(3)),
+            "description": "Опис товару. " * 20,
+            "usage": "Спосіб застосування. " * 5,
+            "composition": None,
+            "unit": "шт",
+            "sku": f"SKU-{pid}",
+            "parent_sku": f"PARENT-{pid}",
+            "status": "available",
+            "stock": 1,
+            "is_hit": pid % 7 == 0,
+            "is_new": pid % 11 == 0,
+            "is_promotion": False,
+            "created_at": created + timedelta(minutes=pid),
+            "average_rating": 4.6,
+            "review_count": pid % 40,
+            "variants": [_variant(pid, n) for n in range(3)],
+        })
+    return {"products": cards, "total_pages": 1, "current_page": 1, "categories": [f"Категорія {i}" for i in range(12)]}
+
+
+def default_path(content) -> bytes:
+    # What a route returning a dict goes through by default.
+    return JSONResponse(jsonable_encoder(content)).body
+
+
+def fast_path(content) -> bytes:
+    return FastJSONResponse(content).body
+
+
+def _time(fn, content, rounds: int) -> float:
+    fn(content)  # warm-up
+    started = time.perf_counter()
+    for _ in range(rounds):
+        fn(content)
+    return (time.perf_counter() - started) / rounds
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--products", type=int, default=1000)
+    parser.add_argument("--rounds", type=int, default=20)
+    args = parser.parse_args()
+
+    page = build_page(args.products)
+    default_body, fast_body = default_path(page), fast_path(page)
+    if json.loads(default_body) != json.loads(fast_body):
+        print("FAIL: FastJSONResponse output differs from the default encoder")
+        return 1
+
+    default_s = _time(default_path, page, args.rounds)
+    fast_s = _time(fast_path, page, args.rounds)
+    print(f"page: {args.products} products, {len(fast_body) / 1024:.0f} KiB")
+    print(f"jsonable_encoder + json.dumps: {default_s * 1000:8.2f} ms/page")
+    print(f"FastJSONResponse (orjson):     {fast_s * 1000:8.2f} ms/page")
+    print(f"speedup: x{default_s / fast_s:.1f}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
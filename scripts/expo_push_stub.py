@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""Stand-in for the Expo push API (send + getReceipts), for local testing.
+
+Implements the two endpoints used by services/notifications.py:
+  POST /--/api/v2/push/send         list of messages -> one ticket per message
+  POST /--/api/v2/push/getReceipts  {"ids": [...]}   -> receipts by ticket id
+
+Tokens containing "Unregistered" get a DeviceNotRegistered error on the ticket;
+tokens containing "LateUnregistered" get an ok ticket and a DeviceNotRegistered
+receipt. Requests with more than 100 messages are rejected like Expo does.
+
+Run and point the app at it:
+  python3 scripts/expo_push_stub.py --port 8765
+  EXPO_PUSH_URL=http://127.0.0.1:8765/--/api/v2/push/send
+  EXPO_RECEIPTS_URL=http://127.0.0.1:8765/--/api/v2/push/getReceipts
+"""
+
+import argparse
+import json
+import threading
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+MAX_MESSAGES_PER_REQUEST = 100
+
+
+class ExpoStubState:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.receipts = {}
+        self.send_requests = []
+
+    def reset(self):
+        with self.lock:
+            self.receipts.clear()
+            self.send_requests.clear()
+
+
+STATE = ExpoStubState()
+
+
+def _unregistered(message=""):
+    return {"status": "error", "message": message, "details": {"error": "DeviceNotRegistered"}}
+
+
+class ExpoStubHandler(BaseHTTPRequestHandler):
+    def _json(self, status: int, payload) -> None:
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        payload = json.loads(self.rfile.read(length) or b"null")
+
+        if self.path.endswith("/push/send"):
+            messages = payload if isinstance(payload, list) else [payload]
+            if len(messages) > MAX_MESSAGES_PER_REQUEST:
+                self._json(400, {"errors": [{"code": "PUSH_TOO_MANY_NOTIFICATIONS"}]})
+                return
+            tickets = []
+            with STATE.lock:
+                STATE.send_requests.append(len(messages))
+                for message in messages:
+                    token = str(message.get("to") or "")
+                    if "Unregistered" in token and "LateUnregistered" not in token:
+                        tickets.append(_unregistered(f"{token} is not a registered push notification recipient"))
+                        continue
+                    ticket_id = str(uuid.uuid4())
+                    STATE.receipts[ticket_id] = _unregistered() if "LateUnregistered" in token else {"status": "ok"}
+                    tickets.append({"status": "ok", "id": ticket_id})
+            self._json(200, {"data": tickets})
+            return
+
+        if self.path.endswith("/push/getReceipts"):
+            with STATE.lock:
+                data = {i: STATE.receipts[i] for i in payload.get("ids", []) if i in STATE.receipts}
+            self._json(200, {"data": data})
+            return
+
+        self._json(404, {"errors": [{"code": "NOT_FOUND"}]})
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_stub(port: int = 0) -> ThreadingHTTPServer:
+    """Start the stub in a daemon thread; returns the server (see server.server_port)."""
+    server = ThreadingHTTPServer(("127.0.0.1", port), ExpoStubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+    server = ThreadingHTTPServer(("0.0.0.0", args.port), ExpoStubHandler)
+    print(f"Expo push stub listening on :{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
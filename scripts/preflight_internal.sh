@@ -19,4 +19,18 @@ docker compose exec -T app python3 scripts/test_chat_sales_smoke.py
 
 docker compose exec -T app python3 scripts/test_chat_budget_form_smoke.py
 
+docker compose exec -T app python3 scripts/test_storage_smoke.py
+
+docker compose exec -T app python3 scripts/test_push_smoke.py
+
+docker compose exec -T app python3 scripts/test_index_plans_smoke.py
+
+docker compose exec -T app python3 scripts/test_catalog_sync_smoke.py
+
+docker compose exec -T app python3 scripts/test_metrics_smoke.py
+
+docker compose exec -T app python3 scripts/test_compression_smoke.py
+
+docker compose exec -T app python3 scripts/test_query_budget_smoke.py
+
 echo "== OK: preflight passed =="
\ No newline at end of file
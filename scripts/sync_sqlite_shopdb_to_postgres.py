@@ -1,4 +1,5 @@
 import argparse
+import json
 import os
 import sqlite3
 from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
@@ -10,7 +11,6 @@ from psycopg2.extras import RealDictCursor
 TEXT_COLUMNS = {
     "name",
     "image",
-    "images",
     "category",
     "pack_sizes",
     "unit",
@@ -18,13 +18,15 @@ TEXT_COLUMNS = {
     "usage",
     "delivery_info",
     "return_info",
-    "variants",
     "option_names",
     "external_id",
     "composition",
     "group_id",
 }
 
+# JSONB in Postgres (TEXT in SQLite): images is a JSON array of URLs, variants a JSON array.
+JSON_COLUMNS = {"images", "variants"}
+
 
 def _env(name: str, default: Optional[str] = None) -> Optional[str]:
     v = os.environ.get(name)
@@ -60,6 +62,27 @@ def _is_nonempty_text(v: Any) -> bool:
     return bool(s) and s not in {"null", "undefined"}
 
 
+def _json_array(v: Any) -> Optional[list]:
+    try:
+        parsed = json.loads(v) if isinstance(v, str) else v
+    except ValueError:
+        return None
+    return parsed if isinstance(parsed, list) else None
+
+
+def _jsonb_value(column: str, v: Any) -> Optional[str]:
+    """SQLite text -> JSON text for the JSONB columns (NULL when there is nothing usable)."""
+    if not _is_nonempty_text(v):
+        return None
+    if column == "images":
+        text = str(v).strip()
+        items = _json_array(text) if text.startswith("[") else text.split(",")
+        urls = [str(u).strip() for u in (items or []) if str(u or "").strip()]
+        return json.dumps(urls, ensure_ascii=False) if urls else None
+    items = _json_array(v)
+    return json.dumps(items, ensure_ascii=False) if items else None
+
+
 def main() -> int:
     ap = argparse.ArgumentParser(description="Sync SQLite shop.db into production Postgres (upsert by external_id).")
     ap.add_argument("--sqlite", default="/app/_incoming/shop.db", help="Path to uploaded SQLite shop.db")
@@ -108,7 +131,9 @@ def main() -> int:
     for c in target_cols:
         if c == "external_id":
             continue
-        if c in TEXT_COLUMNS:
+        if c in JSON_COLUMNS:
+            update_parts.append(f"{c} = COALESCE(excluded.{c}, products.{c})")
+        elif c in TEXT_COLUMNS:
             update_parts.append(
                 f"{c} = CASE WHEN excluded.{c} IS NULL OR excluded.{c} = '' THEN products.{c} ELSE excluded.{c} END"
             )
@@ -128,7 +153,7 @@ def main() -> int:
         ext = prod.get("external_id")
         if not _is_nonempty_text(ext):
             continue
-        rows.append(tuple(prod.get(c) for c in target_cols))
+        rows.append(tuple(_jsonb_value(c, prod.get(c)) if c in JSON_COLUMNS else prod.get(c) for c in target_cols))
 
     print(f"SQLite file: {sqlite_path}")
     print(f"SQLite products rows: {total}")
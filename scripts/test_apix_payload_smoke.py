@@ -8,7 +8,6 @@ Run inside docker app container:
   python3 scripts/test_apix_payload_smoke.py
 """
 
-import json
 import os
 import random
 import string
@@ -23,6 +22,8 @@ PROJECT_ROOT = Path(__file__).resolve().parents[1]
 if str(PROJECT_ROOT) not in sys.path:
     sys.path.insert(0, str(PROJECT_ROOT))
 
+from services.json_columns import variant_list  # noqa: E402
+
 
 def _dsn() -> str:
     return os.getenv("DATABASE_URL") or "postgresql://postgres:postgres@db:5432/app_db"
@@ -42,7 +43,7 @@ def _rand_phone() -> str:
 
 def _pick_product_with_variants() -> Optional[Dict[str, Any]]:
     needles = ["порош", "ціл", "мелен", "пудра", "капсул", "capsul", "форма"]
-    where = " OR ".join(["variants ILIKE %s" for _ in needles])
+    where = " OR ".join(["variants::text ILIKE %s" for _ in needles])
     params = [f"%{n}%" for n in needles]
 
     with _connect() as conn, conn.cursor() as cur:
@@ -50,7 +51,7 @@ def _pick_product_with_variants() -> Optional[Dict[str, Any]]:
             f"""
             SELECT id, name, unit, price, variants
             FROM products
-            WHERE variants IS NOT NULL AND length(btrim(variants)) > 2
+            WHERE variants IS NOT NULL AND jsonb_array_length(variants) > 0
               AND ({where})
             ORDER BY id
             LIMIT 50
@@ -60,10 +61,7 @@ def _pick_product_with_variants() -> Optional[Dict[str, Any]]:
         rows = cur.fetchall()
 
     for r in rows:
-        try:
-            variants = json.loads(r.get("variants") or "[]")
-        except Exception:
-            continue
+        variants = variant_list(r.get("variants"))
         if isinstance(variants, list) and variants:
             r["_variants"] = variants
             return r
@@ -74,7 +72,7 @@ def _pick_product_with_variants() -> Optional[Dict[str, Any]]:
             """
             SELECT id, name, unit, price, variants
             FROM products
-            WHERE variants IS NOT NULL AND length(btrim(variants)) > 2
+            WHERE variants IS NOT NULL AND jsonb_array_length(variants) > 0
             ORDER BY id
             LIMIT 50
             """
@@ -82,10 +80,7 @@ def _pick_product_with_variants() -> Optional[Dict[str, Any]]:
         rows2 = cur.fetchall()
 
     for r in rows2:
-        try:
-            variants = json.loads(r.get("variants") or "[]")
-        except Exception:
-            continue
+        variants = variant_list(r.get("variants"))
         if isinstance(variants, list) and variants:
             r["_variants"] = variants
             return r
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""Smoke test for catalog delta sync: version triggers, tombstones and resets.
+
+Applies migrations, then inside one transaction inserts, updates and deletes
+catalog rows and checks what ``changes_since`` reports for them: versions
+move on effective writes only, deletes come back as tombstones, a category
+banner re-versions its category, and the reset answer is given for unknown
+versions, too many changes and truncated tables. The transaction is rolled
+back, nothing is left in the database.
+
+Run inside docker app container:
+  python3 scripts/test_catalog_sync_smoke.py
+"""
+
+import sys
+from pathlib import Path
+
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+if str(PROJECT_ROOT) not in sys.path:
+    sys.path.insert(0, str(PROJECT_ROOT))
+
+from db import get_db_connection  # noqa: E402
+from services import catalog_sync  # noqa: E402
+from services.catalog_sync import catalog_version, changes_since  # noqa: E402
+from services.db_schema import fix_db_schema  # noqa: E402
+
+EXPECTED_TRIGGERS = {
+    "products_catalog_lock",
+    "products_catalog_touch",
+    "products_catalog_tombstone",
+    "products_catalog_truncate",
+    "categories_catalog_lock",
+    "categories_catalog_touch",
+    "categories_catalog_tombstone",
+    "banners_catalog_lock",
+    "banners_catalog_touch",
+    "banners_catalog_tombstone",
+    "category_banners_catalog_lock",
+    "category_banners_catalog_touch",
+}
+
+
+def _product_version(cur, product_id: int) -> int:
+    return cur.execute("SELECT catalog_version FROM products WHERE id = ?", (product_id,)).fetchone()["catalog_version"]
+
+
+def _check_triggers(cur) -> None:
+    rows = cur.execute(
+        "SELECT tgname FROM pg_trigger WHERE NOT tgisinternal AND tgname = ANY(?)",
+        (sorted(EXPECTED_TRIGGERS),),
+    ).fetchall()
+    missing = EXPECTED_TRIGGERS - {row["tgname"] for row in rows}
+    assert not missing, f"missing catalog triggers: {sorted(missing)}"
+
+
+def _check_versions(conn, cur) -> None:
+    start = catalog_version(conn)
+    product_id = cur.execute(
+        "INSERT INTO products (name, price, sku) VALUES ('Smoke catalog', 100, 'SMOKE-CATALOG-1') RETURNING id"
+    ).fetchone()["id"]
+    inserted = _product_version(cur, product_id)
+    assert inserted > start, "insert must take a new catalog version"
+    assert catalog_version(conn) == inserted, "current version must be the latest write"
+
+    changes = changes_since(conn, start)
+    assert not changes["reset"], changes
+    assert [p["id"] for p in changes["products"]] == [product_id], changes["products"]
+    assert changes["products"][0]["group_key"] == "SMOKE-CATALOG-1"
+
+    cur.execute("UPDATE products SET name = name WHERE id = ?", (product_id,))
+    assert _product_version(cur, product_id) == inserted, "a no-op update must keep the version"
+    cur.execute("UPDATE products SET price = 120 WHERE id = ?", (product_id,))
+    updated = _product_version(cur, product_id)
+    assert updated > inserted, "an effective update must take a new version"
+    assert changes_since(conn, updated)["products"] == [], "nothing changed after the latest version"
+
+    category_id = cur.execute(
+        "INSERT INTO categories (name) VALUES ('Smoke catalog category') RETURNING id"
+    ).fetchone()["id"]
+    before_banner = catalog_version(conn)
+    cur.execute("INSERT INTO category_banners (category_id, image_url) VALUES (?, 'smoke-catalog.jpg')", (category_id,))
+    categories = changes_since(conn, before_banner)["categories"]
+    assert [c["id"] for c in categories] == [category_id], "a category banner must re-version its category"
+    assert categories[0]["banners"] == ["smoke-catalog.jpg"], categories
+
+    before_delete = catalog_version(conn)
+    cur.execute("DELETE FROM products WHERE id = ?", (product_id,))
+    changes = changes_since(conn, before_delete)
+    assert not changes["reset"], changes
+    assert changes["deleted"]["products"] == [product_id], changes["deleted"]
+    assert changes_since(conn, start)["products"] == [], "a deleted row must not be served as changed"
+    print("ok  versions, no-op updates, category banners and tombstones")
+
+
+def _check_resets(conn, cur) -> None:
+    version = catalog_version(conn)
+    assert changes_since(conn, version + 1000)["reset"], "an unknown (future) version must reset"
+    assert changes_since(conn, -1)["reset"], "a negative version must reset"
+
+    start = version
+    cur.execute(
+        """
+        INSERT INTO banners (image_url)
+        SELECT 'smoke-reset-' || g || '.jpg' FROM generate_series(1, 3) AS g
+        """
+    )
+    saved_max = catalog_sync.CATALOG_CHANGES_MAX
+    catalog_sync.CATALOG_CHANGES_MAX = 2
+    try:
+        assert changes_since(conn, start)["reset"], "more than CATALOG_CHANGES_MAX changed rows (banners) must reset"
+    finally:
+        catalog_sync.CATALOG_CHANGES_MAX = saved_max
+    assert len(changes_since(conn, start)["banners"]) == 3
+
+    # What the TRUNCATE trigger writes; the table itself is left alone.
+    cur.execute(
+        "INSERT INTO catalog_tombstones (entity, entity_id, catalog_version) VALUES ('products', NULL, nextval('catalog_version_seq'))"
+    )
+    assert changes_since(conn, start)["reset"], "a truncate tombstone must reset"
+    print("ok  reset on unknown version, too many changes and truncate")
+
+
+def main() -> int:
+    fix_db_schema()
+    conn = get_db_connection()
+    try:
+        cur = conn.cursor()
+        _check_triggers(cur)
+        _check_versions(conn, cur)
+        _check_resets(conn, cur)
+    finally:
+        conn.rollback()
+        conn.close()
+    print("OK: catalog delta sync")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+"""Smoke test for the response compression middleware.
+
+Drives CompressionMiddleware with minimal ASGI apps and checks Accept-Encoding
+negotiation (q-values, server preference on ties), the min-size and
+content-type bypasses, chunk-by-chunk compression of streaming responses,
+the compressed-body cache for catalog GETs and the Vary header. gzip is
+always checked; br and zstd are round-tripped when their packages are
+installed.
+
+Run inside docker app container:
+  python3 scripts/test_compression_smoke.py
+"""
+
+import asyncio
+import gzip
+import json
+import sys
+from pathlib import Path
+
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+if str(PROJECT_ROOT) not in sys.path:
+    sys.path.insert(0, str(PROJECT_ROOT))
+
+from services.compression import (  # noqa: E402
+    CompressionMiddleware,
+    available_encodings,
+    brotli,
+    choose_encoding,
+    zstandard,
+)
+
+ALL_ENCODINGS = ("zstd", "br", "gzip")
+PAYLOAD = json.dumps([{"id": i, "name": f"Мухомор {i}", "price": 249.9} for i in range(300)]).encode("utf-8")
+
+
+def _app(body: bytes, content_type: str = "application/json", chunks: int = 1, headers=()):
+    async def app(scope, receive, send):
+        raw = [(b"content-type", content_type.encode("latin-1"))] + [(k.lower().encode(), v.encode()) for k, v in headers]
+        if chunks == 1:
+            raw.append((b"content-length", str(len(body)).encode()))
+        await send({"type": "http.response.start", "status": 200, "headers": raw})
+        size = -(-len(body) // chunks)
+        for index in range(chunks):
+            part = body[index * size:(index + 1) * size]
+            await send({"type": "http.response.body", "body": part, "more_body": index < chunks - 1})
+
+    return app
+
+
+def _call(middleware, path: str = "/api/orders", accept: str = "gzip", method: str = "GET"):
+    messages = []
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        messages.append(message)
+
+    scope = {
+        "type": "http",
+        "method": method,
+        "path": path,
+        "headers": [(b"accept-encoding", accept.encode())] if accept else [],
+    }
+    asyncio.run(middleware(scope, receive, send))
+    start = messages[0]
+    headers = {k.decode().lower(): v.decode() for k, v in start["headers"]}
+    bodies = [m for m in messages[1:] if m["type"] == "http.response.body"]
+    return headers, bodies, b"".join(m.get("body", b"") for m in bodies)
+
+
+def _decode(encoding: str, data: bytes) -> bytes:
+    if encoding == "gzip":
+        return gzip.decompress(data)
+    if encoding == "br":
+        return brotli.decompress(data)
+    return zstandard.ZstdDecompressor().decompressobj().decompress(data)
+
+
+def check_negotiation() -> None:
+    assert choose_encoding("gzip, br, zstd", ALL_ENCODINGS) == "zstd", "ties go to the server preference"
+    assert choose_encoding("gzip;q=0.5, br;q=0.8", ALL_ENCODINGS) == "br"
+    assert choose_encoding("gzip;q=1.0, br;q=0.8", ALL_ENCODINGS) == "gzip"
+    assert choose_encoding("br;q=0, gzip", ALL_ENCODINGS) == "gzip", "q=0 means not acceptable"
+    assert choose_encoding("*;q=0.1, gzip;q=0", ALL_ENCODINGS) == "zstd", "wildcard covers unnamed encodings"
+    assert choose_encoding("gzip;q=bogus, br", ALL_ENCODINGS) == "br", "a malformed q-value counts as 0"
+    assert choose_encoding("identity", ALL_ENCODINGS) is None
+    assert choose_encoding("", ALL_ENCODINGS) is None
+    assert choose_encoding("br, zstd", ("gzip",)) is None, "only installed encodings are offered"
+    print("ok  Accept-Encoding negotiation")
+
+
+def check_bypasses() -> None:
+    middleware = CompressionMiddleware(_app(b'{"ok": true}'), minimum_size=1024, cache_entries=0)
+    headers, _, body = _call(middleware)
+    assert "content-encoding" not in headers and body == b'{"ok": true}', "bodies below the minimum go out as they are"
+
+    middleware = CompressionMiddleware(_app(PAYLOAD, content_type="image/png"), minimum_size=1024, cache_entries=0)
+    headers, _, body = _call(middleware)
+    assert "content-encoding" not in headers and body == PAYLOAD, "non-text types are not compressed"
+
+    middleware = CompressionMiddleware(_app(PAYLOAD, headers=[("Content-Encoding", "gzip")]), minimum_size=1024, cache_entries=0)
+    headers, _, body = _call(middleware)
+    assert headers["content-encoding"] == "gzip" and body == PAYLOAD, "already-encoded bodies are not re-encoded"
+
+    middleware = CompressionMiddleware(_app(PAYLOAD), minimum_size=1024, cache_entries=0)
+    headers, _, body = _call(middleware, accept="")
+    assert "content-encoding" not in headers and body == PAYLOAD, "no Accept-Encoding, no compression"
+    print("ok  min-size, content-type, encoded and identity bypasses")
+
+
+def check_round_trips() -> None:
+    for encoding in available_encodings():
+        middleware = CompressionMiddleware(_app(PAYLOAD), minimum_size=1024, cache_entries=0)
+        headers, _, body = _call(middleware, accept=encoding)
+        assert headers["content-encoding"] == encoding, headers
+        assert int(headers["content-length"]) == len(body) < len(PAYLOAD)
+        assert _decode(encoding, body) == PAYLOAD, f"{encoding}: round trip failed"
+    print(f"ok  round trips: {', '.join(available_encodings())}")
+
+
+def check_streaming() -> None:
+    middleware = CompressionMiddleware(_app(PAYLOAD, content_type="text/csv", chunks=4), minimum_size=1024, cache_entries=0)
+    headers, bodies, body = _call(middleware)
+    assert headers["content-encoding"] == "gzip"
+    assert "content-length" not in headers, "streamed responses have no Content-Length"
+    assert len(bodies) == 4, f"every chunk is forwarded as it comes: {len(bodies)} messages"
+    assert [m["more_body"] for m in bodies] == [True, True, True, False]
+    assert gzip.decompress(body) == PAYLOAD
+    print("ok  streaming chunks")
+
+
+def check_cache() -> None:
+    middleware = CompressionMiddleware(_app(PAYLOAD), minimum_size=1024, cache_paths=("/api/products",), cache_entries=4)
+    first = _call(middleware, path="/api/products")[2]
+    second = _call(middleware, path="/api/products")[2]
+    assert first == second and gzip.decompress(second) == PAYLOAD
+    assert (middleware.cache.misses, middleware.cache.hits) == (1, 1), "the second hit must come from the cache"
+
+    _call(middleware, path="/api/products", method="POST")
+    _call(middleware, path="/api/orders")
+    assert (middleware.cache.misses, middleware.cache.hits) == (1, 1), "only GETs of cache paths use the cache"
+
+    if "br" in available_encodings():
+        _call(middleware, path="/api/products", accept="br")
+        assert middleware.cache.misses == 2, "entries are keyed by encoding"
+    print("ok  compressed-body cache")
+
+
+def check_vary() -> None:
+    middleware = CompressionMiddleware(_app(PAYLOAD), minimum_size=1024, cache_entries=0)
+    headers = _call(middleware)[0]
+    assert headers["vary"] == "Accept-Encoding", headers
+
+    middleware = CompressionMiddleware(_app(PAYLOAD, headers=[("Vary", "Origin")]), minimum_size=1024, cache_entries=0)
+    headers = _call(middleware)[0]
+    assert headers["vary"] == "Origin, Accept-Encoding", "an existing Vary is extended, not replaced"
+    print("ok  Vary")
+
+
+def main() -> int:
+    check_negotiation()
+    check_bypasses()
+    check_round_trips()
+    check_streaming()
+    check_cache()
+    check_vary()
+    print("OK: response compression")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
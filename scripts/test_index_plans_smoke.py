@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""Query-plan regression test for hot router lookups.
+
+Applies migrations, seeds products/orders/reviews/category banners inside one
+transaction, runs EXPLAIN for each query as the routers issue it and checks the
+plan reads the expected index. Sequential scans are disabled for the session,
+so the check is "the index exists and matches the query", independent of table
+size. The transaction is rolled back, nothing is left in the database.
+
+Run inside docker app container:
+  python3 scripts/test_index_plans_smoke.py
+"""
+
+import sys
+from pathlib import Path
+
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+if str(PROJECT_ROOT) not in sys.path:
+    sys.path.insert(0, str(PROJECT_ROOT))
+
+from db import get_db_connection  # noqa: E402
+from services.db_schema import fix_db_schema  # noqa: E402
+from services.products import PRODUCT_GROUP_KEY_SQL  # noqa: E402
+
+SEED_ROWS = 2000
+
+# (label, SQL as issued by the router, params, index the plan must use)
+PLAN_CASES = [
+    ("sync: product by sku", "SELECT id FROM products WHERE sku = ?", ("SMOKE-SKU-10",), "idx_products_sku"),
+    (
+        "products: variants of page groups",
+        f"SELECT * FROM products WHERE {PRODUCT_GROUP_KEY_SQL} IN (?, ?) ORDER BY id DESC",
+        ("SMOKE-PARENT-1", "SMOKE-PARENT-2"),
+        "idx_products_group_key",
+    ),
+    ("products: category filter", "SELECT id FROM products WHERE category = ?", ("Smoke category 3",), "idx_products_category"),
+    (
+        "orders: client orders",
+        "SELECT * FROM orders WHERE user_phone=? OR phone=? ORDER BY id DESC",
+        ("380000000007", "380000000007"),
+        ("idx_orders_user_phone_id", "idx_orders_phone_id"),
+    ),
+    (
+        "orders: admin list by status",
+        "SELECT id FROM orders WHERE status = ? ORDER BY id DESC LIMIT 51",
+        ("Smoke status 1",),
+        "idx_orders_status_id",
+    ),
+    (
+        "reviews: product review page",
+        "SELECT id, rating FROM reviews WHERE product_id = ? AND id < ? ORDER BY id DESC LIMIT ?",
+        (7, 10**9, 51),
+        "idx_reviews_product_id_id",
+    ),
+    (
+        "reviews: user reviews",
+        "SELECT * FROM reviews r WHERE r.user_phone=? ORDER BY r.created_at DESC",
+        ("380000000007",),
+        "idx_reviews_user_phone_created",
+    ),
+    (
+        "categories: banners of category",
+        "SELECT image_url FROM category_banners WHERE category_id = ?",
+        (1,),
+        "idx_category_banners_category_id",
+    ),
+]
+
+
+def _seed(cur) -> None:
+    cur.execute(
+        """
+        INSERT INTO products (name, price, category, sku, parent_sku)
+        SELECT 'Smoke ' || g, 100, 'Smoke category ' || (g % 10), 'SMOKE-SKU-' || g,
+               CASE WHEN g % 3 = 0 THEN 'SMOKE-PARENT-' || (g % 50) ELSE NULL END
+        FROM generate_series(1, ?) AS g
+        """,
+        (SEED_ROWS,),
+    )
+    cur.execute(
+        """
+        INSERT INTO orders (name, phone, user_phone, items, total_price, status, date)
+        SELECT 'Smoke', '3800000000' || lpad((g % 100)::text, 2, '0'), '3800000000' || lpad((g % 100)::text, 2, '0'),
+               '[]', 100, 'Smoke status ' || (g % 5), '2025-01-01 00:00:00'
+        FROM generate_series(1, ?) AS g
+        """,
+        (SEED_ROWS,),
+    )
+    cur.execute(
+        """
+        INSERT INTO reviews (product_id, user_name, user_phone, rating, comment, created_at)
+        SELECT g % 200, 'Smoke', '3800000000' || lpad((g % 100)::text, 2, '0'), 5, 'ok', '2025-01-01'
+        FROM generate_series(1, ?) AS g
+        """,
+        (SEED_ROWS,),
+    )
+    cur.execute("INSERT INTO categories (name) VALUES ('Smoke plan category') ON CONFLICT (name) DO NOTHING")
+    cur.execute(
+        """
+        INSERT INTO category_banners (category_id, image_url)
+        SELECT (SELECT id FROM categories WHERE name = 'Smoke plan category'), 'smoke-' || g || '.jpg'
+        FROM generate_series(1, 50) AS g
+        """
+    )
+    for table in ("products", "orders", "reviews", "category_banners"):
+        cur.execute(f"ANALYZE {table}")
+
+
+def _index_names(plan: dict) -> set:
+    names = set()
+    if plan.get("Index Name"):
+        names.add(plan["Index Name"])
+    for child in plan.get("Plans") or []:
+        names |= _index_names(child)
+    return names
+
+
+def main() -> int:
+    fix_db_schema()
+    conn = get_db_connection()
+    failures = []
+    try:
+        cur = conn.cursor()
+        _seed(cur)
+        cur.execute("SET LOCAL enable_seqscan = off")
+        for label, sql, params, expected in PLAN_CASES:
+            row = cur.execute(f"EXPLAIN (FORMAT JSON) {sql}", params).fetchone()
+            plan = row["QUERY PLAN"][0]["Plan"]
+            used = _index_names(plan)
+            wanted = {expected} if isinstance(expected, str) else set(expected)
+            if not wanted & used:
+                failures.append(f"{label}: expected {sorted(wanted)}, plan used {sorted(used) or 'no index'}")
+            else:
+                print(f"ok  {label}: {sorted(wanted & used)}")
+    finally:
+        conn.rollback()
+        conn.close()
+
+    if failures:
+        for failure in failures:
+            print("FAIL", failure)
+        return 1
+    print("OK: hot-path queries use their indexes")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
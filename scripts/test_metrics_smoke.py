@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""Smoke test for request/DB metrics and their Prometheus exposition.
+
+Drives MetricsMiddleware with a minimal ASGI app that "matches" a route
+template and reports SQL statements, then checks the rendered /metrics text:
+route labels use the template, the per-request query count is recorded, the
+in-flight gauge returns to zero and histogram buckets are cumulative.
+Statements issued after the response is sent (background tasks) are not
+counted against the request.
+
+Run inside docker app container:
+  python3 scripts/test_metrics_smoke.py
+"""
+
+import asyncio
+import re
+import sys
+from pathlib import Path
+
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+if str(PROJECT_ROOT) not in sys.path:
+    sys.path.insert(0, str(PROJECT_ROOT))
+
+from services.metrics import (  # noqa: E402
+    METRICS_TOKEN,
+    MetricsMiddleware,
+    metrics_authorized,
+    observe_query,
+    observe_upstream,
+    render_metrics,
+)
+
+
+class _Route:
+    path = "/api/orders/{order_id}"
+
+
+async def _app(scope, receive, send):
+    # What the router leaves in the scope for a matched route.
+    scope["route"] = _Route()
+    for _ in range(3):
+        observe_query("SELECT * FROM orders WHERE id = ?", 0.002)
+    observe_query("UPDATE orders SET status = ? WHERE id = ?", 0.004)
+    await send({"type": "http.response.start", "status": 200, "headers": []})
+    await send({"type": "http.response.body", "body": b"{}"})
+    # BackgroundTasks run here, after the client has the response.
+    observe_query("DELETE FROM push_tokens WHERE token = ?", 0.003)
+
+
+async def _failing_app(scope, receive, send):
+    raise RuntimeError("boom")
+
+
+async def _run(app, path: str) -> None:
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        return None
+
+    scope = {"type": "http", "method": "GET", "path": path, "headers": []}
+    await MetricsMiddleware(app)(scope, receive, send)
+
+
+def _sample(text: str, line_prefix: str) -> float:
+    match = re.search(rf"^{re.escape(line_prefix)} (\S+)$", text, re.MULTILINE)
+    assert match, f"missing sample: {line_prefix}\n{text}"
+    return float(match.group(1))
+
+
+def main() -> int:
+    asyncio.run(_run(_app, "/api/orders/42"))
+    asyncio.run(_run(_app, "/api/orders/43"))
+    try:
+        asyncio.run(_run(_failing_app, "/nowhere"))
+    except RuntimeError:
+        pass
+    else:
+        raise AssertionError("middleware must re-raise application errors")
+    observe_upstream("monobank", 0.12, 200)
+    observe_upstream("monobank", 5.0, None)
+
+    text = render_metrics()
+    route = 'method="GET",route="/api/orders/{order_id}"'
+    assert _sample(text, f'http_requests_total{{{route},status="200"}}') == 2
+    assert _sample(text, 'http_requests_total{method="GET",route="unmatched",status="500"}') == 1
+    assert _sample(text, f"http_request_duration_seconds_count{{{route}}}") == 2
+    assert _sample(text, f"http_request_db_queries_sum{{{route}}}") == 8, "4 queries per request; the background DELETE is not counted"
+    assert _sample(text, f'http_request_db_queries_bucket{{{route},le="2"}}') == 0
+    assert _sample(text, f'http_request_db_queries_bucket{{{route},le="5"}}') == 2
+    assert _sample(text, "http_requests_in_progress") == 0
+    assert _sample(text, 'db_query_duration_seconds_count{operation="select"}') == 6
+    assert _sample(text, 'db_query_duration_seconds_count{operation="update"}') == 2
+    assert _sample(text, 'db_query_duration_seconds_count{operation="delete"}') == 2, "background statements are still timed"
+    assert _sample(text, 'http_client_request_duration_seconds_count{upstream="monobank",status="2xx"}') == 1
+    assert _sample(text, 'http_client_request_duration_seconds_count{upstream="monobank",status="error"}') == 1
+    assert "# TYPE http_request_duration_seconds histogram" in text
+
+    buckets = [
+        float(value)
+        for value in re.findall(rf'^http_request_duration_seconds_bucket\{{{re.escape(route)},le="[^"]+"\}} (\S+)$', text, re.MULTILINE)
+    ]
+    assert buckets and buckets == sorted(buckets) and buckets[-1] == 2, f"buckets must be cumulative: {buckets}"
+
+    if METRICS_TOKEN:
+        assert metrics_authorized(f"Bearer {METRICS_TOKEN}") and not metrics_authorized("Bearer wrong")
+    else:
+        assert not metrics_authorized(None) and not metrics_authorized("Bearer "), "no token configured: /metrics is closed"
+
+    print("OK: metrics middleware and exposition")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -10,7 +10,6 @@ Usage (inside docker app container):
 """
 
 import asyncio
-import json
 import os
 import random
 import string
@@ -27,6 +26,8 @@ PROJECT_ROOT = Path(__file__).resolve().parents[1]
 if str(PROJECT_ROOT) not in sys.path:
     sys.path.insert(0, str(PROJECT_ROOT))
 
+from services.json_columns import variant_list  # noqa: E402
+
 
 def _dsn() -> str:
     return os.getenv("DATABASE_URL") or "postgresql://postgres:postgres@db:5432/app_db"
@@ -43,7 +44,7 @@ def _clean(v: Any) -> str:
 def _pick_product_with_variants() -> Optional[Dict[str, Any]]:
     """Find a product that likely has non-numeric variant labels (powder/whole/etc)."""
     needles = ["порош", "ціл", "мелен", "пудра", "capsul", "капсул", "форма"]
-    where = " OR ".join(["variants ILIKE %s" for _ in needles])
+    where = " OR ".join(["variants::text ILIKE %s" for _ in needles])
     params = [f"%{n}%" for n in needles]
 
     with _connect() as conn, conn.cursor() as cur:
@@ -51,7 +52,7 @@ def _pick_product_with_variants() -> Optional[Dict[str, Any]]:
             f"""
             SELECT id, name, unit, price, variants, option_names
             FROM products
-            WHERE variants IS NOT NULL AND length(btrim(variants)) > 2
+            WHERE variants IS NOT NULL AND jsonb_array_length(variants) > 0
               AND ({where})
             ORDER BY id
             LIMIT 50
@@ -61,10 +62,7 @@ def _pick_product_with_variants() -> Optional[Dict[str, Any]]:
         rows = cur.fetchall()
 
     for r in rows:
-        try:
-            variants = json.loads(r.get("variants") or "[]")
-        except Exception:
-            continue
+        variants = variant_list(r.get("variants"))
         if not isinstance(variants, list) or not variants:
             continue
         # ensure at least one variant has a non-numeric-ish label
@@ -80,7 +78,7 @@ def _pick_product_with_variants() -> Optional[Dict[str, Any]]:
             """
             SELECT id, name, unit, price, variants, option_names
             FROM products
-            WHERE variants IS NOT NULL AND length(btrim(variants)) > 2
+            WHERE variants IS NOT NULL AND jsonb_array_length(variants) > 0
             ORDER BY id
             LIMIT 50
             """
@@ -88,10 +86,7 @@ def _pick_product_with_variants() -> Optional[Dict[str, Any]]:
         rows2 = cur.fetchall()
 
     for r in rows2:
-        try:
-            variants = json.loads(r.get("variants") or "[]")
-        except Exception:
-            continue
+        variants = variant_list(r.get("variants"))
         if isinstance(variants, list) and variants:
             r["_variants"] = variants
             return r
@@ -212,12 +207,7 @@ async def _run() -> int:
     with _connect() as conn, conn.cursor() as cur:
         cur.execute("SELECT items FROM orders WHERE id=%s", (int(oid),))
         row = cur.fetchone() or {}
-        raw = row.get("items") or "[]"
-
-    try:
-        stored = json.loads(raw)
-    except Exception as e:
-        raise SystemExit(f"FAIL: could not parse stored items JSON: {e}")
+        stored = row.get("items")  # JSONB, decoded by psycopg2
 
     if not isinstance(stored, list) or len(stored) != 3:
         raise SystemExit(f"FAIL: expected 3 stored items, got {type(stored)} len={len(stored) if isinstance(stored, list) else 'n/a'}")
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""Smoke test for batched Expo push delivery and receipt processing.
+
+Starts scripts/expo_push_stub.py in-process and points EXPO_PUSH_URL /
+EXPO_RECEIPTS_URL at it, so nothing is sent to Expo. Creates two temporary
+users whose tokens the stub reports as DeviceNotRegistered (one on the ticket,
+one on the receipt) and checks both are pruned. Temporary rows are removed.
+
+Run inside docker app container:
+  python3 scripts/test_push_smoke.py
+"""
+
+import asyncio
+import os
+import sys
+import uuid
+from pathlib import Path
+
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+if str(PROJECT_ROOT) not in sys.path:
+    sys.path.insert(0, str(PROJECT_ROOT))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from expo_push_stub import STATE, start_stub  # noqa: E402
+
+_server = start_stub()
+_base = f"http://127.0.0.1:{_server.server_port}/--/api/v2/push"
+os.environ["EXPO_PUSH_URL"] = f"{_base}/send"
+os.environ["EXPO_RECEIPTS_URL"] = f"{_base}/getReceipts"
+os.environ["EXPO_RECEIPT_DELAY_SECONDS"] = "0"
+
+from db import get_db_connection  # noqa: E402
+from services.db_schema import fix_db_schema  # noqa: E402
+from services import notifications  # noqa: E402
+from services.http_clients import close_http_clients  # noqa: E402
+
+
+def _token(label: str) -> str:
+    return f"ExponentPushToken[{label}-{uuid.uuid4().hex[:12]}]"
+
+
+async def _run(phones, early_token, late_token) -> None:
+    messages = [notifications.build_message(_token("Smoke"), "Smoke", f"#{i}") for i in range(248)]
+    messages.append(notifications.build_message(early_token, "Smoke", "early"))
+    messages.append(notifications.build_message(late_token, "Smoke", "late"))
+
+    result = await notifications.send_push_messages(messages)
+    assert sorted(STATE.send_requests) == [50, 100, 100], f"unexpected batching: {STATE.send_requests}"
+    assert result == {"sent": 249, "failed": 1, "unregistered": 1}, result
+
+    receipts = await notifications.process_push_receipts()
+    assert receipts["checked"] >= 249, receipts
+    assert receipts["unregistered"] == 1, receipts
+
+    conn = get_db_connection()
+    try:
+        rows = conn.execute("SELECT phone, push_token FROM users WHERE phone = ANY(?)", (phones,)).fetchall()
+    finally:
+        conn.close()
+    assert rows and all(row["push_token"] is None for row in rows), f"tokens not pruned: {rows}"
+    await close_http_clients()
+
+
+def main() -> int:
+    fix_db_schema()
+    phones = [f"smoke-push-{uuid.uuid4().hex[:8]}" for _ in range(2)]
+    early_token, late_token = _token("Unregistered"), _token("LateUnregistered")
+
+    conn = get_db_connection()
+    try:
+        for phone, token in zip(phones, (early_token, late_token)):
+            conn.execute("INSERT INTO users (phone, push_token) VALUES (?, ?)", (phone, token))
+        conn.commit()
+    finally:
+        conn.close()
+
+    try:
+        asyncio.run(_run(phones, early_token, late_token))
+    finally:
+        conn = get_db_connection()
+        try:
+            conn.execute("DELETE FROM users WHERE phone = ANY(?)", (phones,))
+            conn.commit()
+        finally:
+            conn.close()
+        _server.shutdown()
+
+    print("OK: push batching, ticket/receipt pruning")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
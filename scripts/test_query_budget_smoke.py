@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""Smoke test for the N+1 detector and per-route query budgets.
+
+Checks SQL fingerprinting, then drives MetricsMiddleware with ASGI apps that
+issue statements the way db.PGCursorAdapter does (budget check, then timing):
+a route within its budget passes, a per-item loop over the budget is stopped
+with QueryBudgetExceeded in raise mode, and a task spawned by the handler
+that keeps issuing statements after the response is not counted.
+
+Run inside docker app container:
+  python3 scripts/test_query_budget_smoke.py
+"""
+
+import asyncio
+import os
+import sys
+from pathlib import Path
+
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+if str(PROJECT_ROOT) not in sys.path:
+    sys.path.insert(0, str(PROJECT_ROOT))
+
+os.environ["QUERY_BUDGET_MODE"] = "raise"
+os.environ["QUERY_BUDGETS"] = "POST /api/smoke/{item_id}=5"
+
+from services.metrics import MetricsMiddleware, current_request_stats, observe_query  # noqa: E402
+from services.query_budget import QueryBudgetExceeded, check_query_budget, fingerprint  # noqa: E402
+
+
+class _Route:
+    path = "/api/smoke/{item_id}"
+
+
+def _statement(sql: str) -> None:
+    check_query_budget(sql)
+    observe_query(sql, 0.001)
+
+
+def _app(statements: int):
+    async def app(scope, receive, send):
+        scope["route"] = _Route()
+        for item_id in range(statements):
+            _statement(f"SELECT id FROM products WHERE sku = 'SKU-{item_id}'")
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b"{}"})
+
+    return app
+
+
+def _spawning_app(spawned: list, sent: asyncio.Event, seen: list):
+    async def job():
+        # Inherits the request's context, like a push campaign or a backfill.
+        await sent.wait()
+        for chunk in range(20):
+            _statement(f"UPDATE push_campaigns SET sent = {chunk} WHERE id = 1")
+            await asyncio.sleep(0)
+
+    async def app(scope, receive, send):
+        scope["route"] = _Route()
+        _statement("INSERT INTO push_campaigns (title) VALUES ('smoke')")
+        seen.append(current_request_stats())
+        spawned.append(asyncio.create_task(job()))
+        await send({"type": "http.response.start", "status": 202, "headers": []})
+        await send({"type": "http.response.body", "body": b"{}"})
+
+    return app
+
+
+async def _run(app, sent: asyncio.Event = None) -> None:
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        if sent is not None and message["type"] == "http.response.body" and not message.get("more_body"):
+            sent.set()
+
+    scope = {"type": "http", "method": "POST", "path": "/api/smoke/1", "headers": []}
+    await MetricsMiddleware(app)(scope, receive, send)
+
+
+async def _run_spawning() -> None:
+    spawned, sent, seen = [], asyncio.Event(), []
+    await _run(_spawning_app(spawned, sent, seen), sent)
+    await asyncio.gather(*spawned)
+    stats = seen[0]
+    assert stats.queries == 1 and list(stats.shapes) == ["INSERT INTO push_campaigns (title) VALUES (?)"], stats.shapes
+
+
+def main() -> int:
+    assert fingerprint("SELECT * FROM users WHERE phone = ? AND id = 42") == fingerprint(
+        "SELECT *\n  FROM users -- lookup\n WHERE phone = %s AND id = 7"
+    )
+    assert fingerprint("DELETE FROM orders WHERE id IN (?, ?, ?)") == fingerprint("DELETE FROM orders WHERE id IN (?)")
+    assert fingerprint("SELECT name FROM t WHERE note = 'it''s 5'") == "SELECT name FROM t WHERE note = ?"
+    assert fingerprint("SELECT rating_1 FROM product_rating_stats") == "SELECT rating_1 FROM product_rating_stats"
+    assert fingerprint("INSERT INTO t (a, b) VALUES (1, 'x'), (2, 'y')") == "INSERT INTO t (a, b) VALUES (...)"
+
+    asyncio.run(_run(_app(5)))
+    try:
+        asyncio.run(_run(_app(12)))
+    except QueryBudgetExceeded as exc:
+        message = str(exc)
+        assert "POST /api/smoke/{item_id} issued 6 statements, budget 5" in message, message
+        assert "6x SELECT id FROM products WHERE sku = ?" in message, message
+    else:
+        raise AssertionError("a request over its budget must raise in raise mode")
+
+    # Work spawned by the request and still running after the response is not its budget.
+    asyncio.run(_run_spawning())
+
+    # Outside a request nothing is counted.
+    for _ in range(100):
+        _statement("SELECT 1")
+
+    print("OK: query budget and N+1 detector")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
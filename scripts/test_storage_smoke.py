@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""Smoke test for the upload storage backends.
+
+Always exercises LocalStorage in a temporary directory. When S3_BUCKET is set,
+also exercises S3Storage against that bucket (for example the MinIO stand-in
+from docker-compose: `docker compose --profile s3 up -d minio`). The bucket is
+created if it does not exist and only keys under a random prefix are touched.
+
+Run inside docker app container:
+  python3 scripts/test_storage_smoke.py
+"""
+
+import os
+import sys
+import tempfile
+import uuid
+from pathlib import Path
+
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+if str(PROJECT_ROOT) not in sys.path:
+    sys.path.insert(0, str(PROJECT_ROOT))
+
+from services.storage import LocalStorage, S3Storage  # noqa: E402
+
+
+def _exercise(storage, label: str) -> None:
+    original = "a" * 64 + ".jpg"
+    derivative = ".cache/img_smoke.webp"
+    payload = b"\xff\xd8smoke-" + uuid.uuid4().hex.encode()
+
+    assert not storage.exists(original), f"{label}: fresh key must not exist"
+
+    fd, tmp_path = tempfile.mkstemp(dir=storage.tmp_dir)
+    with os.fdopen(fd, "wb") as handle:
+        handle.write(payload)
+    storage.put_file(original, tmp_path)
+    assert not os.path.exists(tmp_path), f"{label}: put_file must consume the staging file"
+
+    assert storage.exists(original), f"{label}: original missing after put_file"
+    assert storage.size(original) == len(payload), f"{label}: size mismatch"
+    assert storage.mtime(original) > 0, f"{label}: mtime missing"
+    with storage.open(original) as handle:
+        assert handle.read() == payload, f"{label}: content mismatch"
+
+    storage.put_bytes(derivative, payload[::-1])
+    keys = set(storage.list_keys(".cache/"))
+    assert derivative in keys, f"{label}: list_keys did not return {derivative}: {keys}"
+
+    response = storage.response(derivative, media_type="image/webp")
+    assert response.media_type == "image/webp", f"{label}: wrong media type"
+
+    for key in (original, derivative):
+        storage.delete(key)
+        assert not storage.exists(key), f"{label}: {key} still exists after delete"
+
+    try:
+        storage.response(original)
+    except FileNotFoundError:
+        pass
+    else:
+        raise AssertionError(f"{label}: response() must raise FileNotFoundError for missing keys")
+
+    for bad_key in ("../etc/passwd", "", "/"):
+        try:
+            storage.exists(bad_key)
+        except ValueError:
+            continue
+        raise AssertionError(f"{label}: key {bad_key!r} was not rejected")
+
+    print(f"OK: {label}")
+
+
+def main() -> int:
+    with tempfile.TemporaryDirectory() as root:
+        _exercise(LocalStorage(root), "local")
+
+    bucket = os.getenv("S3_BUCKET")
+    if not bucket:
+        print("SKIP: s3 (S3_BUCKET is not set)")
+        return 0
+
+    storage = S3Storage(
+        bucket=bucket,
+        prefix=f"smoke-{uuid.uuid4().hex[:8]}",
+        endpoint_url=os.getenv("S3_ENDPOINT_URL") or None,
+        region=os.getenv("S3_REGION") or None,
+        access_key_id=os.getenv("S3_ACCESS_KEY_ID") or None,
+        secret_access_key=os.getenv("S3_SECRET_ACCESS_KEY") or None,
+    )
+    try:
+        storage._client.head_bucket(Bucket=bucket)
+    except Exception:
+        storage._client.create_bucket(Bucket=bucket)
+    _exercise(storage, "s3")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -1,18 +1,45 @@
-"""Analytics integrations for server-side event tracking."""
+"""Analytics integrations for server-side event tracking.
+
+``/api/track`` only appends events to an in-process bounded buffer; a
+background flusher drains it when it reaches ``ANALYTICS_FLUSH_SIZE`` events or
+every ``ANALYTICS_FLUSH_SECONDS``, and delivers them in batches: up to 1000
+events per Facebook CAPI request and up to 25 events per GA4 Measurement
+Protocol request (grouped by client_id). Failed batches are re-queued a few
+times. When the buffer is full, low-priority events are dropped first, so a
+traffic spike never grows memory or competes with checkout.
+
+Every event is also appended to the first-party store (``services.event_store``).
+"""
 
 from __future__ import annotations
 
+import asyncio
 import hashlib
 import logging
 import os
 import time
 import uuid
-from typing import Any, Dict
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional
 
-import httpx
+from services.event_store import store_events
+from services.http_clients import get_http_client
 
 logger = logging.getLogger(__name__)
 
+ANALYTICS_BUFFER_MAX = int(os.getenv("ANALYTICS_BUFFER_MAX", "10000"))
+ANALYTICS_FLUSH_SIZE = int(os.getenv("ANALYTICS_FLUSH_SIZE", "500"))
+ANALYTICS_FLUSH_SECONDS = float(os.getenv("ANALYTICS_FLUSH_SECONDS", "5"))
+ANALYTICS_MAX_ATTEMPTS = int(os.getenv("ANALYTICS_MAX_ATTEMPTS", "3"))
+FB_BATCH_SIZE = 1000
+GA_BATCH_SIZE = 25
+GA_CONCURRENCY = 4
+
+# Conversion events are kept when the buffer overflows; everything else may be dropped.
+HIGH_PRIORITY_EVENTS = {"purchase", "Purchase", "InitiateCheckout", "begin_checkout", "AddPaymentInfo", "add_payment_info"}
+
+DESTINATIONS = ("store", "facebook", "google_analytics")
+
 
 def _hash_data(value: Any) -> str | None:
     if not value:
@@ -20,67 +47,246 @@ def _hash_data(value: Any) -> str | None:
     return hashlib.sha256(str(value).strip().lower().encode("utf-8")).hexdigest()
 
 
-async def send_to_facebook_capi(event_name: str, data: dict, user_data: dict) -> None:
+class EventBuffer:
+    """Bounded two-priority FIFO. Overflow drops low-priority events first."""
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.high: Deque[dict] = deque()
+        self.low: Deque[dict] = deque()
+        self.stats = {
+            "enqueued": 0,
+            "dropped": 0,
+            "retried": 0,
+            "stored": 0,
+            "sent_facebook": 0,
+            "sent_google_analytics": 0,
+            "failed": 0,
+        }
+
+    def __len__(self) -> int:
+        return len(self.high) + len(self.low)
+
+    def put(self, event: dict) -> bool:
+        high = event["event_name"] in HIGH_PRIORITY_EVENTS
+        if len(self) >= self.max_size:
+            self.stats["dropped"] += 1
+            if not high:
+                return False
+            # A high-priority event evicts the oldest low one, or the oldest high one if none are left.
+            (self.low or self.high).popleft()
+        (self.high if high else self.low).append(event)
+        return True
+
+    def take(self, limit: int) -> List[dict]:
+        batch = []
+        for queue in (self.high, self.low):
+            while queue and len(batch) < limit:
+                batch.append(queue.popleft())
+        return batch
+
+
+_buffer = EventBuffer(ANALYTICS_BUFFER_MAX)
+_wakeup: Optional[asyncio.Event] = None
+_flush_task: Optional[asyncio.Task] = None
+
+
+def enqueue_event(event_name: str, data: dict, user_data: dict) -> bool:
+    """Buffer an event for batched delivery. Never blocks; returns False if dropped."""
+    event = {
+        "event_id": str(uuid.uuid4()),
+        "event_name": event_name,
+        "event_time": int(time.time()),
+        "data": dict(data or {}),
+        "user_data": dict(user_data or {}),
+        "destinations": set(DESTINATIONS),
+        "attempts": 0,
+    }
+    accepted = _buffer.put(event)
+    if accepted:
+        _buffer.stats["enqueued"] += 1
+    if _wakeup is not None and len(_buffer) >= ANALYTICS_FLUSH_SIZE:
+        _wakeup.set()
+    return accepted
+
+
+async def track_analytics_event(event_name: str, data: dict, user_data: dict) -> None:
+    enqueue_event(event_name, data, user_data)
+
+
+def get_pipeline_stats() -> dict:
+    return {"buffered": len(_buffer), "high": len(_buffer.high), "low": len(_buffer.low), **_buffer.stats}
+
+
+# --- Payloads ---
+
+def _facebook_event(event: dict) -> dict:
+    user_data = event["user_data"]
+    event_name = event["event_name"]
+    return {
+        "event_name": "Purchase" if event_name == "purchase" else event_name,
+        "event_time": event["event_time"],
+        "event_id": event["event_id"],
+        "action_source": "website",
+        "user_data": {
+            "ph": [_hash_data(user_data.get("phone"))] if user_data.get("phone") else [],
+            "em": [_hash_data(user_data.get("email"))] if user_data.get("email") else [],
+            "client_user_agent": user_data.get("user_agent"),
+            "client_ip_address": user_data.get("ip"),
+        },
+        "custom_data": event["data"],
+    }
+
+
+def _ga_client_id(event: dict) -> str:
+    user_data = event["user_data"]
+    return str(user_data.get("client_id") or user_data.get("phone") or event["event_id"])
+
+
+def _ga_event(event: dict) -> dict:
+    ga_params = dict(event["data"])
+    if "value" in ga_params:
+        try:
+            ga_params["value"] = float(ga_params["value"])
+        except (TypeError, ValueError):
+            ga_params.pop("value")
+    return {"name": event["event_name"], "params": ga_params}
+
+
+# --- Delivery ---
+
+def _requeue(events: List[dict], destination: str) -> None:
+    for event in events:
+        attempts = event["attempts"] + 1
+        if attempts >= ANALYTICS_MAX_ATTEMPTS:
+            _buffer.stats["failed"] += 1
+            continue
+        # Events are shared by both destinations; retry a copy bound to the failed one.
+        retry = dict(event, destinations={destination}, attempts=attempts)
+        if _buffer.put(retry):
+            _buffer.stats["retried"] += 1
+
+
+async def save_to_store(events: List[dict]) -> None:
+    if not events:
+        return
+    try:
+        _buffer.stats["stored"] += await asyncio.to_thread(store_events, events)
+    except Exception as exc:
+        logger.warning("Analytics store Error: %s", exc)
+        _requeue(events, "store")
+
+
+async def send_to_facebook_capi(events: List[dict]) -> None:
     pixel_id = os.getenv("FB_PIXEL_ID")
     access_token = os.getenv("FB_ACCESS_TOKEN")
-    if not pixel_id or not access_token:
+    if not pixel_id or not access_token or not events:
         return
 
     url = f"https://graph.facebook.com/v19.0/{pixel_id}/events?access_token={access_token}"
-    fb_event_name = "Purchase" if event_name == "purchase" else event_name
-
-    payload: Dict[str, Any] = {
-        "data": [
-            {
-                "event_name": fb_event_name,
-                "event_time": int(time.time()),
-                "action_source": "website",
-                "user_data": {
-                    "ph": [_hash_data(user_data.get("phone"))] if user_data.get("phone") else [],
-                    "em": [_hash_data(user_data.get("email"))] if user_data.get("email") else [],
-                    "client_user_agent": user_data.get("user_agent"),
-                    "client_ip_address": user_data.get("ip"),
-                },
-                "custom_data": data,
-            }
-        ]
-    }
-
-    async with httpx.AsyncClient() as client:
+    for start in range(0, len(events), FB_BATCH_SIZE):
+        chunk = events[start : start + FB_BATCH_SIZE]
         try:
-            await client.post(url, json=payload)
+            response = await get_http_client("facebook").post(url, json={"data": [_facebook_event(e) for e in chunk]})
+            if response.status_code >= 500 or response.status_code == 429:
+                raise RuntimeError(f"HTTP {response.status_code}")
+            if response.status_code >= 400:
+                logger.warning("FB CAPI rejected batch of %s: %s", len(chunk), response.text[:500])
+                continue
+            _buffer.stats["sent_facebook"] += len(chunk)
         except Exception as exc:
             logger.warning("FB CAPI Error: %s", exc)
+            _requeue(chunk, "facebook")
 
 
-async def send_to_google_analytics(event_name: str, data: dict, user_data: dict) -> None:
+async def _send_ga_request(url: str, client_id: str, chunk: List[dict], semaphore: asyncio.Semaphore) -> None:
+    async with semaphore:
+        try:
+            response = await get_http_client("google_analytics").post(
+                url, json={"client_id": client_id, "events": [_ga_event(e) for e in chunk]}
+            )
+            if response.status_code >= 500 or response.status_code == 429:
+                raise RuntimeError(f"HTTP {response.status_code}")
+            _buffer.stats["sent_google_analytics"] += len(chunk)
+        except Exception as exc:
+            logger.warning("GA4 Error: %s", exc)
+            _requeue(chunk, "google_analytics")
+
+
+async def send_to_google_analytics(events: List[dict]) -> None:
     measurement_id = os.getenv("GA_MEASUREMENT_ID")
     api_secret = os.getenv("GA_API_SECRET")
-    if not measurement_id or not api_secret:
+    if not measurement_id or not api_secret or not events:
         return
 
     url = f"https://www.google-analytics.com/mp/collect?measurement_id={measurement_id}&api_secret={api_secret}"
-    ga_params = data.copy()
-    if "value" in ga_params:
-        ga_params["value"] = float(ga_params["value"])
-
-    payload = {
-        "client_id": user_data.get("client_id") or user_data.get("phone") or str(uuid.uuid4()),
-        "events": [
-            {
-                "name": event_name,
-                "params": ga_params,
-            }
-        ],
-    }
+    by_client: Dict[str, List[dict]] = {}
+    for event in events:
+        by_client.setdefault(_ga_client_id(event), []).append(event)
+
+    semaphore = asyncio.Semaphore(GA_CONCURRENCY)
+    await asyncio.gather(
+        *(
+            _send_ga_request(url, client_id, client_events[start : start + GA_BATCH_SIZE], semaphore)
+            for client_id, client_events in by_client.items()
+            for start in range(0, len(client_events), GA_BATCH_SIZE)
+        )
+    )
+
+
+async def flush_events(limit: int = FB_BATCH_SIZE) -> int:
+    """Deliver up to ``limit`` buffered events. Returns number of events taken."""
+    batch = _buffer.take(limit)
+    if not batch:
+        return 0
+    await asyncio.gather(
+        save_to_store([e for e in batch if "store" in e["destinations"]]),
+        send_to_facebook_capi([e for e in batch if "facebook" in e["destinations"]]),
+        send_to_google_analytics([e for e in batch if "google_analytics" in e["destinations"]]),
+    )
+    return len(batch)
 
-    async with httpx.AsyncClient() as client:
+
+async def _flush_loop() -> None:
+    while True:
         try:
-            await client.post(url, json=payload)
-        except Exception as exc:
-            logger.warning("GA4 Error: %s", exc)
+            await asyncio.wait_for(_wakeup.wait(), timeout=ANALYTICS_FLUSH_SECONDS)
+        except asyncio.TimeoutError:
+            pass
+        _wakeup.clear()
+        try:
+            while await flush_events() and len(_buffer) >= ANALYTICS_FLUSH_SIZE:
+                pass
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Analytics flush failed")
 
 
-async def track_analytics_event(event_name: str, data: dict, user_data: dict) -> None:
-    await send_to_facebook_capi(event_name, data, user_data)
-    await send_to_google_analytics(event_name, data, user_data)
+def start_analytics_flusher() -> None:
+    """Start the background flusher (call from the app startup hook)."""
+    global _flush_task, _wakeup
+    if _flush_task is None or _flush_task.done():
+        _wakeup = asyncio.Event()
+        _flush_task = asyncio.get_running_loop().create_task(_flush_loop())
+
+
+async def stop_analytics_flusher(timeout: float = 10.0) -> None:
+    """Stop the flusher and try to deliver what is still buffered."""
+    global _flush_task
+    if _flush_task is not None:
+        _flush_task.cancel()
+        try:
+            await _flush_task
+        except asyncio.CancelledError:
+            pass
+        _flush_task = None
+
+    async def _drain():
+        while await flush_events():
+            pass
+
+    try:
+        await asyncio.wait_for(_drain(), timeout=timeout)
+    except asyncio.TimeoutError:
+        logger.warning("Analytics: %s events not delivered on shutdown", len(_buffer))
@@ -0,0 +1,176 @@
+"""Delta sync of the catalog (products, categories, banners) for the app's offline cache.
+
+Each row carries ``catalog_version``, assigned by triggers (migration 12) on
+every insert and effective update. Deletes leave tombstones with their own
+version. Each writing statement takes a transaction-scoped advisory lock
+before it locks any row (statement-level triggers, migration 13), so versions
+commit in increasing order: a client that stored ``version`` and asks for
+``since=version`` later cannot miss a write.
+
+The current version is the highest committed one. ``catalog_changes`` returns
+``reset: true`` when the client has to reload the snapshot: too many changes, a
+truncated table, or a version this database never issued.
+"""
+
+from __future__ import annotations
+
+import os
+import threading
+from typing import List, Optional
+
+from db import get_db_connection
+from services.json_response import dumps
+from services.products import normalize_product_row
+
+CATALOG_CHANGES_MAX = int(os.getenv("CATALOG_CHANGES_MAX", "2000"))
+
+CATALOG_ENTITIES = ("products", "categories", "banners")
+
+_snapshot_lock = threading.Lock()
+_snapshot_cache: Optional[tuple] = None  # (version, rendered JSON bytes)
+
+
+def catalog_version(conn) -> int:
+    row = conn.execute(
+        """
+        SELECT GREATEST(
+            (SELECT MAX(catalog_version) FROM products),
+            (SELECT MAX(catalog_version) FROM categories),
+            (SELECT MAX(catalog_version) FROM banners),
+            (SELECT MAX(catalog_version) FROM catalog_tombstones)
+        ) AS version
+        """
+    ).fetchone()
+    return int(row["version"] or 0)
+
+
+def _version_filter(since: Optional[int], upto: int) -> tuple:
+    if since is None:
+        return "catalog_version <= ?", (upto,)
+    return "catalog_version > ? AND catalog_version <= ?", (since, upto)
+
+
+def _products(conn, since: Optional[int], upto: int) -> List[dict]:
+    where_sql, params = _version_filter(since, upto)
+    rows = conn.execute(f"SELECT * FROM products WHERE {where_sql} ORDER BY id", params).fetchall()
+    products = []
+    for row in rows:
+        product = normalize_product_row(dict(row))
+        # Same key /api/products groups variants by.
+        product["group_key"] = product.get("parent_sku") or product.get("sku") or str(product["id"])
+        products.append(product)
+    return products
+
+
+def _categories(conn, since: Optional[int], upto: int) -> List[dict]:
+    where_sql, params = _version_filter(since, upto)
+    rows = conn.execute(
+        f"SELECT id, name, banner_url, catalog_version FROM categories WHERE {where_sql} ORDER BY id", params
+    ).fetchall()
+    if not rows:
+        return []
+    banners = {}
+    for banner in conn.execute(
+        "SELECT category_id, image_url FROM category_banners WHERE category_id = ANY(?) ORDER BY id",
+        ([row["id"] for row in rows],),
+    ).fetchall():
+        banners.setdefault(banner["category_id"], []).append(banner["image_url"])
+    return [
+        {
+            "id": row["id"],
+            "name": row["name"],
+            "banner_url": row["banner_url"] or None,
+            "banners": banners.get(row["id"], []),
+            "catalog_version": row["catalog_version"],
+        }
+        for row in rows
+    ]
+
+
+def _banners(conn, since: Optional[int], upto: int) -> List[dict]:
+    where_sql, params = _version_filter(since, upto)
+    rows = conn.execute(
+        f"SELECT id, image_url, catalog_version FROM banners WHERE {where_sql} ORDER BY id", params
+    ).fetchall()
+    return [dict(row) for row in rows]
+
+
+def _reset(version: int, since: int) -> dict:
+    return {"version": version, "since": since, "reset": True}
+
+
+def changes_since(conn, since: int) -> dict:
+    """Rows written and ids deleted after ``since``, up to the current version."""
+    version = catalog_version(conn)
+    if since < 0 or since > version:
+        return _reset(version, since)
+    if since == version:
+        return {
+            "version": version, "since": since, "reset": False,
+            "products": [], "categories": [], "banners": [],
+            "deleted": {entity: [] for entity in CATALOG_ENTITIES},
+        }
+
+    tombstones = conn.execute(
+        """
+        SELECT entity, entity_id FROM catalog_tombstones
+        WHERE catalog_version > ? AND catalog_version <= ?
+        ORDER BY catalog_version
+        """,
+        (since, version),
+    ).fetchall()
+    if any(t["entity_id"] is None for t in tombstones):
+        return _reset(version, since)
+    changed = conn.execute(
+        """
+        SELECT (SELECT COUNT(*) FROM products WHERE catalog_version > ? AND catalog_version <= ?)
+             + (SELECT COUNT(*) FROM categories WHERE catalog_version > ? AND catalog_version <= ?)
+             + (SELECT COUNT(*) FROM banners WHERE catalog_version > ? AND catalog_version <= ?) AS n
+        """,
+        (since, version) * 3,
+    ).fetchone()["n"]
+    if changed + len(tombstones) > CATALOG_CHANGES_MAX:
+        return _reset(version, since)
+
+    deleted = {entity: [] for entity in CATALOG_ENTITIES}
+    for tombstone in tombstones:
+        deleted.setdefault(tombstone["entity"], []).append(tombstone["entity_id"])
+    return {
+        "version": version,
+        "since": since,
+        "reset": False,
+        "products": _products(conn, since, version),
+        "categories": _categories(conn, since, version),
+        "banners": _banners(conn, since, version),
+        "deleted": deleted,
+    }
+
+
+def catalog_changes(since: int) -> dict:
+    conn = get_db_connection()
+    try:
+        return changes_since(conn, since)
+    finally:
+        conn.close()
+
+
+def catalog_snapshot() -> tuple:
+    """``(version, JSON bytes)`` of the whole catalog; re-rendered only when the version moves."""
+    global _snapshot_cache
+    conn = get_db_connection()
+    try:
+        version = catalog_version(conn)
+        with _snapshot_lock:
+            if _snapshot_cache is not None and _snapshot_cache[0] == version:
+                return _snapshot_cache
+        body = dumps({
+            "version": version,
+            "products": _products(conn, None, version),
+            "categories": _categories(conn, None, version),
+            "banners": _banners(conn, None, version),
+        })
+    finally:
+        conn.close()
+    with _snapshot_lock:
+        _snapshot_cache = (version, body)
+    return version, body
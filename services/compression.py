@@ -0,0 +1,241 @@
+"""Negotiated response compression (zstd, brotli, gzip) as ASGI middleware.
+
+The encoding is picked from ``Accept-Encoding`` (q-values respected; on a tie
+zstd, then br, then gzip); brotli and zstd are used only when their packages
+are installed. Bodies below ``COMPRESS_MIN_SIZE`` and non-text content types go
+out as they are. Streaming responses (exports) are compressed chunk by chunk.
+
+Catalog GET responses (``COMPRESS_CACHE_PATHS``) additionally keep their
+compressed copies in a small LRU keyed by encoding and body digest, so a
+repeated hit on the same page costs one hash instead of a compression pass.
+Keying by content means a catalog change simply produces a new entry.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import logging
+import os
+import zlib
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+from starlette.datastructures import Headers, MutableHeaders
+
+try:
+    import brotli
+except ImportError:  # optional: br is not offered without it
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:  # optional: zstd is not offered without it
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+COMPRESS_MIN_SIZE = int(os.getenv("COMPRESS_MIN_SIZE", "1024"))
+GZIP_LEVEL = int(os.getenv("GZIP_LEVEL", "6"))
+BROTLI_QUALITY = int(os.getenv("BROTLI_QUALITY", "5"))
+ZSTD_LEVEL = int(os.getenv("ZSTD_LEVEL", "3"))
+COMPRESS_CACHE_ENTRIES = int(os.getenv("COMPRESS_CACHE_ENTRIES", "64"))
+COMPRESS_CACHE_PATHS = tuple(
+    p.strip() for p in os.getenv("COMPRESS_CACHE_PATHS", "/api/products,/products,/api/categories,/categories,/api/catalog/snapshot").split(",")
+    if p.strip()
+)
+
+COMPRESSIBLE_TYPES = (
+    "application/json",
+    "application/javascript",
+    "application/xml",
+    "image/svg+xml",
+    "text/",
+)
+
+# Server preference on equal q-values.
+_PREFERENCE = ("zstd", "br", "gzip")
+
+
+def available_encodings() -> Tuple[str, ...]:
+    return tuple(
+        enc for enc in _PREFERENCE
+        if enc == "gzip" or (enc == "br" and brotli is not None) or (enc == "zstd" and zstandard is not None)
+    )
+
+
+def choose_encoding(accept_encoding: str, available: Tuple[str, ...]) -> Optional[str]:
+    """Best encoding the client accepts, or None for identity."""
+    weights: Dict[str, float] = {}
+    for part in (accept_encoding or "").lower().split(","):
+        name, _, params = part.strip().partition(";")
+        if not name:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        weights[name.strip()] = q
+    best, best_q = None, 0.0
+    for enc in available:
+        q = weights.get(enc, weights.get("*", 0.0))
+        if q > best_q:
+            best, best_q = enc, q
+    return best
+
+
+class _Compressor:
+    """Incremental compressor with one interface for the three encodings."""
+
+    def __init__(self, encoding: str):
+        self.encoding = encoding
+        if encoding == "zstd":
+            self._obj = zstandard.ZstdCompressor(level=ZSTD_LEVEL).compressobj()
+        elif encoding == "br":
+            self._obj = brotli.Compressor(quality=BROTLI_QUALITY)
+        else:
+            self._obj = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, data: bytes) -> bytes:
+        if not data:
+            return b""
+        if self.encoding == "br":
+            return self._obj.process(data)
+        return self._obj.compress(data)
+
+    def finish(self) -> bytes:
+        if self.encoding == "br":
+            return self._obj.finish()
+        return self._obj.flush()
+
+
+def compress_body(encoding: str, body: bytes) -> bytes:
+    compressor = _Compressor(encoding)
+    return compressor.compress(body) + compressor.finish()
+
+
+class CompressedBodyCache:
+    """LRU of compressed bodies keyed by (encoding, size, digest of the plain body)."""
+
+    def __init__(self, max_entries: int = COMPRESS_CACHE_ENTRIES):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[tuple, bytes]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_compress(self, encoding: str, body: bytes) -> bytes:
+        key = (encoding, len(body), hashlib.blake2b(body, digest_size=16).digest())
+        cached = self._entries.get(key)
+        if cached is not None:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return cached
+        self.misses += 1
+        compressed = compress_body(encoding, body)
+        self._entries[key] = compressed
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        return compressed
+
+
+class CompressionMiddleware:
+    def __init__(
+        self,
+        app,
+        minimum_size: int = COMPRESS_MIN_SIZE,
+        cache_paths: Tuple[str, ...] = COMPRESS_CACHE_PATHS,
+        cache_entries: int = COMPRESS_CACHE_ENTRIES,
+    ):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.cache_paths = cache_paths
+        self.cache = CompressedBodyCache(cache_entries) if cache_entries > 0 else None
+        self.encodings = available_encodings()
+        logger.info("Response compression: encodings=%s min_size=%s", ",".join(self.encodings), minimum_size)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        encoding = choose_encoding(Headers(scope=scope).get("accept-encoding", ""), self.encodings)
+        if not encoding:
+            await self.app(scope, receive, send)
+            return
+        cache = None
+        if self.cache is not None and scope.get("method") == "GET" and scope.get("path", "").startswith(self.cache_paths):
+            cache = self.cache
+        await _CompressResponder(self.app, encoding, self.minimum_size, cache)(scope, receive, send)
+
+
+class _CompressResponder:
+    def __init__(self, app, encoding: str, minimum_size: int, cache: Optional[CompressedBodyCache]):
+        self.app = app
+        self.encoding = encoding
+        self.minimum_size = minimum_size
+        self.cache = cache
+        self.send = None
+        self.start_message: Optional[dict] = None
+        self.mode: Optional[str] = None  # "identity" | "stream" once the first body chunk is seen
+        self.compressor: Optional[_Compressor] = None
+
+    async def __call__(self, scope, receive, send):
+        self.send = send
+        await self.app(scope, receive, self.send_wrapper)
+
+    def _should_compress(self) -> bool:
+        headers = Headers(raw=self.start_message["headers"])
+        if "content-encoding" in headers or self.start_message["status"] in (204, 206, 304):
+            return False
+        content_type = headers.get("content-type", "").lower()
+        return content_type.startswith(COMPRESSIBLE_TYPES)
+
+    def _encoded_headers(self, length: Optional[int]) -> None:
+        headers = MutableHeaders(raw=self.start_message["headers"])
+        headers["Content-Encoding"] = self.encoding
+        headers.add_vary_header("Accept-Encoding")
+        if length is None:
+            del headers["Content-Length"]
+        else:
+            headers["Content-Length"] = str(length)
+
+    async def send_wrapper(self, message) -> None:
+        message_type = message["type"]
+        if message_type == "http.response.start":
+            # Own copy with a list of headers so MutableHeaders can edit it in place.
+            self.start_message = dict(message, headers=list(message.get("headers") or []))
+            return
+        if message_type != "http.response.body":
+            await self.send(message)
+            return
+
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+
+        if self.mode is None:
+            if not self._should_compress() or (not more_body and len(body) < self.minimum_size):
+                self.mode = "identity"
+            elif not more_body:
+                if self.cache is not None and self.start_message["status"] == 200:
+                    compressed = self.cache.get_or_compress(self.encoding, body)
+                else:
+                    compressed = compress_body(self.encoding, body)
+                self._encoded_headers(len(compressed))
+                await self.send(self.start_message)
+                await self.send({"type": "http.response.body", "body": compressed})
+                return
+            else:
+                self.mode = "stream"
+                self.compressor = _Compressor(self.encoding)
+                self._encoded_headers(None)
+            await self.send(self.start_message)
+
+        if self.mode == "identity":
+            await self.send(message)
+            return
+
+        chunk = self.compressor.compress(body)
+        if not more_body:
+            chunk += self.compressor.finish()
+        await self.send({"type": "http.response.body", "body": chunk, "more_body": more_body})
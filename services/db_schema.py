@@ -1,217 +1,674 @@
-"""Database schema initialization and lightweight migrations."""
+"""Database schema: versioned migrations applied by ``services.migrations``.
 
-from __future__ import annotations
-
-from db import get_db_connection
-
-
-# --- БАЗА ДАННЫХ ---
-
-def fix_db_schema():
-    conn = get_db_connection()
-    c = conn.cursor()
-
-    # Tables (PostgreSQL)
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS products (
-            id BIGSERIAL PRIMARY KEY,
-            name TEXT,
-            price DOUBLE PRECISION,
-            discount INTEGER DEFAULT 0,
-            image TEXT,
-            images TEXT,
-            category TEXT,
-            pack_sizes TEXT,
-            old_price DOUBLE PRECISION,
-            unit TEXT DEFAULT 'шт',
-            description TEXT,
-            usage TEXT,
-            composition TEXT,
-            delivery_info TEXT,
-            return_info TEXT,
-            variants TEXT,
-            option_names TEXT,
-            external_id TEXT UNIQUE,
-            is_bestseller BOOLEAN DEFAULT FALSE,
-            is_promotion BOOLEAN DEFAULT FALSE,
-            is_new BOOLEAN DEFAULT FALSE,
-            sku TEXT,
-            status TEXT DEFAULT 'В наличии',
-            remains INTEGER DEFAULT 0,
-            parent_sku TEXT,
-            variant_name TEXT
-        )
-    ''')
-
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS users (
-            phone TEXT PRIMARY KEY,
-            bonus_balance INTEGER DEFAULT 0,
-            total_spent DOUBLE PRECISION DEFAULT 0,
-            cashback_percent INTEGER DEFAULT 0,
-            referrer TEXT,
-            created_at TEXT,
-            name TEXT,
-            city TEXT,
-            warehouse TEXT,
-            user_ukrposhta TEXT,
-            email TEXT,
-            contact_preference TEXT DEFAULT 'call',
-            google_id TEXT UNIQUE,
-            facebook_id TEXT UNIQUE,
-            is_bonus_claimed BOOLEAN DEFAULT FALSE
-        )
-    ''')
-
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS app_users (
-            id BIGSERIAL PRIMARY KEY,
-            telegram_id VARCHAR(64) UNIQUE,
-            phone VARCHAR(50),
-            name TEXT NOT NULL DEFAULT '',
-            bonus_balance DOUBLE PRECISION DEFAULT 150
-        )
-    ''')
+Each migration is applied once and recorded in ``schema_migrations``; a boot
+with an up-to-date schema runs no DDL. Never edit a migration that has shipped,
+append a new version instead. Migration 1 is the schema that used to be
+re-created on every boot; it only uses ``IF NOT EXISTS`` DDL, so it is a no-op
+on existing databases.
+"""
 
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS orders (
-            id BIGSERIAL PRIMARY KEY,
-            name TEXT,
-            phone TEXT,
-            user_phone TEXT,
-            email TEXT,
-            contact_preference TEXT DEFAULT 'call',
-            city TEXT,
-            city_ref TEXT,
-            warehouse TEXT,
-            warehouse_ref TEXT,
-            items TEXT,
-            total_price DOUBLE PRECISION,
-            payment_method TEXT DEFAULT 'card',
-            bonus_used INTEGER DEFAULT 0,
-            status TEXT DEFAULT 'New',
-            date TEXT
-        )
-    ''')
-
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS categories (
-            id BIGSERIAL PRIMARY KEY,
-            name TEXT UNIQUE,
-            banner_url VARCHAR(255)
-        )
-    ''')
-
-    c.execute('''CREATE TABLE IF NOT EXISTS category_banners (
-        id BIGSERIAL PRIMARY KEY,
-        category_id INTEGER REFERENCES categories(id) ON DELETE CASCADE,
-        image_url VARCHAR(255)
-    )''')
-
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS banners (
-            id BIGSERIAL PRIMARY KEY,
-            image_url TEXT
-        )
-    ''')
+from __future__ import annotations
 
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS promo_codes (
-            id BIGSERIAL PRIMARY KEY,
-            code TEXT UNIQUE NOT NULL,
-            discount_percent INTEGER DEFAULT 0,
-            discount_amount DOUBLE PRECISION DEFAULT 0,
-            max_uses INTEGER DEFAULT 0,
-            current_uses INTEGER DEFAULT 0,
-            active INTEGER DEFAULT 1,
-            expires_at TEXT,
-            created_at TEXT
-        )
-    ''')
+from services.migrations import Migration, migrate, migration_status
 
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS reviews (
-            id BIGSERIAL PRIMARY KEY,
-            product_id BIGINT NOT NULL,
-            user_name TEXT,
-            user_phone TEXT,
-            rating INTEGER NOT NULL,
-            comment TEXT,
-            created_at TEXT
-        )
-    ''')
 
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS posts (
-            id BIGSERIAL PRIMARY KEY,
-            title TEXT NOT NULL,
-            content TEXT NOT NULL,
-            image_url TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
+MIGRATIONS = (
+    Migration(
+        1,
+        "baseline",
+        (
+            """
+                CREATE TABLE IF NOT EXISTS products (
+                    id BIGSERIAL PRIMARY KEY,
+                    name TEXT,
+                    price DOUBLE PRECISION,
+                    discount INTEGER DEFAULT 0,
+                    image TEXT,
+                    images TEXT,
+                    category TEXT,
+                    pack_sizes TEXT,
+                    old_price DOUBLE PRECISION,
+                    unit TEXT DEFAULT 'шт',
+                    description TEXT,
+                    usage TEXT,
+                    composition TEXT,
+                    delivery_info TEXT,
+                    return_info TEXT,
+                    variants TEXT,
+                    option_names TEXT,
+                    external_id TEXT UNIQUE,
+                    is_bestseller BOOLEAN DEFAULT FALSE,
+                    is_promotion BOOLEAN DEFAULT FALSE,
+                    is_new BOOLEAN DEFAULT FALSE,
+                    sku TEXT,
+                    status TEXT DEFAULT 'В наличии',
+                    remains INTEGER DEFAULT 0,
+                    parent_sku TEXT,
+                    variant_name TEXT
+                )
+            """,
+            """
+                CREATE TABLE IF NOT EXISTS users (
+                    phone TEXT PRIMARY KEY,
+                    bonus_balance INTEGER DEFAULT 0,
+                    total_spent DOUBLE PRECISION DEFAULT 0,
+                    cashback_percent INTEGER DEFAULT 0,
+                    referrer TEXT,
+                    created_at TEXT,
+                    name TEXT,
+                    city TEXT,
+                    warehouse TEXT,
+                    user_ukrposhta TEXT,
+                    email TEXT,
+                    contact_preference TEXT DEFAULT 'call',
+                    google_id TEXT UNIQUE,
+                    facebook_id TEXT UNIQUE,
+                    is_bonus_claimed BOOLEAN DEFAULT FALSE
+                )
+            """,
+            """
+                CREATE TABLE IF NOT EXISTS app_users (
+                    id BIGSERIAL PRIMARY KEY,
+                    telegram_id VARCHAR(64) UNIQUE,
+                    phone VARCHAR(50),
+                    name TEXT NOT NULL DEFAULT '',
+                    bonus_balance DOUBLE PRECISION DEFAULT 150
+                )
+            """,
+            """
+                CREATE TABLE IF NOT EXISTS orders (
+                    id BIGSERIAL PRIMARY KEY,
+                    name TEXT,
+                    phone TEXT,
+                    user_phone TEXT,
+                    email TEXT,
+                    contact_preference TEXT DEFAULT 'call',
+                    city TEXT,
+                    city_ref TEXT,
+                    warehouse TEXT,
+                    warehouse_ref TEXT,
+                    items TEXT,
+                    total_price DOUBLE PRECISION,
+                    payment_method TEXT DEFAULT 'card',
+                    bonus_used INTEGER DEFAULT 0,
+                    status TEXT DEFAULT 'New',
+                    date TEXT
+                )
+            """,
+            """
+                CREATE TABLE IF NOT EXISTS categories (
+                    id BIGSERIAL PRIMARY KEY,
+                    name TEXT UNIQUE,
+                    banner_url VARCHAR(255)
+                )
+            """,
+            """
+                CREATE TABLE IF NOT EXISTS category_banners (
+                        id BIGSERIAL PRIMARY KEY,
+                        category_id INTEGER REFERENCES categories(id) ON DELETE CASCADE,
+                        image_url VARCHAR(255)
+                    )
+            """,
+            """
+                CREATE TABLE IF NOT EXISTS banners (
+                    id BIGSERIAL PRIMARY KEY,
+                    image_url TEXT
+                )
+            """,
+            """
+                CREATE TABLE IF NOT EXISTS promo_codes (
+                    id BIGSERIAL PRIMARY KEY,
+                    code TEXT UNIQUE NOT NULL,
+                    discount_percent INTEGER DEFAULT 0,
+                    discount_amount DOUBLE PRECISION DEFAULT 0,
+                    max_uses INTEGER DEFAULT 0,
+                    current_uses INTEGER DEFAULT 0,
+                    active INTEGER DEFAULT 1,
+                    expires_at TEXT,
+                    created_at TEXT
+                )
+            """,
+            """
+                CREATE TABLE IF NOT EXISTS reviews (
+                    id BIGSERIAL PRIMARY KEY,
+                    product_id BIGINT NOT NULL,
+                    user_name TEXT,
+                    user_phone TEXT,
+                    rating INTEGER NOT NULL,
+                    comment TEXT,
+                    created_at TEXT
+                )
+            """,
+            """
+                CREATE TABLE IF NOT EXISTS posts (
+                    id BIGSERIAL PRIMARY KEY,
+                    title TEXT NOT NULL,
+                    content TEXT NOT NULL,
+                    image_url TEXT,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """,
+            """
+                CREATE TABLE IF NOT EXISTS image_cache (
+                    cache_key TEXT PRIMARY KEY,
+                    source TEXT NOT NULL,
+                    source_mtime BIGINT DEFAULT 0,
+                    size_bytes BIGINT DEFAULT 0,
+                    hits BIGINT DEFAULT 0,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    last_access TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """,
+            "CREATE INDEX IF NOT EXISTS image_cache_source_idx ON image_cache (source)",
+            "CREATE INDEX IF NOT EXISTS image_cache_last_access_idx ON image_cache (last_access)",
+            """
+                CREATE TABLE IF NOT EXISTS upload_blobs (
+                    content_hash TEXT PRIMARY KEY,
+                    path TEXT UNIQUE NOT NULL,
+                    size_bytes BIGINT DEFAULT 0,
+                    ref_count INTEGER DEFAULT 0,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """,
+            "ALTER TABLE products ADD COLUMN IF NOT EXISTS composition TEXT",
+            "ALTER TABLE products ADD COLUMN IF NOT EXISTS images TEXT",
+            "ALTER TABLE products ADD COLUMN IF NOT EXISTS variants TEXT",
+            "ALTER TABLE products ADD COLUMN IF NOT EXISTS option_names TEXT",
+            "ALTER TABLE products ADD COLUMN IF NOT EXISTS delivery_info TEXT",
+            "ALTER TABLE products ADD COLUMN IF NOT EXISTS return_info TEXT",
+            "ALTER TABLE products ADD COLUMN IF NOT EXISTS external_id TEXT",
+            "ALTER TABLE products ADD COLUMN IF NOT EXISTS is_bestseller BOOLEAN DEFAULT FALSE",
+            "ALTER TABLE products ADD COLUMN IF NOT EXISTS is_promotion BOOLEAN DEFAULT FALSE",
+            "ALTER TABLE products ADD COLUMN IF NOT EXISTS is_new BOOLEAN DEFAULT FALSE",
+            "ALTER TABLE products ADD COLUMN IF NOT EXISTS discount INTEGER DEFAULT 0",
+            "ALTER TABLE products ADD COLUMN IF NOT EXISTS is_manually_edited BOOLEAN DEFAULT FALSE",
+            "ALTER TABLE products ADD COLUMN IF NOT EXISTS sku TEXT",
+            "ALTER TABLE products ADD COLUMN IF NOT EXISTS status TEXT DEFAULT 'В наличии'",
+            "ALTER TABLE products ADD COLUMN IF NOT EXISTS remains INTEGER DEFAULT 0",
+            "ALTER TABLE products ADD COLUMN IF NOT EXISTS parent_sku TEXT",
+            "ALTER TABLE products ADD COLUMN IF NOT EXISTS variant_name TEXT",
+            "ALTER TABLE categories ADD COLUMN IF NOT EXISTS banner_url VARCHAR(255)",
+            "ALTER TABLE categories ADD COLUMN IF NOT EXISTS external_id TEXT",
+            "ALTER TABLE users ADD COLUMN IF NOT EXISTS user_ukrposhta TEXT",
+            "ALTER TABLE orders ADD COLUMN IF NOT EXISTS delivery_method TEXT",
+            "ALTER TABLE orders ADD COLUMN IF NOT EXISTS user_ukrposhta TEXT",
+            "ALTER TABLE orders ADD COLUMN IF NOT EXISTS push_token TEXT",
+            "ALTER TABLE orders ADD COLUMN IF NOT EXISTS cashback_applied BOOLEAN DEFAULT FALSE",
+            "ALTER TABLE users ADD COLUMN IF NOT EXISTS google_id TEXT",
+            "ALTER TABLE users ADD COLUMN IF NOT EXISTS facebook_id TEXT",
+            "ALTER TABLE users ADD COLUMN IF NOT EXISTS telegram_id TEXT",
+            "ALTER TABLE users ADD COLUMN IF NOT EXISTS is_bonus_claimed BOOLEAN DEFAULT FALSE",
+            "ALTER TABLE users ADD COLUMN IF NOT EXISTS push_token TEXT",
+            "ALTER TABLE users ADD COLUMN IF NOT EXISTS welcome_push_sent BOOLEAN DEFAULT FALSE",
+        ),
+        optional=(
+            # Duplicates in old data may block these; the app keeps working without them.
+            "CREATE UNIQUE INDEX IF NOT EXISTS products_external_id_uq ON products (external_id)",
+            "CREATE UNIQUE INDEX IF NOT EXISTS users_google_id_key ON users (google_id) WHERE google_id IS NOT NULL",
+            "CREATE UNIQUE INDEX IF NOT EXISTS users_facebook_id_key ON users (facebook_id) WHERE facebook_id IS NOT NULL",
+            "CREATE UNIQUE INDEX IF NOT EXISTS users_telegram_id_key ON users (telegram_id) WHERE telegram_id IS NOT NULL",
+        ),
+    ),
+    Migration(
+        2,
+        "nova_poshta_reference",
+        (
+            """
+                CREATE TABLE IF NOT EXISTS np_cities (
+                    ref TEXT PRIMARY KEY,
+                    description TEXT NOT NULL,
+                    description_ru TEXT,
+                    area TEXT,
+                    settlement_type TEXT,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """,
+            """
+                CREATE TABLE IF NOT EXISTS np_warehouses (
+                    ref TEXT PRIMARY KEY,
+                    city_ref TEXT NOT NULL,
+                    description TEXT NOT NULL,
+                    number INTEGER DEFAULT 0,
+                    category TEXT,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """,
+            "CREATE INDEX IF NOT EXISTS idx_np_warehouses_city_ref ON np_warehouses(city_ref, number)",
+        ),
+    ),
+    Migration(
+        3,
+        "push_delivery",
+        (
+            """
+                CREATE TABLE IF NOT EXISTS push_tickets (
+                    ticket_id TEXT PRIMARY KEY,
+                    token TEXT NOT NULL,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    claimed_at TIMESTAMP
+                )
+            """,
+            "CREATE INDEX IF NOT EXISTS idx_push_tickets_created_at ON push_tickets(created_at)",
+            """
+                CREATE TABLE IF NOT EXISTS push_campaigns (
+                    id BIGSERIAL PRIMARY KEY,
+                    title TEXT NOT NULL,
+                    body TEXT NOT NULL,
+                    data TEXT,
+                    segment TEXT,
+                    status TEXT DEFAULT 'pending',
+                    total INTEGER DEFAULT 0,
+                    processed INTEGER DEFAULT 0,
+                    sent INTEGER DEFAULT 0,
+                    failed INTEGER DEFAULT 0,
+                    unregistered INTEGER DEFAULT 0,
+                    last_token TEXT,
+                    error TEXT,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    started_at TIMESTAMP,
+                    finished_at TIMESTAMP
+                )
+            """,
+            "CREATE INDEX IF NOT EXISTS idx_users_push_token ON users (push_token) WHERE push_token IS NOT NULL",
+            "CREATE INDEX IF NOT EXISTS idx_orders_user_phone_date ON orders (user_phone, date)",
+        ),
+    ),
+    Migration(
+        4,
+        "analytics_store",
+        (
+            """
+                CREATE TABLE IF NOT EXISTS analytics_events (
+                    occurred_at TIMESTAMP NOT NULL,
+                    event_name TEXT NOT NULL,
+                    product_ids TEXT[] DEFAULT '{}',
+                    client_id TEXT,
+                    value DOUBLE PRECISION,
+                    properties TEXT
+                ) PARTITION BY RANGE (occurred_at)
+            """,
+            "CREATE INDEX IF NOT EXISTS idx_analytics_events_occurred_at ON analytics_events (occurred_at)",
+            """
+                CREATE TABLE IF NOT EXISTS analytics_hourly_events (
+                    hour TIMESTAMP NOT NULL,
+                    event_name TEXT NOT NULL,
+                    events BIGINT DEFAULT 0,
+                    unique_clients BIGINT DEFAULT 0,
+                    value_sum DOUBLE PRECISION DEFAULT 0,
+                    PRIMARY KEY (hour, event_name)
+                )
+            """,
+            """
+                CREATE TABLE IF NOT EXISTS analytics_hourly_products (
+                    hour TIMESTAMP NOT NULL,
+                    event_name TEXT NOT NULL,
+                    product_id TEXT NOT NULL,
+                    events BIGINT DEFAULT 0,
+                    value_sum DOUBLE PRECISION DEFAULT 0,
+                    PRIMARY KEY (hour, event_name, product_id)
+                )
+            """,
+            "CREATE INDEX IF NOT EXISTS idx_analytics_hourly_products_product ON analytics_hourly_products (product_id, hour)",
+        ),
+    ),
+    Migration(
+        5,
+        "bonus_ledger",
+        (
+            """
+                CREATE TABLE IF NOT EXISTS bonus_transactions (
+                    id BIGSERIAL PRIMARY KEY,
+                    user_phone TEXT NOT NULL,
+                    delta INTEGER NOT NULL,
+                    balance_after INTEGER,
+                    reason TEXT NOT NULL,
+                    order_id INTEGER,
+                    idempotency_key TEXT UNIQUE,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """,
+            "CREATE INDEX IF NOT EXISTS idx_bonus_transactions_user ON bonus_transactions (user_phone, id)",
+            """
+                INSERT INTO bonus_transactions (user_phone, delta, balance_after, reason, idempotency_key)
+                SELECT phone, bonus_balance, bonus_balance, 'opening_balance', 'opening:' || phone
+                FROM users
+                WHERE COALESCE(bonus_balance, 0) <> 0
+                ON CONFLICT (idempotency_key) DO NOTHING
+            """,
+        ),
+    ),
+    Migration(
+        6,
+        "order_items",
+        (
+            """
+                CREATE TABLE IF NOT EXISTS order_items (
+                    id BIGSERIAL PRIMARY KEY,
+                    order_id BIGINT NOT NULL REFERENCES orders(id) ON DELETE CASCADE,
+                    line_no INTEGER NOT NULL,
+                    product_id BIGINT,
+                    sku TEXT,
+                    name TEXT,
+                    quantity INTEGER NOT NULL DEFAULT 1,
+                    price DOUBLE PRECISION NOT NULL DEFAULT 0,
+                    pack_size TEXT,
+                    unit TEXT,
+                    variant_info TEXT,
+                    UNIQUE (order_id, line_no)
+                )
+            """,
+            "CREATE INDEX IF NOT EXISTS idx_order_items_product_id ON order_items (product_id)",
+            "CREATE INDEX IF NOT EXISTS idx_order_items_sku ON order_items (sku)",
+        ),
+    ),
+    Migration(
+        7,
+        "admin_order_list_indexes",
+        (
+            "CREATE INDEX IF NOT EXISTS idx_orders_status_id ON orders (status, id)",
+            "CREATE INDEX IF NOT EXISTS idx_orders_phone_id ON orders (phone, id)",
+            "CREATE INDEX IF NOT EXISTS idx_orders_user_phone_id ON orders (user_phone, id)",
+            "CREATE INDEX IF NOT EXISTS idx_orders_date ON orders (date)",
+            "CREATE INDEX IF NOT EXISTS idx_orders_payment_method_id ON orders (payment_method, id)",
+            "CREATE INDEX IF NOT EXISTS idx_orders_delivery_method_id ON orders (delivery_method, id)",
+        ),
+    ),
+    Migration(
+        8,
+        "hot_path_indexes",
+        (
+            # Horoshop sync upsert (WHERE sku = ?), catalog grouping and category filter
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_products_sku ON products (sku)",
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_products_parent_sku ON products (parent_sku)",
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_products_group_key "
+            "ON products ((COALESCE(NULLIF(parent_sku, ''), NULLIF(sku, ''), CAST(id AS TEXT))))",
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_products_category ON products (category)",
+            # Reviews per product / per user, newest first
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_reviews_product_created ON reviews (product_id, created_at)",
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_reviews_user_phone_created ON reviews (user_phone, created_at)",
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_category_banners_category_id ON category_banners (category_id)",
+        ),
+        transactional=False,
+    ),
+    Migration(
+        9,
+        "jsonb_product_and_order_columns",
+        (
+            # Session-local converters for the USING clauses (which cannot hold subqueries).
+            """
+                CREATE FUNCTION pg_temp.json_array_or_null(value TEXT) RETURNS JSONB
+                LANGUAGE plpgsql IMMUTABLE AS $$
+                DECLARE
+                    parsed JSONB;
+                BEGIN
+                    parsed := NULLIF(btrim(value), '')::jsonb;
+                    RETURN CASE WHEN jsonb_typeof(parsed) = 'array' THEN parsed END;
+                EXCEPTION WHEN others THEN
+                    RETURN NULL;
+                END
+                $$
+            """,
+            # Legacy images are a JSON array or comma-joined URLs; both become a JSON array of URLs.
+            """
+                CREATE FUNCTION pg_temp.image_urls_jsonb(value TEXT) RETURNS JSONB
+                LANGUAGE plpgsql IMMUTABLE AS $$
+                DECLARE
+                    parsed JSONB := pg_temp.json_array_or_null(value);
+                BEGIN
+                    IF parsed IS NOT NULL THEN
+                        RETURN COALESCE(
+                            (SELECT jsonb_agg(btrim(u.url) ORDER BY u.n)
+                             FROM jsonb_array_elements_text(parsed) WITH ORDINALITY AS u(url, n)
+                             WHERE btrim(u.url) <> ''),
+                            '[]'::jsonb
+                        );
+                    END IF;
+                    RETURN COALESCE(
+                        (SELECT jsonb_agg(btrim(u.url) ORDER BY u.n)
+                         FROM unnest(string_to_array(value, ',')) WITH ORDINALITY AS u(url, n)
+                         WHERE btrim(u.url) <> ''),
+                        '[]'::jsonb
+                    );
+                END
+                $$
+            """,
+            """
+                ALTER TABLE products
+                    ALTER COLUMN images TYPE JSONB USING pg_temp.image_urls_jsonb(images),
+                    ALTER COLUMN images SET DEFAULT '[]'::jsonb,
+                    ALTER COLUMN variants TYPE JSONB USING pg_temp.json_array_or_null(variants)
+            """,
+            """
+                ALTER TABLE orders
+                    ALTER COLUMN items TYPE JSONB USING COALESCE(pg_temp.json_array_or_null(items), '[]'::jsonb),
+                    ALTER COLUMN items SET DEFAULT '[]'::jsonb
+            """,
+            # Upload cleanup looks up a URL inside images (images @> '["..."]').
+            "CREATE INDEX IF NOT EXISTS idx_products_images ON products USING GIN (images jsonb_path_ops)",
+            "DROP FUNCTION pg_temp.image_urls_jsonb(TEXT)",
+            "DROP FUNCTION pg_temp.json_array_or_null(TEXT)",
+        ),
+    ),
+    Migration(
+        10,
+        "product_rating_stats",
+        (
+            """
+                CREATE TABLE IF NOT EXISTS product_rating_stats (
+                    product_id BIGINT PRIMARY KEY,
+                    review_count INTEGER NOT NULL DEFAULT 0,
+                    rating_sum BIGINT NOT NULL DEFAULT 0,
+                    rating_1 INTEGER NOT NULL DEFAULT 0,
+                    rating_2 INTEGER NOT NULL DEFAULT 0,
+                    rating_3 INTEGER NOT NULL DEFAULT 0,
+                    rating_4 INTEGER NOT NULL DEFAULT 0,
+                    rating_5 INTEGER NOT NULL DEFAULT 0,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """,
+            # Out-of-range ratings count in the nearest histogram bucket, as in services.reviews.
+            """
+                INSERT INTO product_rating_stats (
+                    product_id, review_count, rating_sum, rating_1, rating_2, rating_3, rating_4, rating_5
+                )
+                SELECT product_id, COUNT(*), SUM(rating),
+                       COUNT(*) FILTER (WHERE rating <= 1),
+                       COUNT(*) FILTER (WHERE rating = 2),
+                       COUNT(*) FILTER (WHERE rating = 3),
+                       COUNT(*) FILTER (WHERE rating = 4),
+                       COUNT(*) FILTER (WHERE rating >= 5)
+                FROM reviews
+                GROUP BY product_id
+                ON CONFLICT (product_id) DO NOTHING
+            """,
+            # Keyset pages of a product's reviews (WHERE product_id = ? AND id < ? ORDER BY id DESC).
+            "CREATE INDEX IF NOT EXISTS idx_reviews_product_id_id ON reviews (product_id, id)",
+        ),
+    ),
+    Migration(
+        11,
+        "order_promo_code",
+        ("ALTER TABLE orders ADD COLUMN IF NOT EXISTS promo_code TEXT",),
+    ),
+    Migration(
+        12,
+        "catalog_versions",
+        (
+            "CREATE SEQUENCE IF NOT EXISTS catalog_version_seq",
+            """
+                CREATE TABLE IF NOT EXISTS catalog_tombstones (
+                    id BIGSERIAL PRIMARY KEY,
+                    entity TEXT NOT NULL,
+                    entity_id BIGINT,
+                    catalog_version BIGINT NOT NULL,
+                    deleted_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """,
+            "CREATE INDEX IF NOT EXISTS idx_catalog_tombstones_version ON catalog_tombstones (catalog_version)",
+            "ALTER TABLE products ADD COLUMN IF NOT EXISTS catalog_version BIGINT, ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP",
+            "ALTER TABLE categories ADD COLUMN IF NOT EXISTS catalog_version BIGINT, ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP",
+            "ALTER TABLE banners ADD COLUMN IF NOT EXISTS catalog_version BIGINT, ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP",
+            "UPDATE products SET catalog_version = nextval('catalog_version_seq'), updated_at = CURRENT_TIMESTAMP WHERE catalog_version IS NULL",
+            "UPDATE categories SET catalog_version = nextval('catalog_version_seq'), updated_at = CURRENT_TIMESTAMP WHERE catalog_version IS NULL",
+            "UPDATE banners SET catalog_version = nextval('catalog_version_seq'), updated_at = CURRENT_TIMESTAMP WHERE catalog_version IS NULL",
+            "CREATE INDEX IF NOT EXISTS idx_products_catalog_version ON products (catalog_version)",
+            "CREATE INDEX IF NOT EXISTS idx_categories_catalog_version ON categories (catalog_version)",
+            "CREATE INDEX IF NOT EXISTS idx_banners_catalog_version ON banners (catalog_version)",
+            # Every catalog write takes a version under a transaction-scoped advisory lock, so versions
+            # become visible in increasing order and a reader never skips one. No-op updates (a sync
+            # rewriting identical values) keep their version.
+            """
+                CREATE OR REPLACE FUNCTION catalog_touch() RETURNS trigger
+                LANGUAGE plpgsql AS $$
+                BEGIN
+                    IF TG_OP = 'UPDATE' AND NEW IS NOT DISTINCT FROM OLD THEN
+                        RETURN NEW;
+                    END IF;
+                    PERFORM pg_advisory_xact_lock(730048);
+                    NEW.catalog_version := nextval('catalog_version_seq');
+                    NEW.updated_at := CURRENT_TIMESTAMP;
+                    RETURN NEW;
+                END
+                $$
+            """,
+            """
+                CREATE OR REPLACE FUNCTION catalog_tombstone() RETURNS trigger
+                LANGUAGE plpgsql AS $$
+                BEGIN
+                    PERFORM pg_advisory_xact_lock(730048);
+                    IF TG_OP = 'TRUNCATE' THEN
+                        -- entity_id NULL: every row of the table is gone, clients reload the snapshot.
+                        INSERT INTO catalog_tombstones (entity, entity_id, catalog_version)
+                        VALUES (TG_TABLE_NAME, NULL, nextval('catalog_version_seq'));
+                        RETURN NULL;
+                    END IF;
+                    INSERT INTO catalog_tombstones (entity, entity_id, catalog_version)
+                    VALUES (TG_TABLE_NAME, OLD.id, nextval('catalog_version_seq'));
+                    RETURN OLD;
+                END
+                $$
+            """,
+            "DROP TRIGGER IF EXISTS products_catalog_touch ON products",
+            "CREATE TRIGGER products_catalog_touch BEFORE INSERT OR UPDATE ON products FOR EACH ROW EXECUTE FUNCTION catalog_touch()",
+            "DROP TRIGGER IF EXISTS products_catalog_tombstone ON products",
+            "CREATE TRIGGER products_catalog_tombstone AFTER DELETE ON products FOR EACH ROW EXECUTE FUNCTION catalog_tombstone()",
+            "DROP TRIGGER IF EXISTS products_catalog_truncate ON products",
+            "CREATE TRIGGER products_catalog_truncate AFTER TRUNCATE ON products FOR EACH STATEMENT EXECUTE FUNCTION catalog_tombstone()",
+            "DROP TRIGGER IF EXISTS categories_catalog_touch ON categories",
+            "CREATE TRIGGER categories_catalog_touch BEFORE INSERT OR UPDATE ON categories FOR EACH ROW EXECUTE FUNCTION catalog_touch()",
+            "DROP TRIGGER IF EXISTS categories_catalog_tombstone ON categories",
+            "CREATE TRIGGER categories_catalog_tombstone AFTER DELETE ON categories FOR EACH ROW EXECUTE FUNCTION catalog_tombstone()",
+            "DROP TRIGGER IF EXISTS banners_catalog_touch ON banners",
+            "CREATE TRIGGER banners_catalog_touch BEFORE INSERT OR UPDATE ON banners FOR EACH ROW EXECUTE FUNCTION catalog_touch()",
+            "DROP TRIGGER IF EXISTS banners_catalog_tombstone ON banners",
+            "CREATE TRIGGER banners_catalog_tombstone AFTER DELETE ON banners FOR EACH ROW EXECUTE FUNCTION catalog_tombstone()",
+            # Category banners are served inside their category: a change re-versions the category.
+            """
+                CREATE OR REPLACE FUNCTION catalog_touch_category() RETURNS trigger
+                LANGUAGE plpgsql AS $$
+                BEGIN
+                    UPDATE categories SET updated_at = CURRENT_TIMESTAMP
+                    WHERE id = CASE WHEN TG_OP = 'DELETE' THEN OLD.category_id ELSE NEW.category_id END;
+                    RETURN NULL;
+                END
+                $$
+            """,
+            "DROP TRIGGER IF EXISTS category_banners_catalog_touch ON category_banners",
+            "CREATE TRIGGER category_banners_catalog_touch AFTER INSERT OR UPDATE OR DELETE ON category_banners "
+            "FOR EACH ROW EXECUTE FUNCTION catalog_touch_category()",
+        ),
+    ),
+    Migration(
+        13,
+        "catalog_version_statement_lock",
+        (
+            # The catalog advisory lock moves from the row triggers to BEFORE ... FOR EACH STATEMENT
+            # triggers: it is taken before the statement locks any row. Taken in a row trigger, a
+            # writer holding row X could wait for the lock while the lock holder waits for X.
+            """
+                CREATE OR REPLACE FUNCTION catalog_lock() RETURNS trigger
+                LANGUAGE plpgsql AS $$
+                BEGIN
+                    PERFORM pg_advisory_xact_lock(730048);
+                    RETURN NULL;
+                END
+                $$
+            """,
+            """
+                CREATE OR REPLACE FUNCTION catalog_touch() RETURNS trigger
+                LANGUAGE plpgsql AS $$
+                BEGIN
+                    IF TG_OP = 'UPDATE' AND NEW IS NOT DISTINCT FROM OLD THEN
+                        RETURN NEW;
+                    END IF;
+                    NEW.catalog_version := nextval('catalog_version_seq');
+                    NEW.updated_at := CURRENT_TIMESTAMP;
+                    RETURN NEW;
+                END
+                $$
+            """,
+            """
+                CREATE OR REPLACE FUNCTION catalog_tombstone() RETURNS trigger
+                LANGUAGE plpgsql AS $$
+                BEGIN
+                    IF TG_OP = 'TRUNCATE' THEN
+                        -- entity_id NULL: every row of the table is gone, clients reload the snapshot.
+                        INSERT INTO catalog_tombstones (entity, entity_id, catalog_version)
+                        VALUES (TG_TABLE_NAME, NULL, nextval('catalog_version_seq'));
+                        RETURN NULL;
+                    END IF;
+                    INSERT INTO catalog_tombstones (entity, entity_id, catalog_version)
+                    VALUES (TG_TABLE_NAME, OLD.id, nextval('catalog_version_seq'));
+                    RETURN OLD;
+                END
+                $$
+            """,
+            # clock_timestamp(): a banner added in the transaction that wrote the category still
+            # changes the row, so the category is re-versioned.
+            """
+                CREATE OR REPLACE FUNCTION catalog_touch_category() RETURNS trigger
+                LANGUAGE plpgsql AS $$
+                BEGIN
+                    UPDATE categories SET updated_at = clock_timestamp()
+                    WHERE id = CASE WHEN TG_OP = 'DELETE' THEN OLD.category_id ELSE NEW.category_id END;
+                    RETURN NULL;
+                END
+                $$
+            """,
+            "DROP TRIGGER IF EXISTS products_catalog_lock ON products",
+            "CREATE TRIGGER products_catalog_lock BEFORE INSERT OR UPDATE OR DELETE OR TRUNCATE ON products "
+            "FOR EACH STATEMENT EXECUTE FUNCTION catalog_lock()",
+            "DROP TRIGGER IF EXISTS categories_catalog_lock ON categories",
+            "CREATE TRIGGER categories_catalog_lock BEFORE INSERT OR UPDATE OR DELETE ON categories "
+            "FOR EACH STATEMENT EXECUTE FUNCTION catalog_lock()",
+            "DROP TRIGGER IF EXISTS banners_catalog_lock ON banners",
+            "CREATE TRIGGER banners_catalog_lock BEFORE INSERT OR UPDATE OR DELETE ON banners "
+            "FOR EACH STATEMENT EXECUTE FUNCTION catalog_lock()",
+            "DROP TRIGGER IF EXISTS category_banners_catalog_lock ON category_banners",
+            "CREATE TRIGGER category_banners_catalog_lock BEFORE INSERT OR UPDATE OR DELETE ON category_banners "
+            "FOR EACH STATEMENT EXECUTE FUNCTION catalog_lock()",
+        ),
+    ),
+)
 
-    # Column migrations (idempotent in Postgres)
-    c.execute("ALTER TABLE products ADD COLUMN IF NOT EXISTS composition TEXT")
-    c.execute("ALTER TABLE products ADD COLUMN IF NOT EXISTS images TEXT")
-    c.execute("ALTER TABLE products ADD COLUMN IF NOT EXISTS variants TEXT")
-    c.execute("ALTER TABLE products ADD COLUMN IF NOT EXISTS option_names TEXT")
-    c.execute("ALTER TABLE products ADD COLUMN IF NOT EXISTS delivery_info TEXT")
-    c.execute("ALTER TABLE products ADD COLUMN IF NOT EXISTS return_info TEXT")
-    c.execute("ALTER TABLE products ADD COLUMN IF NOT EXISTS external_id TEXT")
-    c.execute("ALTER TABLE products ADD COLUMN IF NOT EXISTS is_bestseller BOOLEAN DEFAULT FALSE")
-    c.execute("ALTER TABLE products ADD COLUMN IF NOT EXISTS is_promotion BOOLEAN DEFAULT FALSE")
-    c.execute("ALTER TABLE products ADD COLUMN IF NOT EXISTS is_new BOOLEAN DEFAULT FALSE")
-    c.execute("ALTER TABLE products ADD COLUMN IF NOT EXISTS discount INTEGER DEFAULT 0")
-    c.execute("ALTER TABLE products ADD COLUMN IF NOT EXISTS is_manually_edited BOOLEAN DEFAULT FALSE")
-    
-    try:
-        c.execute("ALTER TABLE products ADD COLUMN IF NOT EXISTS sku TEXT")
-        c.execute("ALTER TABLE products ADD COLUMN IF NOT EXISTS status TEXT DEFAULT 'В наличии'")
-        c.execute("ALTER TABLE products ADD COLUMN IF NOT EXISTS remains INTEGER DEFAULT 0")
-        c.execute("ALTER TABLE products ADD COLUMN IF NOT EXISTS parent_sku TEXT")
-        c.execute("ALTER TABLE products ADD COLUMN IF NOT EXISTS variant_name TEXT")
-    except Exception:
-        pass
-    try:
-        c.execute("CREATE UNIQUE INDEX IF NOT EXISTS products_external_id_uq ON products (external_id)")
-    except Exception:
-        # If duplicates already exist, index creation may fail; keep server running.
-        pass
 
-    c.execute("ALTER TABLE categories ADD COLUMN IF NOT EXISTS banner_url VARCHAR(255)")
-    c.execute("ALTER TABLE categories ADD COLUMN IF NOT EXISTS external_id TEXT")
-    # User: Nova Poshta branch (warehouse) and Ukrposhta address
-    c.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS user_ukrposhta TEXT")
-    # Orders: delivery type and Ukrposhta address
-    c.execute("ALTER TABLE orders ADD COLUMN IF NOT EXISTS delivery_method TEXT")
-    c.execute("ALTER TABLE orders ADD COLUMN IF NOT EXISTS user_ukrposhta TEXT")
-    c.execute("ALTER TABLE orders ADD COLUMN IF NOT EXISTS push_token TEXT")
-    c.execute("ALTER TABLE orders ADD COLUMN IF NOT EXISTS cashback_applied BOOLEAN DEFAULT FALSE")
-    # User: social ids and bonus protection
-    c.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS google_id TEXT")
-    c.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS facebook_id TEXT")
-    c.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS telegram_id TEXT")
-    c.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS is_bonus_claimed BOOLEAN DEFAULT FALSE")
-    c.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS push_token TEXT")
-    c.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS welcome_push_sent BOOLEAN DEFAULT FALSE")
-    try:
-        c.execute("CREATE UNIQUE INDEX IF NOT EXISTS users_google_id_key ON users (google_id) WHERE google_id IS NOT NULL")
-    except Exception:
-        pass
-    try:
-        c.execute("CREATE UNIQUE INDEX IF NOT EXISTS users_facebook_id_key ON users (facebook_id) WHERE facebook_id IS NOT NULL")
-    except Exception:
-        pass
-    try:
-        c.execute("CREATE UNIQUE INDEX IF NOT EXISTS users_telegram_id_key ON users (telegram_id) WHERE telegram_id IS NOT NULL")
-    except Exception:
-        pass
+# --- БАЗА ДАННЫХ ---
 
-    conn.commit()
-    conn.close()
+def fix_db_schema():
+    """Apply pending migrations (a quick no-op when the schema is current)."""
+    return migrate(MIGRATIONS)
 
 
 def init_db():
     """Инициализация БД (создание таблиц в т.ч. posts для блога). Вызывает fix_db_schema()."""
     fix_db_schema()
+
+
+if __name__ == "__main__":
+    # python -m services.db_schema  (e.g. as a deploy step before starting workers)
+    import logging
+
+    logging.basicConfig(level=logging.INFO)
+    print("applied:", fix_db_schema() or "nothing, schema is current")
+    for item in migration_status(MIGRATIONS):
+        print(item)
@@ -0,0 +1,365 @@
+"""First-party store for ``/api/track`` events with hourly rollups.
+
+Raw events are appended (in batches, by the analytics flusher) to
+``analytics_events``, a table range-partitioned by month on ``occurred_at`` so
+old months can be dropped cheaply. A periodic job re-aggregates the most recent
+hours into two rollup tables:
+
+* ``analytics_hourly_events``: events, unique clients and value per hour and event;
+* ``analytics_hourly_products``: events and value per hour, event and product.
+
+Admin queries read only the rollups, never the raw events.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+from datetime import date, datetime, timedelta
+from typing import Iterable, List, Optional
+
+from db import get_db_connection
+
+logger = logging.getLogger(__name__)
+
+ANALYTICS_ROLLUP_SECONDS = float(os.getenv("ANALYTICS_ROLLUP_SECONDS", "300"))
+# Events can arrive late (buffer flush, retries), so recent hours are recomputed.
+ANALYTICS_ROLLUP_LOOKBACK_HOURS = int(os.getenv("ANALYTICS_ROLLUP_LOOKBACK_HOURS", "2"))
+ANALYTICS_RAW_RETENTION_MONTHS = int(os.getenv("ANALYTICS_RAW_RETENTION_MONTHS", "6"))
+
+_ROLLUP_LOCK_KEY = 730_035
+_rollup_task: Optional[asyncio.Task] = None
+
+
+def _month_start(value: date) -> date:
+    return value.replace(day=1)
+
+
+def _next_month(value: date) -> date:
+    return (value.replace(day=28) + timedelta(days=4)).replace(day=1)
+
+
+def _partition_name(month: date) -> str:
+    return f"analytics_events_{month:%Y%m}"
+
+
+def ensure_partitions(months: Iterable[date] = ()) -> None:
+    """Create monthly partitions for the previous, current and next month (and ``months``)."""
+    this_month = _month_start(date.today())
+    wanted = {_month_start(this_month - timedelta(days=1)), this_month, _next_month(this_month)}
+    wanted.update(_month_start(m) for m in months)
+    conn = get_db_connection()
+    try:
+        cur = conn.cursor()
+        for month in sorted(wanted):
+            cur.execute(
+                f"""
+                CREATE TABLE IF NOT EXISTS {_partition_name(month)}
+                PARTITION OF analytics_events
+                FOR VALUES FROM ('{month.isoformat()}') TO ('{_next_month(month).isoformat()}')
+                """
+            )
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def drop_old_partitions(keep_months: int = ANALYTICS_RAW_RETENTION_MONTHS) -> List[str]:
+    """Drop raw-event partitions older than ``keep_months``; rollups are kept."""
+    cutoff = _month_start(date.today())
+    for _ in range(max(keep_months, 1)):
+        cutoff = _month_start(cutoff - timedelta(days=1))
+    conn = get_db_connection()
+    dropped = []
+    try:
+        rows = conn.execute(
+            """
+            SELECT c.relname AS name
+            FROM pg_inherits i
+            JOIN pg_class c ON c.oid = i.inhrelid
+            JOIN pg_class p ON p.oid = i.inhparent
+            WHERE p.relname = 'analytics_events'
+            """
+        ).fetchall()
+        for row in rows:
+            name = row["name"]
+            suffix = name.rsplit("_", 1)[-1]
+            if len(suffix) == 6 and suffix.isdigit() and suffix < f"{cutoff:%Y%m}":
+                conn.execute(f"DROP TABLE IF EXISTS {name}")
+                dropped.append(name)
+        conn.commit()
+    finally:
+        conn.close()
+    if dropped:
+        logger.info("Analytics store: dropped partitions %s", dropped)
+    return dropped
+
+
+# --- Writing ---
+
+def _product_ids(properties: dict) -> List[str]:
+    ids = properties.get("content_ids") or properties.get("product_ids") or []
+    if not isinstance(ids, list):
+        ids = [ids]
+    for key in ("product_id", "item_id", "content_id"):
+        if properties.get(key):
+            ids.append(properties[key])
+    return sorted({str(value) for value in ids if value not in (None, "")})
+
+
+def _client_id(user_data: dict) -> Optional[str]:
+    if user_data.get("client_id"):
+        return str(user_data["client_id"])
+    phone = user_data.get("phone")
+    # Never store raw phone numbers in the analytics table.
+    return hashlib.sha256(str(phone).encode("utf-8")).hexdigest()[:32] if phone else None
+
+
+def _value(properties: dict) -> Optional[float]:
+    try:
+        return float(properties["value"]) if properties.get("value") is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+def _event_row(event: dict) -> tuple:
+    properties = event.get("data") or {}
+    return (
+        datetime.fromtimestamp(event["event_time"]),
+        event["event_name"],
+        _product_ids(properties),
+        _client_id(event.get("user_data") or {}),
+        _value(properties),
+        json.dumps(properties, ensure_ascii=False, default=str),
+    )
+
+
+def _insert(rows: List[tuple]) -> None:
+    conn = get_db_connection()
+    try:
+        conn.cursor().execute_values(
+            """
+            INSERT INTO analytics_events (occurred_at, event_name, product_ids, client_id, value, properties)
+            VALUES ?
+            """,
+            rows,
+        )
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def store_events(events: List[dict]) -> int:
+    """Append events (as buffered by services.analytics) to the raw store."""
+    rows = [_event_row(event) for event in events]
+    if not rows:
+        return 0
+    try:
+        _insert(rows)
+    except Exception as exc:
+        if "no partition" not in str(exc):
+            raise
+        ensure_partitions(row[0].date() for row in rows)
+        _insert(rows)
+    return len(rows)
+
+
+# --- Rollups ---
+
+def rollup(since: datetime, until: Optional[datetime] = None) -> bool:
+    """Recompute hourly rollups for ``[since, until)``. Returns False if another worker is rolling up."""
+    since = since.replace(minute=0, second=0, microsecond=0)
+    until = until or datetime.now().replace(minute=0, second=0, microsecond=0) + timedelta(hours=1)
+    conn = get_db_connection()
+    try:
+        locked = conn.execute("SELECT pg_try_advisory_xact_lock(?) AS locked", (_ROLLUP_LOCK_KEY,)).fetchone()
+        if not locked or not locked["locked"]:
+            conn.rollback()
+            return False
+        conn.execute(
+            """
+            INSERT INTO analytics_hourly_events (hour, event_name, events, unique_clients, value_sum)
+            SELECT date_trunc('hour', occurred_at), event_name,
+                   COUNT(*), COUNT(DISTINCT client_id), COALESCE(SUM(value), 0)
+            FROM analytics_events
+            WHERE occurred_at >= ? AND occurred_at < ?
+            GROUP BY 1, 2
+            ON CONFLICT (hour, event_name) DO UPDATE SET
+                events = EXCLUDED.events,
+                unique_clients = EXCLUDED.unique_clients,
+                value_sum = EXCLUDED.value_sum
+            """,
+            (since, until),
+        )
+        conn.execute(
+            """
+            INSERT INTO analytics_hourly_products (hour, event_name, product_id, events, value_sum)
+            SELECT date_trunc('hour', e.occurred_at), e.event_name, p.product_id,
+                   COUNT(*), COALESCE(SUM(e.value), 0)
+            FROM analytics_events e
+            CROSS JOIN LATERAL unnest(e.product_ids) AS p(product_id)
+            WHERE e.occurred_at >= ? AND e.occurred_at < ?
+            GROUP BY 1, 2, 3
+            ON CONFLICT (hour, event_name, product_id) DO UPDATE SET
+                events = EXCLUDED.events,
+                value_sum = EXCLUDED.value_sum
+            """,
+            (since, until),
+        )
+        conn.commit()
+        return True
+    finally:
+        conn.close()
+
+
+def rollup_recent() -> bool:
+    now = datetime.now()
+    return rollup(now - timedelta(hours=ANALYTICS_ROLLUP_LOOKBACK_HOURS))
+
+
+async def _rollup_loop() -> None:
+    last_maintenance = None
+    while True:
+        try:
+            if last_maintenance != date.today():
+                await asyncio.to_thread(ensure_partitions)
+                await asyncio.to_thread(drop_old_partitions)
+                last_maintenance = date.today()
+            await asyncio.to_thread(rollup_recent)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Analytics rollup failed")
+        await asyncio.sleep(ANALYTICS_ROLLUP_SECONDS)
+
+
+def start_rollup_job() -> None:
+    """Start the periodic partition maintenance + rollup loop (app startup hook)."""
+    global _rollup_task
+    if _rollup_task is None or _rollup_task.done():
+        _rollup_task = asyncio.get_running_loop().create_task(_rollup_loop())
+
+
+async def stop_rollup_job() -> None:
+    global _rollup_task
+    if _rollup_task is not None:
+        _rollup_task.cancel()
+        try:
+            await _rollup_task
+        except asyncio.CancelledError:
+            pass
+        _rollup_task = None
+
+
+# --- Queries (rollups only) ---
+
+def _range(date_from: Optional[str], date_to: Optional[str]) -> tuple:
+    """Parse ISO dates/datetimes; defaults to today. ``date_to`` is inclusive for plain dates."""
+    start = datetime.fromisoformat(date_from) if date_from else datetime.combine(date.today(), datetime.min.time())
+    if date_to:
+        end = datetime.fromisoformat(date_to)
+        if len(date_to) <= 10:
+            end += timedelta(days=1)
+    else:
+        end = datetime.now() + timedelta(hours=1)
+    return start, end
+
+
+def event_series(date_from: Optional[str], date_to: Optional[str], event_name: Optional[str], granularity: str) -> List[dict]:
+    start, end = _range(date_from, date_to)
+    bucket = "day" if granularity == "day" else "hour"
+    where = "hour >= ? AND hour < ?"
+    params: list = [start, end]
+    if event_name:
+        where += " AND event_name = ?"
+        params.append(event_name)
+    conn = get_db_connection()
+    try:
+        rows = conn.execute(
+            f"""
+            SELECT date_trunc('{bucket}', hour) AS bucket, event_name,
+                   SUM(events) AS events, SUM(unique_clients) AS unique_clients, SUM(value_sum) AS value_sum
+            FROM analytics_hourly_events
+            WHERE {where}
+            GROUP BY 1, 2
+            ORDER BY 1, 2
+            """,
+            tuple(params),
+        ).fetchall()
+    finally:
+        conn.close()
+    series = [dict(row) for row in rows]
+    if bucket == "day":
+        # Hourly unique counts do not add up to daily uniques.
+        for row in series:
+            row.pop("unique_clients", None)
+    return series
+
+
+def top_products(date_from: Optional[str], date_to: Optional[str], event_name: str, limit: int) -> List[dict]:
+    start, end = _range(date_from, date_to)
+    conn = get_db_connection()
+    try:
+        rows = conn.execute(
+            """
+            SELECT product_id, SUM(events) AS events, SUM(value_sum) AS value_sum
+            FROM analytics_hourly_products
+            WHERE hour >= ? AND hour < ? AND event_name = ?
+            GROUP BY product_id
+            ORDER BY events DESC
+            LIMIT ?
+            """,
+            (start, end, event_name, limit),
+        ).fetchall()
+    finally:
+        conn.close()
+    return [dict(row) for row in rows]
+
+
+def product_event_counts(product_id: str, date_from: Optional[str], date_to: Optional[str]) -> dict:
+    start, end = _range(date_from, date_to)
+    conn = get_db_connection()
+    try:
+        rows = conn.execute(
+            """
+            SELECT event_name, SUM(events) AS events, SUM(value_sum) AS value_sum
+            FROM analytics_hourly_products
+            WHERE product_id = ? AND hour >= ? AND hour < ?
+            GROUP BY event_name
+            """,
+            (str(product_id), start, end),
+        ).fetchall()
+    finally:
+        conn.close()
+    return {row["event_name"]: {"events": int(row["events"]), "value_sum": float(row["value_sum"] or 0)} for row in rows}
+
+
+def funnel(steps: List[str], date_from: Optional[str], date_to: Optional[str]) -> List[dict]:
+    start, end = _range(date_from, date_to)
+    conn = get_db_connection()
+    try:
+        rows = conn.execute(
+            """
+            SELECT event_name, SUM(events) AS events
+            FROM analytics_hourly_events
+            WHERE hour >= ? AND hour < ? AND event_name = ANY(?)
+            GROUP BY event_name
+            """,
+            (start, end, steps),
+        ).fetchall()
+    finally:
+        conn.close()
+    counts = {row["event_name"]: int(row["events"] or 0) for row in rows}
+    result, previous = [], None
+    for step in steps:
+        events = counts.get(step, 0)
+        result.append({
+            "event_name": step,
+            "events": events,
+            "conversion_from_previous": round(events / previous, 4) if previous else None,
+        })
+        previous = events
+    return result
@@ -0,0 +1,218 @@
+"""Shared outbound HTTP clients, one pooled ``httpx.AsyncClient`` per upstream.
+
+Clients are created on application startup and closed on shutdown, so
+keep-alive connections (and HTTP/2 where the upstream supports it) are reused
+across requests instead of paying DNS, TCP and TLS setup on every call. Each
+upstream has its own connection limits, timeouts and retry policy, and
+per-upstream latency/error metrics are kept in memory for the admin API (and
+exported as Prometheus histograms on ``/metrics``).
+
+Usage::
+
+    client = get_http_client("monobank")
+    response = await client.post(url, json=payload)
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import random
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Deque, Dict, Optional
+
+import httpx
+
+from services.metrics import observe_upstream
+
+
+logger = logging.getLogger(__name__)
+
+# Status codes that mean "try again later" rather than "your request is wrong".
+RETRY_STATUS_CODES = {429, 502, 503, 504}
+IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS", "PUT", "DELETE"}
+_LATENCY_WINDOW = 500
+
+
+@dataclass(frozen=True)
+class UpstreamConfig:
+    timeout: float = 10.0
+    connect_timeout: float = 5.0
+    max_connections: int = 20
+    max_keepalive_connections: int = 10
+    keepalive_expiry: float = 60.0
+    http2: bool = True
+    # Connection failures are always safe to retry (nothing reached the upstream).
+    retries: int = 2
+    # Also retry read timeouts and 429/5xx responses of POST requests. Only for
+    # upstreams where POST is a read (Nova Poshta) or duplicates are harmless.
+    retry_posts: bool = False
+    backoff: float = 0.2
+
+
+UPSTREAMS: Dict[str, UpstreamConfig] = {
+    "monobank": UpstreamConfig(timeout=15.0, max_connections=10, retries=1),
+    "facebook": UpstreamConfig(timeout=10.0, max_connections=10),
+    "google_analytics": UpstreamConfig(timeout=10.0, max_connections=10),
+    "onebox": UpstreamConfig(timeout=30.0, max_connections=10, retries=1),
+    "nova_poshta": UpstreamConfig(timeout=10.0, max_connections=10, retry_posts=True),
+    "horoshop": UpstreamConfig(timeout=120.0, max_connections=4, retries=1),
+    "expo": UpstreamConfig(timeout=30.0, max_connections=10, max_keepalive_connections=10, retries=2),
+}
+
+
+class _UpstreamMetrics:
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.retries = 0
+        self.status_counts: Dict[str, int] = {}
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.latencies: Deque[float] = deque(maxlen=_LATENCY_WINDOW)
+
+    def snapshot(self) -> dict:
+        recent = sorted(self.latencies)
+
+        def percentile(share: float) -> Optional[float]:
+            if not recent:
+                return None
+            return round(recent[min(len(recent) - 1, int(len(recent) * share))], 1)
+
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "retries": self.retries,
+            "status": dict(self.status_counts),
+            "avg_ms": round(self.total_ms / self.requests, 1) if self.requests else None,
+            "max_ms": round(self.max_ms, 1),
+            "p50_ms": percentile(0.5),
+            "p95_ms": percentile(0.95),
+        }
+
+
+_metrics_lock = threading.Lock()
+_metrics: Dict[str, _UpstreamMetrics] = {name: _UpstreamMetrics() for name in UPSTREAMS}
+
+
+def _record(name: str, elapsed_ms: float, status: Optional[int], retried: bool) -> None:
+    observe_upstream(name, elapsed_ms / 1000, status)
+    with _metrics_lock:
+        metrics = _metrics.setdefault(name, _UpstreamMetrics())
+        metrics.requests += 1
+        metrics.total_ms += elapsed_ms
+        metrics.max_ms = max(metrics.max_ms, elapsed_ms)
+        metrics.latencies.append(elapsed_ms)
+        if retried:
+            metrics.retries += 1
+        key = f"{status // 100}xx" if status else "error"
+        metrics.status_counts[key] = metrics.status_counts.get(key, 0) + 1
+        if status is None or status >= 500:
+            metrics.errors += 1
+
+
+def get_http_metrics() -> dict:
+    """Per-upstream request counts, retries, status classes and latency (ms)."""
+    with _metrics_lock:
+        return {name: metrics.snapshot() for name, metrics in _metrics.items()}
+
+
+class UpstreamClient:
+    """``httpx.AsyncClient`` wrapper adding retries and metrics for one upstream."""
+
+    def __init__(self, name: str, config: UpstreamConfig):
+        self.name = name
+        self.config = config
+        self._client = self._build_client()
+
+    def _build_client(self) -> httpx.AsyncClient:
+        config = self.config
+        kwargs = dict(
+            timeout=httpx.Timeout(config.timeout, connect=config.connect_timeout),
+            limits=httpx.Limits(
+                max_connections=config.max_connections,
+                max_keepalive_connections=config.max_keepalive_connections,
+                keepalive_expiry=config.keepalive_expiry,
+            ),
+        )
+        if config.http2:
+            try:
+                return httpx.AsyncClient(http2=True, **kwargs)
+            except ImportError:
+                logger.warning("HTTP client %s: h2 package missing, using HTTP/1.1", self.name)
+        return httpx.AsyncClient(**kwargs)
+
+    @property
+    def is_closed(self) -> bool:
+        return self._client.is_closed
+
+    async def aclose(self) -> None:
+        await self._client.aclose()
+
+    def _can_retry(self, method: str, exc: Optional[Exception], status: Optional[int]) -> bool:
+        if isinstance(exc, (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)):
+            return True
+        if method.upper() not in IDEMPOTENT_METHODS and not self.config.retry_posts:
+            return False
+        if exc is not None:
+            return isinstance(exc, (httpx.ReadTimeout, httpx.RemoteProtocolError))
+        return status in RETRY_STATUS_CODES
+
+    async def request(self, method: str, url: str, **kwargs) -> httpx.Response:
+        attempt = 0
+        while True:
+            started = time.perf_counter()
+            try:
+                response = await self._client.request(method, url, **kwargs)
+            except httpx.HTTPError as exc:
+                _record(self.name, (time.perf_counter() - started) * 1000, None, attempt > 0)
+                if attempt >= self.config.retries or not self._can_retry(method, exc, None):
+                    raise
+                logger.info("HTTP client %s: %s %s failed (%s), retrying", self.name, method, url.split("?")[0], exc)
+            else:
+                _record(self.name, (time.perf_counter() - started) * 1000, response.status_code, attempt > 0)
+                if attempt >= self.config.retries or not self._can_retry(method, None, response.status_code):
+                    return response
+                logger.info("HTTP client %s: %s %s -> %s, retrying", self.name, method, url.split("?")[0], response.status_code)
+            attempt += 1
+            await asyncio.sleep(self.config.backoff * (2 ** (attempt - 1)) * (1 + random.random()))
+
+    async def get(self, url: str, **kwargs) -> httpx.Response:
+        return await self.request("GET", url, **kwargs)
+
+    async def post(self, url: str, **kwargs) -> httpx.Response:
+        return await self.request("POST", url, **kwargs)
+
+
+_clients: Dict[str, UpstreamClient] = {}
+
+
+def get_http_client(name: str) -> UpstreamClient:
+    """Return the shared client for ``name`` (created lazily outside the app lifetime)."""
+    client = _clients.get(name)
+    if client is None or client.is_closed:
+        if name not in UPSTREAMS:
+            raise KeyError(f"Unknown upstream: {name}")
+        client = UpstreamClient(name, UPSTREAMS[name])
+        _clients[name] = client
+    return client
+
+
+def start_http_clients() -> None:
+    """Create all upstream clients (call from the app startup hook)."""
+    for name in UPSTREAMS:
+        get_http_client(name)
+
+
+async def close_http_clients() -> None:
+    """Close all upstream clients and their pooled connections."""
+    clients = list(_clients.values())
+    _clients.clear()
+    for client in clients:
+        try:
+            await client.aclose()
+        except Exception as exc:
+            logger.warning("HTTP client %s: close failed: %s", client.name, exc)
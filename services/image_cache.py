@@ -0,0 +1,297 @@
+"""Managed cache for resized image derivatives.
+
+Derivatives produced by ``/api/image`` are written under the ``.cache/`` prefix
+of the configured storage backend and tracked in the ``image_cache`` table. The
+index keeps per-entry size and hit counts so the cache can be held under a byte
+budget with LRU or LFU eviction, and entries for deleted or re-uploaded sources
+can be removed.
+"""
+
+from __future__ import annotations
+
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Dict, Optional
+
+from db import get_db_connection
+from services.storage import get_storage
+
+
+logger = logging.getLogger(__name__)
+
+CACHE_DIR_NAME = ".cache"
+
+IMAGE_CACHE_MAX_BYTES = int(os.getenv("IMAGE_CACHE_MAX_BYTES", str(1024 * 1024 * 1024)))
+IMAGE_CACHE_POLICY = (os.getenv("IMAGE_CACHE_POLICY", "lru") or "lru").strip().lower()
+IMAGE_CACHE_HIT_FLUSH_SIZE = int(os.getenv("IMAGE_CACHE_HIT_FLUSH_SIZE", "100"))
+IMAGE_CACHE_HIT_FLUSH_SECONDS = float(os.getenv("IMAGE_CACHE_HIT_FLUSH_SECONDS", "30"))
+
+# Evict down to this share of the budget so every miss does not trigger eviction.
+_EVICT_TARGET_RATIO = 0.9
+_EVICT_BATCH = 200
+# Unindexed files younger than this may belong to a render still in progress.
+_ORPHAN_GRACE_SECONDS = 60
+
+_lock = threading.Lock()
+_pending_hits: Dict[str, int] = {}
+_last_flush = time.monotonic()
+_counters = {"hits": 0, "misses": 0, "evicted": 0, "evicted_bytes": 0}
+
+
+def _remove_file(cache_key: str) -> None:
+    try:
+        get_storage().delete(cache_key)
+    except Exception as exc:
+        logger.warning("Image cache: failed to remove %s: %s", cache_key, exc)
+
+
+def record_hit(cache_key: str) -> None:
+    """Count a cache hit. Hits are buffered and flushed to the index in batches."""
+    global _last_flush
+    with _lock:
+        _counters["hits"] += 1
+        _pending_hits[cache_key] = _pending_hits.get(cache_key, 0) + 1
+        due = (
+            sum(_pending_hits.values()) >= IMAGE_CACHE_HIT_FLUSH_SIZE
+            or time.monotonic() - _last_flush >= IMAGE_CACHE_HIT_FLUSH_SECONDS
+        )
+        if not due:
+            return
+        pending = dict(_pending_hits)
+        _pending_hits.clear()
+        _last_flush = time.monotonic()
+    _flush_hits(pending)
+
+
+def _flush_hits(pending: Dict[str, int]) -> None:
+    if not pending:
+        return
+    now = datetime.now()
+    try:
+        conn = get_db_connection()
+        try:
+            conn.cursor().executemany(
+                "UPDATE image_cache SET hits = hits + ?, last_access = ? WHERE cache_key = ?",
+                [(count, now, key) for key, count in pending.items()],
+            )
+            conn.commit()
+        finally:
+            conn.close()
+    except Exception as exc:
+        logger.warning("Image cache: failed to flush hit counters: %s", exc)
+
+
+def flush_pending_hits() -> None:
+    """Write buffered hit counters to the index (used on shutdown and before stats)."""
+    global _last_flush
+    with _lock:
+        pending = dict(_pending_hits)
+        _pending_hits.clear()
+        _last_flush = time.monotonic()
+    _flush_hits(pending)
+
+
+def register_entry(cache_key: str, source: str, source_mtime: int, size_bytes: int) -> None:
+    """Index a freshly written derivative and enforce the cache budget.
+
+    Derivatives of the same source built from an older ``source_mtime`` are
+    stale (the original was re-uploaded) and are dropped right away.
+    """
+    with _lock:
+        _counters["misses"] += 1
+
+    now = datetime.now()
+    try:
+        conn = get_db_connection()
+        try:
+            cur = conn.cursor()
+            cur.execute(
+                """
+                INSERT INTO image_cache (cache_key, source, source_mtime, size_bytes, hits, created_at, last_access)
+                VALUES (?, ?, ?, ?, 0, ?, ?)
+                ON CONFLICT (cache_key) DO UPDATE
+                SET size_bytes = EXCLUDED.size_bytes, last_access = EXCLUDED.last_access
+                """,
+                (cache_key, source, int(source_mtime or 0), size_bytes, now, now),
+            )
+            stale = cur.execute(
+                "DELETE FROM image_cache WHERE source = ? AND source_mtime <> ? RETURNING cache_key",
+                (source, int(source_mtime or 0)),
+            ).fetchall()
+            conn.commit()
+        finally:
+            conn.close()
+    except Exception as exc:
+        logger.warning("Image cache: failed to index %s: %s", cache_key, exc)
+        return
+
+    for row in stale:
+        _remove_file(row["cache_key"])
+    evict_if_needed()
+
+
+def invalidate_source(source: str) -> int:
+    """Drop every derivative built from ``source``. Returns number of entries removed."""
+    conn = get_db_connection()
+    try:
+        rows = conn.execute(
+            "DELETE FROM image_cache WHERE source = ? RETURNING cache_key",
+            (source,),
+        ).fetchall()
+        conn.commit()
+    finally:
+        conn.close()
+    for row in rows:
+        _remove_file(row["cache_key"])
+    return len(rows)
+
+
+def _eviction_order_sql() -> str:
+    if IMAGE_CACHE_POLICY == "lfu":
+        return "ORDER BY hits ASC, last_access ASC"
+    return "ORDER BY last_access ASC"
+
+
+def evict_if_needed(max_bytes: Optional[int] = None) -> int:
+    """Evict least recently (or least frequently) used entries above the byte budget."""
+    budget = IMAGE_CACHE_MAX_BYTES if max_bytes is None else max_bytes
+    if budget <= 0:
+        return 0
+
+    conn = get_db_connection()
+    evicted = 0
+    freed = 0
+    try:
+        row = conn.execute("SELECT COALESCE(SUM(size_bytes), 0) AS total FROM image_cache").fetchone()
+        total = int((row or {}).get("total") or 0)
+        if total <= budget:
+            return 0
+
+        target = int(budget * _EVICT_TARGET_RATIO)
+        while total > target:
+            rows = conn.execute(
+                f"SELECT cache_key, size_bytes FROM image_cache {_eviction_order_sql()} LIMIT ?",
+                (_EVICT_BATCH,),
+            ).fetchall()
+            if not rows:
+                break
+            victims = []
+            for victim in rows:
+                if total <= target:
+                    break
+                victims.append(victim["cache_key"])
+                total -= int(victim["size_bytes"] or 0)
+                freed += int(victim["size_bytes"] or 0)
+            placeholders = ",".join("?" for _ in victims)
+            conn.execute(f"DELETE FROM image_cache WHERE cache_key IN ({placeholders})", victims)
+            conn.commit()
+            for key in victims:
+                _remove_file(key)
+            evicted += len(victims)
+    finally:
+        conn.close()
+
+    with _lock:
+        _counters["evicted"] += evicted
+        _counters["evicted_bytes"] += freed
+    if evicted:
+        logger.info("Image cache: evicted %s entries (%s bytes), policy=%s", evicted, freed, IMAGE_CACHE_POLICY)
+    return evicted
+
+
+def _in_grace_period(storage, key: str, now: float) -> bool:
+    """True for files a concurrent render may still be writing or about to index."""
+    if key.endswith(".tmp"):
+        return True
+    try:
+        return now - storage.mtime(key) < _ORPHAN_GRACE_SECONDS
+    except FileNotFoundError:
+        return True
+
+
+def purge_orphans() -> dict:
+    """Remove index rows whose source or derivative file is gone, and unindexed files.
+
+    The index is read before the files are listed: a derivative is written
+    before it is indexed, so every indexed key is already on disk. Unindexed
+    files are only removed once they are older than the grace period, which
+    spares in-flight ``*.tmp`` writes and renders not yet registered.
+    """
+    flush_pending_hits()
+    storage = get_storage()
+    conn = get_db_connection()
+    try:
+        rows = conn.execute("SELECT cache_key, source FROM image_cache").fetchall()
+        cached_keys = set(storage.list_keys(f"{CACHE_DIR_NAME}/"))
+        indexed = set()
+        orphaned = []
+        existing_sources = {}
+        for row in rows:
+            key = row["cache_key"]
+            source = row["source"]
+            if source not in existing_sources:
+                existing_sources[source] = storage.exists(source)
+            if not existing_sources[source] or key not in cached_keys:
+                orphaned.append(key)
+            else:
+                indexed.add(key)
+        for start in range(0, len(orphaned), _EVICT_BATCH):
+            chunk = orphaned[start : start + _EVICT_BATCH]
+            placeholders = ",".join("?" for _ in chunk)
+            conn.execute(f"DELETE FROM image_cache WHERE cache_key IN ({placeholders})", chunk)
+        conn.commit()
+    finally:
+        conn.close()
+
+    for key in orphaned:
+        _remove_file(key)
+
+    unindexed = 0
+    now = time.time()
+    for key in cached_keys - indexed - set(orphaned):
+        if _in_grace_period(storage, key, now):
+            continue
+        _remove_file(key)
+        unindexed += 1
+
+    return {"removed_entries": len(orphaned), "removed_unindexed_files": unindexed}
+
+
+def get_cache_stats() -> dict:
+    """Return index totals plus hit/miss counters of this worker process."""
+    flush_pending_hits()
+    conn = get_db_connection()
+    try:
+        row = conn.execute(
+            """
+            SELECT COUNT(*) AS entries,
+                   COALESCE(SUM(size_bytes), 0) AS bytes_used,
+                   COALESCE(SUM(hits), 0) AS total_hits
+            FROM image_cache
+            """
+        ).fetchone() or {}
+    finally:
+        conn.close()
+
+    with _lock:
+        counters = dict(_counters)
+
+    entries = int(row.get("entries") or 0)
+    total_hits = int(row.get("total_hits") or 0)
+    lookups = counters["hits"] + counters["misses"]
+    indexed_lookups = total_hits + entries
+    return {
+        "policy": IMAGE_CACHE_POLICY,
+        "max_bytes": IMAGE_CACHE_MAX_BYTES,
+        "bytes_used": int(row.get("bytes_used") or 0),
+        "entries": entries,
+        "total_hits": total_hits,
+        "hit_ratio": round(total_hits / indexed_lookups, 4) if indexed_lookups else 0.0,
+        "process": {
+            **counters,
+            "hit_ratio": round(counters["hits"] / lookups, 4) if lookups else 0.0,
+        },
+    }
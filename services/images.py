@@ -4,68 +4,195 @@ from __future__ import annotations
 
 import hashlib
 import os
-import uuid
+import re
+import tempfile
+from datetime import datetime
 from io import BytesIO
 from urllib.parse import urlparse
 
-import httpx
 from fastapi import HTTPException, Request, UploadFile
-from fastapi.responses import FileResponse
+from fastapi.responses import Response
 from PIL import Image as PILImage, ImageOps
 
+from db import get_db_connection
+from services.image_cache import CACHE_DIR_NAME, invalidate_source, record_hit, register_entry
+from services.storage import UPLOADS_DIR, get_storage
 
-UPLOADS_DIR = os.path.abspath(os.getenv("UPLOADS_DIR", "uploads"))
-os.makedirs(UPLOADS_DIR, exist_ok=True)
+
+try:
+    import pillow_avif  # noqa: F401  # registers the AVIF codec on Pillow < 11.3
+except ImportError:
+    pillow_avif = None
+
+
+# Requested sizes and qualities are snapped to these steps so clients asking for
+# 301px and 320px share one derivative instead of splintering the cache.
+SIZE_LADDER = (64, 128, 192, 256, 384, 512, 640, 768, 1024, 1280, 1600, 2048)
+QUALITY_LADDER = (50, 65, 80, 90)
+DEFAULT_MAX_SIDE = 1280
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+# Derivatives of legacy names: the file can be replaced under the same URL, only the ETag changes.
+REVALIDATE_CACHE_CONTROL = "public, max-age=600, must-revalidate"
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+# Content-addressed uploads never change under the same name, so their key alone
+# identifies the source and no stat call is needed on the storage backend.
+CONTENT_ADDRESSED_RE = re.compile(r"^[0-9a-f]{64}\.[a-z0-9]+$")
+
+PILImage.init()
+AVIF_SUPPORTED = "AVIF" in PILImage.SAVE
+
+MEDIA_TYPES = {
+    "avif": "image/avif",
+    "webp": "image/webp",
+    "jpg": "image/jpeg",
+    "png": "image/png",
+}
 
 
 async def save_uploaded_image(file: UploadFile) -> str:
-    """Save uploaded image and return relative public URL."""
-    os.makedirs(UPLOADS_DIR, exist_ok=True)
+    """Save uploaded image under its content hash and return relative public URL.
+
+    The upload is streamed to a temporary file in chunks while it is hashed.
+    Identical content maps to one stored object; every save adds a reference in
+    ``upload_blobs`` that is dropped again by ``release_uploaded_image``.
+    """
+    storage = get_storage()
     ext = os.path.splitext(file.filename or "")[1] or ".jpg"
     if ext.lower() not in (".jpg", ".jpeg", ".png", ".gif", ".webp"):
         ext = ".jpg"
-    name = f"{uuid.uuid4().hex}{ext}"
-    path = os.path.join(UPLOADS_DIR, name)
-    content = await file.read()
-    with open(path, "wb") as file_handle:
-        file_handle.write(content)
+
+    hasher = hashlib.sha256()
+    size_bytes = 0
+    fd, tmp_path = tempfile.mkstemp(prefix=".upload_", suffix=".tmp", dir=storage.tmp_dir)
+    try:
+        with os.fdopen(fd, "wb") as file_handle:
+            while True:
+                chunk = await file.read(UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                hasher.update(chunk)
+                size_bytes += len(chunk)
+                file_handle.write(chunk)
+
+        content_hash = hasher.hexdigest()
+        conn = get_db_connection()
+        try:
+            row = conn.execute(
+                """
+                INSERT INTO upload_blobs (content_hash, path, size_bytes, ref_count, created_at)
+                VALUES (?, ?, ?, 1, ?)
+                ON CONFLICT (content_hash) DO UPDATE SET ref_count = upload_blobs.ref_count + 1
+                RETURNING path
+                """,
+                (content_hash, f"{content_hash}{ext.lower()}", size_bytes, datetime.now()),
+            ).fetchone()
+            name = row["path"]
+            if not storage.exists(name):
+                storage.put_file(name, tmp_path)
+            conn.commit()
+        finally:
+            conn.close()
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
     return f"/uploads/{name}"
 
 
-def get_resized_uploaded_image(
-    request: Request,
-    src: str,
-    w: int = 0,
-    h: int = 0,
-    q: int = 80,
-    format: str = "jpg",
-):
-    """Serve a resized/cached version of an uploaded image."""
-    fmt = (format or "jpg").lower().strip(".")
-    if fmt == "jpeg":
-        fmt = "jpg"
-    if fmt not in {"jpg", "png", "webp"}:
-        raise HTTPException(status_code=400, detail="Unsupported format")
+def _upload_name_from_url(url: str | None) -> str | None:
+    value = (url or "").strip()
+    if value.startswith("http://") or value.startswith("https://"):
+        value = urlparse(value).path
+    for prefix in ("/uploads/", "uploads/"):
+        if value.startswith(prefix):
+            name = value[len(prefix) :]
+            return name if name and "/" not in name and name != ".." else None
+    return None
 
-    try:
-        quality = int(q)
-    except Exception:
-        quality = 80
-    quality = max(30, min(95, quality))
 
+def _is_upload_referenced(conn, url: str) -> bool:
+    row = conn.execute(
+        """
+        SELECT 1 WHERE
+            EXISTS (SELECT 1 FROM products WHERE image = ? OR images @> jsonb_build_array(CAST(? AS TEXT)))
+            OR EXISTS (SELECT 1 FROM banners WHERE image_url = ?)
+            OR EXISTS (SELECT 1 FROM categories WHERE banner_url = ?)
+            OR EXISTS (SELECT 1 FROM category_banners WHERE image_url = ?)
+            OR EXISTS (SELECT 1 FROM posts WHERE image_url = ?)
+        """,
+        (url, url, url, url, url, url),
+    ).fetchone()
+    return bool(row)
+
+
+def release_uploaded_image(url: str | None) -> bool:
+    """Drop one reference to an uploaded image; delete it when nothing uses it.
+
+    Legacy uploads that are not tracked in ``upload_blobs`` and external URLs are
+    left untouched. Returns True when the file was removed.
+    """
+    name = _upload_name_from_url(url)
+    if not name:
+        return False
+
+    conn = get_db_connection()
     try:
-        max_w = int(w)
-        max_h = int(h)
-    except Exception:
-        max_w, max_h = 0, 0
+        row = conn.execute(
+            "UPDATE upload_blobs SET ref_count = GREATEST(ref_count - 1, 0) WHERE path = ? RETURNING ref_count",
+            (name,),
+        ).fetchone()
+        if not row or int(row["ref_count"] or 0) > 0 or _is_upload_referenced(conn, f"/uploads/{name}"):
+            conn.commit()
+            return False
+        conn.execute("DELETE FROM upload_blobs WHERE path = ? AND ref_count <= 0", (name,))
+        conn.commit()
+    finally:
+        conn.close()
 
-    if max_w <= 0 and max_h <= 0:
-        max_w = 1200
-    if max_w <= 0:
-        max_w = 99999
-    if max_h <= 0:
-        max_h = 99999
+    get_storage().delete(name)
+    invalidate_source(name)
+    return True
+
+
+def snap_dimension(value: int) -> int:
+    """Round a requested side up to the nearest ladder step (0 means unbounded)."""
+    if value <= 0:
+        return 0
+    for step in SIZE_LADDER:
+        if value <= step:
+            return step
+    return SIZE_LADDER[-1]
+
+
+def snap_quality(value: int) -> int:
+    """Round a requested quality to the nearest ladder step."""
+    return min(QUALITY_LADDER, key=lambda step: (abs(step - value), -step))
+
+
+def negotiate_image_format(accept: str | None, requested: str | None = None) -> tuple[str, bool]:
+    """Pick the output format.
+
+    An explicit ``format`` query value wins for backward compatibility. Otherwise
+    the best format listed in ``Accept`` is used: AVIF, then WebP, then JPEG.
+    Returns ``(format, negotiated)``; negotiated responses must carry ``Vary: Accept``.
+    """
+    fmt = (requested or "").lower().strip(".")
+    if fmt == "jpeg":
+        fmt = "jpg"
+    if fmt and fmt != "auto":
+        if fmt not in MEDIA_TYPES or (fmt == "avif" and not AVIF_SUPPORTED):
+            raise HTTPException(status_code=400, detail="Unsupported format")
+        return fmt, False
 
+    accept_value = (accept or "").lower()
+    if AVIF_SUPPORTED and "image/avif" in accept_value:
+        return "avif", True
+    if "image/webp" in accept_value:
+        return "webp", True
+    return "jpg", True
+
+
+def _resolve_source_key(src: str) -> str:
     safe_src = (src or "").strip()
     if not safe_src:
         raise HTTPException(status_code=400, detail="src is required")
@@ -84,94 +211,112 @@ def get_resized_uploaded_image(
         raise HTTPException(status_code=400, detail="src must point to /uploads")
 
     rel_path = rel_path.lstrip("/\\")
-    norm_rel = os.path.normpath(rel_path)
-    if norm_rel.startswith("..") or os.path.isabs(norm_rel):
+    norm_rel = os.path.normpath(rel_path).replace("\\", "/")
+    if norm_rel.startswith("..") or os.path.isabs(norm_rel) or norm_rel.startswith(f"{CACHE_DIR_NAME}/"):
         raise HTTPException(status_code=400, detail="Invalid src path")
+    return norm_rel
 
-    src_path = os.path.abspath(os.path.join(UPLOADS_DIR, norm_rel))
-    if os.path.commonpath([UPLOADS_DIR, src_path]) != UPLOADS_DIR:
-        raise HTTPException(status_code=400, detail="Invalid src path")
 
-    src_bytes = None
+def _render_derivative(source, fmt: str, max_w: int, max_h: int, quality: int) -> bytes:
+    with PILImage.open(source) as image:
+        image = ImageOps.exif_transpose(image)
+        if fmt == "jpg" and image.mode != "RGB":
+            image = image.convert("RGB")
+        elif fmt in {"webp", "avif"} and image.mode not in {"RGB", "RGBA"}:
+            image = image.convert("RGBA" if "transparency" in image.info else "RGB")
+        image.thumbnail((max_w, max_h), resample=PILImage.Resampling.LANCZOS)
+
+        save_kwargs = {}
+        if fmt == "jpg":
+            save_kwargs = {
+                "format": "JPEG",
+                "quality": quality,
+                "optimize": True,
+                "progressive": True,
+            }
+        elif fmt == "png":
+            save_kwargs = {"format": "PNG", "optimize": True}
+        elif fmt == "webp":
+            save_kwargs = {"format": "WEBP", "quality": quality, "method": 6}
+        elif fmt == "avif":
+            save_kwargs = {"format": "AVIF", "quality": quality}
+
+        output = BytesIO()
+        image.save(output, **save_kwargs)
+        return output.getvalue()
+
+
+def get_resized_uploaded_image(
+    request: Request,
+    src: str,
+    w: int = 0,
+    h: int = 0,
+    q: int = 80,
+    format: str = "auto",
+):
+    """Serve a resized/cached version of an uploaded image."""
+    fmt, negotiated = negotiate_image_format(request.headers.get("accept"), format)
+
+    try:
+        quality = int(q)
+    except Exception:
+        quality = 80
+    quality = snap_quality(max(30, min(95, quality)))
+
+    try:
+        max_w = snap_dimension(int(w))
+        max_h = snap_dimension(int(h))
+    except Exception:
+        max_w, max_h = 0, 0
+
+    if max_w <= 0 and max_h <= 0:
+        max_w = DEFAULT_MAX_SIDE
+    if max_w <= 0:
+        max_w = 99999
+    if max_h <= 0:
+        max_h = 99999
+
+    storage = get_storage()
+    source_key = _resolve_source_key(src)
+
     src_mtime = 0
-    if os.path.exists(src_path) and os.path.isfile(src_path):
-        try:
-            src_mtime = int(os.path.getmtime(src_path))
-        except Exception:
-            src_mtime = 0
-    else:
-        base = os.getenv("PUBLIC_BASE_URL")
-        if base:
-            base = base.rstrip("/")
-        else:
-            proto = request.headers.get("x-forwarded-proto") or request.url.scheme
-            host = request.headers.get("x-forwarded-host") or request.headers.get("host")
-            if not host:
-                raise HTTPException(status_code=404, detail="Image not found")
-            base = f"{proto}://{host}".rstrip("/")
-
-        remote_url = f"{base}{safe_src if safe_src.startswith('/uploads/') else '/uploads/' + norm_rel}"
+    content_addressed = bool(CONTENT_ADDRESSED_RE.match(os.path.basename(source_key)))
+    if not content_addressed:
         try:
-            response = httpx.get(remote_url, timeout=15.0, follow_redirects=True)
-            if response.status_code != 200:
-                raise HTTPException(status_code=404, detail="Image not found")
-            content_type = response.headers.get("content-type", "")
-            if not content_type.startswith("image/"):
-                raise HTTPException(status_code=404, detail="Image not found")
-            src_bytes = response.content
-        except HTTPException:
-            raise
-        except Exception:
+            src_mtime = storage.mtime(source_key)
+        except FileNotFoundError:
             raise HTTPException(status_code=404, detail="Image not found")
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid src path")
 
-    cache_dir = os.path.join(UPLOADS_DIR, ".cache")
-    os.makedirs(cache_dir, exist_ok=True)
-
-    key = f"{norm_rel}|{max_w}|{max_h}|{quality}|{fmt}|{src_mtime}"
+    key = f"{source_key}|{max_w}|{max_h}|{quality}|{fmt}|{src_mtime}"
     digest = hashlib.md5(key.encode("utf-8")).hexdigest()
-    cached_path = os.path.join(cache_dir, f"img_{digest}.{fmt}")
+    cache_key = f"{CACHE_DIR_NAME}/img_{digest}.{fmt}"
 
-    if not os.path.exists(cached_path):
-        try:
-            if src_bytes is not None:
-                image_source = BytesIO(src_bytes)
-                image_context = PILImage.open(image_source)
-            else:
-                image_context = PILImage.open(src_path)
-
-            with image_context as image:
-                image = ImageOps.exif_transpose(image)
-                if fmt in {"jpg", "webp"} and image.mode not in {"RGB", "RGBA"}:
-                    image = image.convert("RGB")
-                image.thumbnail((max_w, max_h), resample=PILImage.Resampling.LANCZOS)
-
-                save_kwargs = {}
-                if fmt == "jpg":
-                    save_kwargs = {
-                        "format": "JPEG",
-                        "quality": quality,
-                        "optimize": True,
-                        "progressive": True,
-                    }
-                elif fmt == "png":
-                    save_kwargs = {"format": "PNG", "optimize": True}
-                elif fmt == "webp":
-                    save_kwargs = {"format": "WEBP", "quality": quality, "method": 6}
-
-                image.save(cached_path, **save_kwargs)
-        except HTTPException:
-            raise
-        except Exception as exc:
-            raise HTTPException(status_code=500, detail=f"Resize failed: {exc}")
-
-    media_type = {
-        "jpg": "image/jpeg",
-        "png": "image/png",
-        "webp": "image/webp",
-    }[fmt]
-
-    return FileResponse(
-        cached_path,
-        media_type=media_type,
-        headers={"Cache-Control": "public, max-age=86400"},
-    )
+    etag = f'"{digest}"'
+    cache_control = IMMUTABLE_CACHE_CONTROL if content_addressed else REVALIDATE_CACHE_CONTROL
+    headers = {"Cache-Control": cache_control, "ETag": etag}
+    if negotiated:
+        headers["Vary"] = "Accept"
+
+    if etag in (request.headers.get("if-none-match") or ""):
+        return Response(status_code=304, headers=headers)
+
+    try:
+        response = storage.response(cache_key, media_type=MEDIA_TYPES[fmt], headers=headers)
+        record_hit(cache_key)
+        return response
+    except FileNotFoundError:
+        pass
+
+    try:
+        with storage.open(source_key) as source:
+            data = _render_derivative(source, fmt, max_w, max_h, quality)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Image not found")
+    except Exception as exc:
+        raise HTTPException(status_code=500, detail=f"Resize failed: {exc}")
+
+    storage.put_bytes(cache_key, data)
+    register_entry(cache_key, source_key, src_mtime, len(data))
+    return Response(content=data, media_type=MEDIA_TYPES[fmt], headers=headers)
@@ -0,0 +1,67 @@
+"""Typed accessors for the JSONB columns ``products.images``, ``products.variants``
+and ``orders.items``.
+
+psycopg2 decodes JSONB into Python lists, so rows read after migration 9 need no
+``json.loads``. The accessors still accept the text forms (JSON strings and
+comma-joined image URLs) because request payloads and the admin form send them.
+Writers pass ``to_jsonb(...)`` for a ``?`` placeholder; Postgres casts the JSON
+text to ``jsonb`` on INSERT/UPDATE.
+"""
+
+from __future__ import annotations
+
+import json
+from typing import Any, List, Optional
+
+
+def json_list(value: Any) -> list:
+    """List stored in a JSONB column (or its JSON text); anything else is ``[]``."""
+    if isinstance(value, list):
+        return value
+    if isinstance(value, (str, bytes)):
+        try:
+            value = json.loads(value)
+        except (TypeError, ValueError):
+            return []
+        return value if isinstance(value, list) else []
+    return []
+
+
+def image_urls(value: Any) -> List[str]:
+    """Image URLs from a JSONB list, a JSON array string or comma-joined text."""
+    if isinstance(value, str):
+        text = value.strip()
+        items = json_list(text) if text.startswith("[") else text.split(",")
+    else:
+        items = json_list(value)
+    urls = []
+    for item in items:
+        url = str(item or "").strip()
+        if url:
+            urls.append(url)
+    return urls
+
+
+def variant_list(value: Any) -> List[dict]:
+    return [v for v in json_list(value) if isinstance(v, dict)]
+
+
+def order_item_list(value: Any) -> List[dict]:
+    return [item for item in json_list(value) if isinstance(item, dict)]
+
+
+def to_jsonb(value: Any) -> Optional[str]:
+    """JSON text for a JSONB parameter; ``None`` stays SQL NULL, strings are assumed to be JSON already."""
+    if value is None or isinstance(value, str):
+        return value
+    return json.dumps(value, ensure_ascii=False)
+
+
+def images_jsonb(value: Any) -> str:
+    """Canonical ``products.images`` value: a JSON array of URLs."""
+    return json.dumps(image_urls(value), ensure_ascii=False)
+
+
+def images_text(value: Any) -> str:
+    """Comma-joined URLs, the ``images`` shape the admin panel and app already read."""
+    return ",".join(image_urls(value))
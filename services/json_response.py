@@ -0,0 +1,45 @@
+"""orjson-backed JSON responses.
+
+``FastJSONResponse`` is the app's default response class. Routes with the
+largest payloads return it directly, which also skips FastAPI's
+``jsonable_encoder`` pass over every nested dict; orjson serializes DB rows
+(dict subclasses included), datetimes and UUIDs natively. ``Decimal`` and
+pydantic models go through ``_default`` and come out the way
+``jsonable_encoder`` would have produced them.
+"""
+
+from __future__ import annotations
+
+from decimal import Decimal
+from typing import Any
+
+import orjson
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+
+# Non-str keys (e.g. int ids) are stringified like json.dumps does.
+ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS
+
+
+def _default(obj: Any) -> Any:
+    if isinstance(obj, Decimal):
+        # Same as jsonable_encoder: integral decimals stay ints.
+        return int(obj) if obj.as_tuple().exponent >= 0 else float(obj)
+    if isinstance(obj, BaseModel):
+        return obj.model_dump()
+    if isinstance(obj, (set, frozenset)):
+        return list(obj)
+    if isinstance(obj, (bytes, bytearray, memoryview)):
+        return bytes(obj).decode("utf-8", errors="replace")
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def dumps(content: Any) -> bytes:
+    return orjson.dumps(content, default=_default, option=ORJSON_OPTIONS)
+
+
+class FastJSONResponse(JSONResponse):
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
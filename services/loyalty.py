@@ -0,0 +1,177 @@
+"""Bonus (loyalty) balance changes recorded in an append-only ledger.
+
+Every change of ``users.bonus_balance`` is a row in ``bonus_transactions``
+(signed ``delta``, reason, order, resulting balance); ``users.bonus_balance``
+stays the materialized sum that the app reads. Writes are single atomic
+``bonus_balance + delta`` updates instead of read-modify-write, and order
+events carry an idempotency key (``order:<id>:redeem``, ``order:<id>:cashback``)
+so a retried webhook or a double status change is applied once.
+
+The helpers take the caller's cursor and never commit: the ledger row, the
+balance and the order update become visible together.
+"""
+
+from __future__ import annotations
+
+from typing import List, Optional
+
+from db import get_db_connection
+from services.users import calculate_cashback_percent, cashback_percent_sql
+
+REASON_SIGNUP = "signup_bonus"
+REASON_REDEEM = "order_redeem"
+REASON_CASHBACK = "order_cashback"
+REASON_ADMIN = "admin_adjust"
+# Written once by the bonus_ledger migration for balances that predate the ledger.
+REASON_OPENING = "opening_balance"
+
+
+def order_key(order_id: int, event: str) -> str:
+    return f"order:{order_id}:{event}"
+
+
+def apply_bonus_delta(
+    cur,
+    user_phone: str,
+    delta: int,
+    reason: str,
+    idempotency_key: Optional[str] = None,
+    order_id: Optional[int] = None,
+) -> Optional[dict]:
+    """Add ``delta`` to the user's balance (never below 0) and record it.
+
+    Returns ``{"delta", "balance"}`` with the amount actually applied, or None
+    when the key was already used or the user does not exist.
+    """
+    entry = cur.execute(
+        """
+        INSERT INTO bonus_transactions (user_phone, delta, reason, order_id, idempotency_key)
+        VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT (idempotency_key) DO NOTHING
+        RETURNING id
+        """,
+        (user_phone, int(delta), reason, order_id, idempotency_key),
+    ).fetchone()
+    if not entry:
+        return None
+
+    # The CTE locks the row and reads its latest version, so before/after are exact.
+    row = cur.execute(
+        """
+        WITH prev AS (SELECT phone, COALESCE(bonus_balance, 0) AS balance FROM users WHERE phone = ? FOR UPDATE)
+        UPDATE users u SET bonus_balance = GREATEST(prev.balance + ?, 0)
+        FROM prev WHERE u.phone = prev.phone
+        RETURNING prev.balance AS balance_before, u.bonus_balance AS balance_after
+        """,
+        (user_phone, int(delta)),
+    ).fetchone()
+    if not row:
+        cur.execute("DELETE FROM bonus_transactions WHERE id = ?", (entry["id"],))
+        return None
+
+    balance = int(row["balance_after"])
+    applied = balance - int(row["balance_before"])
+    cur.execute(
+        "UPDATE bonus_transactions SET delta = ?, balance_after = ? WHERE id = ?",
+        (applied, balance, entry["id"]),
+    )
+    return {"delta": applied, "balance": balance}
+
+
+def set_bonus_balance(cur, user_phone: str, balance: int, reason: str = REASON_ADMIN) -> Optional[dict]:
+    """Set an absolute balance (admin edit) as a ledger delta."""
+    row = cur.execute(
+        "SELECT COALESCE(bonus_balance, 0) AS balance FROM users WHERE phone = ? FOR UPDATE",
+        (user_phone,),
+    ).fetchone()
+    if not row:
+        return None
+    delta = int(balance) - int(row["balance"])
+    if not delta:
+        return {"delta": 0, "balance": int(row["balance"])}
+    return apply_bonus_delta(cur, user_phone, delta, reason)
+
+
+def redeem_order_bonuses(cur, order_id: int, user_phone: str, bonus_used: int) -> Optional[dict]:
+    """Deduct the bonuses used by an order, once per order."""
+    if not user_phone or not bonus_used or bonus_used <= 0:
+        return None
+    return apply_bonus_delta(cur, user_phone, -int(bonus_used), REASON_REDEEM, order_key(order_id, "redeem"), order_id)
+
+
+def apply_order_cashback(cur, order_id: int, user_phone: str, order_total: float) -> Optional[dict]:
+    """Credit cashback for a completed order and add it to ``total_spent``, once per order.
+
+    The percent comes from ``total_spent`` before this order; the new tier is
+    computed in SQL from the updated total.
+    """
+    claimed = cur.execute(
+        "UPDATE orders SET cashback_applied = TRUE WHERE id = ? AND NOT COALESCE(cashback_applied, FALSE) RETURNING id",
+        (order_id,),
+    ).fetchone()
+    if not claimed or not user_phone or order_total <= 0:
+        return None
+
+    row = cur.execute(
+        f"""
+        WITH prev AS (
+            SELECT phone, COALESCE(total_spent, 0) AS spent, COALESCE(total_spent, 0) + ? AS new_spent
+            FROM users WHERE phone = ? FOR UPDATE
+        )
+        UPDATE users u SET total_spent = prev.new_spent, cashback_percent = {cashback_percent_sql("prev.new_spent")}
+        FROM prev WHERE u.phone = prev.phone
+        RETURNING prev.spent AS spent_before
+        """,
+        (order_total, user_phone),
+    ).fetchone()
+    if not row:
+        return None
+
+    cashback = int(order_total * calculate_cashback_percent(float(row["spent_before"])) / 100)
+    if cashback <= 0:
+        return {"delta": 0, "balance": None}
+    return apply_bonus_delta(cur, user_phone, cashback, REASON_CASHBACK, order_key(order_id, "cashback"), order_id)
+
+
+def delete_user_ledger(cur, user_phones: List[str]) -> None:
+    """Drop the ledger of deleted accounts (same transaction as the user delete).
+
+    A phone that registers again starts a fresh account: its ``signup:<phone>``
+    key must be free and the old deltas must not count against the new balance.
+    """
+    if user_phones:
+        cur.execute("DELETE FROM bonus_transactions WHERE user_phone = ANY(?)", (list(user_phones),))
+
+
+def list_transactions(user_phone: str, limit: int = 50) -> List[dict]:
+    conn = get_db_connection()
+    try:
+        rows = conn.execute(
+            "SELECT * FROM bonus_transactions WHERE user_phone = ? ORDER BY id DESC LIMIT ?",
+            (user_phone, limit),
+        ).fetchall()
+    finally:
+        conn.close()
+    return [dict(row) for row in rows]
+
+
+def find_balance_mismatches(limit: int = 100) -> List[dict]:
+    """Users whose materialized balance differs from the ledger sum."""
+    conn = get_db_connection()
+    try:
+        rows = conn.execute(
+            """
+            SELECT u.phone, COALESCE(u.bonus_balance, 0) AS bonus_balance, COALESCE(l.total, 0) AS ledger_total
+            FROM users u
+            LEFT JOIN (
+                SELECT user_phone, SUM(delta) AS total FROM bonus_transactions GROUP BY user_phone
+            ) l ON l.user_phone = u.phone
+            WHERE COALESCE(u.bonus_balance, 0) <> COALESCE(l.total, 0)
+            ORDER BY u.phone
+            LIMIT ?
+            """,
+            (limit,),
+        ).fetchall()
+    finally:
+        conn.close()
+    return [dict(row) for row in rows]
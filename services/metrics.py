@@ -0,0 +1,278 @@
+"""Request, database and upstream metrics in Prometheus text format.
+
+``MetricsMiddleware`` (pure ASGI, outermost) records per-route latency
+histograms, status codes and the number of requests in flight. Routes are
+labelled by their path template (``/api/orders/{order_id}``), so label
+cardinality stays bounded. ``db.PGCursorAdapter`` reports every query through
+``observe_query`` and the shared HTTP clients report upstream calls through
+``observe_upstream``; queries are also counted per request via a context
+variable, which follows sync routes into the threadpool. A request ends when
+its last body chunk is sent: background tasks that run after the response
+are neither timed nor counted against it.
+
+Requests slower than ``SLOW_REQUEST_MS`` and queries slower than
+``SLOW_QUERY_MS`` are logged (0 disables either log). Metrics live in process
+memory: the app runs as a single uvicorn process, so one scrape of
+``/metrics`` sees everything.
+"""
+
+from __future__ import annotations
+
+import bisect
+import contextvars
+import hmac
+import logging
+import os
+import threading
+import time
+from typing import Dict, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+SLOW_REQUEST_MS = float(os.getenv("SLOW_REQUEST_MS", "1000"))
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "200"))
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+QUERY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+_SQL_OPERATIONS = ("select", "insert", "update", "delete")
+_lock = threading.Lock()
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _number(value: float) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        REGISTRY.append(self)
+
+    def _header(self) -> list:
+        return [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        if not self.labelnames:
+            self._values[()] = 0
+
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        with _lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self) -> list:
+        lines = self._header()
+        for labels, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{_labels(self.labelnames, labels)} {_number(value)}")
+        return lines
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, *labels: str, amount: float = 1) -> None:
+        self.inc(*labels, amount=-amount)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(buckets)
+        # labels -> [per-bucket counts (last one is +Inf), sum]
+        self._series: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        index = bisect.bisect_left(self.buckets, value)
+        with _lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def render(self) -> list:
+        lines = self._header()
+        for labels, (counts, total) in sorted(self._series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else _number(bound)
+                bucket_labels = _labels(self.labelnames, labels, 'le="%s"' % le)
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, labels)} {_number(total)}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, labels)} {cumulative}")
+        return lines
+
+
+REGISTRY: list = []
+
+HTTP_REQUESTS = Counter("http_requests_total", "HTTP requests by route and status code.", ("method", "route", "status"))
+HTTP_REQUEST_SECONDS = Histogram("http_request_duration_seconds", "HTTP request latency.", ("method", "route"))
+HTTP_IN_PROGRESS = Gauge("http_requests_in_progress", "HTTP requests being handled right now.")
+HTTP_SLOW_REQUESTS = Counter("http_slow_requests_total", "Requests slower than SLOW_REQUEST_MS.", ("method", "route"))
+HTTP_REQUEST_QUERIES = Histogram(
+    "http_request_db_queries", "SQL statements executed per HTTP request.", ("method", "route"), QUERY_COUNT_BUCKETS
+)
+DB_QUERY_SECONDS = Histogram("db_query_duration_seconds", "SQL statement latency.", ("operation",), QUERY_BUCKETS)
+DB_SLOW_QUERIES = Counter("db_slow_queries_total", "SQL statements slower than SLOW_QUERY_MS.", ("operation",))
+UPSTREAM_SECONDS = Histogram(
+    "http_client_request_duration_seconds", "Outbound HTTP call latency by upstream.", ("upstream", "status")
+)
+
+
+class RequestStats:
+    """Per-request counters filled in by the DB layer while the request runs."""
+
+    __slots__ = ("method", "path", "scope", "queries", "db_seconds", "shapes", "over_budget", "done")
+
+    def __init__(self, method: str, path: str, scope: dict):
+        self.method = method
+        self.path = path
+        self.scope = scope
+        self.queries = 0
+        self.db_seconds = 0.0
+        # Statement shapes and budget state for services.query_budget (debug/CI mode).
+        self.shapes: Dict[str, int] = {}
+        self.over_budget = False
+        # Set once the response is sent; later statements are background work.
+        self.done = False
+
+
+_request_stats: contextvars.ContextVar[Optional[RequestStats]] = contextvars.ContextVar("request_stats", default=None)
+
+
+def current_request_stats() -> Optional[RequestStats]:
+    """Stats of the request being served, or None outside requests and after the response is sent.
+
+    Tasks and threads started by a handler inherit the context variable, so a
+    finished request's stats stay visible to them; ``done`` tells them apart.
+    """
+    stats = _request_stats.get()
+    return None if stats is None or stats.done else stats
+
+
+def _sql_operation(sql: str) -> str:
+    word = sql.lstrip().split(None, 1)[0].lower() if sql.strip() else ""
+    return word if word in _SQL_OPERATIONS else "other"
+
+
+def _compact_sql(sql: str, limit: int = 300) -> str:
+    text = " ".join(sql.split())
+    return text if len(text) <= limit else text[:limit] + "..."
+
+
+def observe_query(sql: str, seconds: float) -> None:
+    """Record one SQL statement (called by ``db.PGCursorAdapter``)."""
+    operation = _sql_operation(sql)
+    DB_QUERY_SECONDS.observe(seconds, operation)
+    stats = current_request_stats()
+    if stats is not None:
+        stats.queries += 1
+        stats.db_seconds += seconds
+    elapsed_ms = seconds * 1000
+    if SLOW_QUERY_MS and elapsed_ms >= SLOW_QUERY_MS:
+        DB_SLOW_QUERIES.inc(operation)
+        where = f"{stats.method} {stats.path}" if stats is not None else "background"
+        logger.warning("Slow query %.0f ms (%s): %s", elapsed_ms, where, _compact_sql(sql))
+
+
+def observe_upstream(name: str, seconds: float, status: Optional[int]) -> None:
+    """Record one outbound HTTP attempt (called by ``services.http_clients``)."""
+    UPSTREAM_SECONDS.observe(seconds, name, f"{status // 100}xx" if status else "error")
+
+
+def route_label(scope) -> str:
+    route = scope.get("route")
+    path = getattr(route, "path", None)
+    if path:
+        return path
+    if scope.get("endpoint") is not None and scope.get("root_path"):
+        # Mounted app (static uploads): label by the mount point.
+        return scope["root_path"] + "/*"
+    return "unmatched"
+
+
+class MetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        method = scope.get("method", "")
+        stats = RequestStats(method, scope.get("path", ""), scope)
+        status = 500
+        elapsed = None
+
+        async def send_wrapper(message) -> None:
+            nonlocal status, elapsed
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+            if message["type"] == "http.response.body" and not message.get("more_body", False) and elapsed is None:
+                # The client has the whole response; BackgroundTasks run after this point.
+                elapsed = time.perf_counter() - started
+                stats.done = True
+
+        token = _request_stats.set(stats)
+        HTTP_IN_PROGRESS.inc()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            if elapsed is None:
+                elapsed = time.perf_counter() - started
+                stats.done = True
+            HTTP_IN_PROGRESS.dec()
+            _request_stats.reset(token)
+            route = route_label(scope)
+            HTTP_REQUESTS.inc(method, route, str(status))
+            HTTP_REQUEST_SECONDS.observe(elapsed, method, route)
+            HTTP_REQUEST_QUERIES.observe(stats.queries, method, route)
+            if SLOW_REQUEST_MS and elapsed * 1000 >= SLOW_REQUEST_MS:
+                HTTP_SLOW_REQUESTS.inc(method, route)
+                logger.warning(
+                    "Slow request %.0f ms: %s %s -> %s (%d queries, %.0f ms in DB)",
+                    elapsed * 1000, method, stats.path, status, stats.queries, stats.db_seconds * 1000,
+                )
+
+
+def metrics_authorized(authorization: Optional[str]) -> bool:
+    """``/metrics`` requires ``Authorization: Bearer <METRICS_TOKEN>``; with no token configured it is closed."""
+    if not METRICS_TOKEN:
+        return False
+    return hmac.compare_digest(str(authorization or ""), f"Bearer {METRICS_TOKEN}")
+
+
+def render_metrics() -> str:
+    with _lock:
+        lines = [line for metric in REGISTRY for line in metric.render()]
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,188 @@
+"""Versioned schema migrations.
+
+Applied migrations are recorded in ``schema_migrations`` (version, name,
+checksum). On startup ``migrate`` first reads that table without taking any
+lock: when every migration is already applied it returns immediately, so a
+normal boot runs no DDL at all. Otherwise the worker takes a Postgres advisory
+lock (other workers wait on it), re-reads the table and applies what is still
+pending, each migration in its own transaction.
+
+Checksums are computed over the whitespace-normalized SQL; editing a migration
+that was already applied is an error - add a new version instead.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import logging
+import re
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from db import get_db_connection
+
+logger = logging.getLogger(__name__)
+
+MIGRATION_LOCK_KEY = 730_041
+
+_CONCURRENT_INDEX_RE = re.compile(r"CREATE\s+(?:UNIQUE\s+)?INDEX\s+CONCURRENTLY\s+IF\s+NOT\s+EXISTS\s+(\w+)", re.I)
+
+
+class MigrationError(RuntimeError):
+    pass
+
+
+@dataclass(frozen=True)
+class Migration:
+    version: int
+    name: str
+    statements: Tuple[str, ...]
+    # Statements allowed to fail (e.g. a unique index blocked by duplicate rows); run in a savepoint.
+    optional: Tuple[str, ...] = ()
+    # False for statements that cannot run in a transaction (CREATE INDEX CONCURRENTLY).
+    transactional: bool = True
+
+    @property
+    def checksum(self) -> str:
+        digest = hashlib.sha256()
+        for sql in self.statements + ("--optional--",) + self.optional:
+            digest.update(" ".join(sql.split()).encode("utf-8"))
+            digest.update(b"\n")
+        digest.update(b"tx" if self.transactional else b"no-tx")
+        return digest.hexdigest()
+
+
+def _applied(conn) -> Optional[Dict[int, str]]:
+    """``{version: checksum}`` or None when ``schema_migrations`` does not exist yet."""
+    row = conn.execute("SELECT to_regclass('schema_migrations') IS NOT NULL AS present").fetchone()
+    if not row or not row["present"]:
+        return None
+    rows = conn.execute("SELECT version, checksum FROM schema_migrations").fetchall()
+    return {int(r["version"]): r["checksum"] for r in rows}
+
+
+def _pending(migrations: Sequence[Migration], applied: Dict[int, str]) -> List[Migration]:
+    for migration in migrations:
+        checksum = applied.get(migration.version)
+        if checksum is not None and checksum != migration.checksum:
+            raise MigrationError(
+                f"Migration {migration.version} ({migration.name}) was changed after it was applied"
+            )
+    return [m for m in migrations if m.version not in applied]
+
+
+def _validate(migrations: Sequence[Migration]) -> None:
+    versions = [m.version for m in migrations]
+    if versions != sorted(set(versions)):
+        raise MigrationError("Migration versions must be unique and increasing")
+
+
+def _run_optional(cur, sql: str, savepoint: bool) -> None:
+    try:
+        if savepoint:
+            cur.execute("SAVEPOINT optional_ddl")
+        cur.execute(sql)
+        if savepoint:
+            cur.execute("RELEASE SAVEPOINT optional_ddl")
+    except Exception as exc:
+        if savepoint:
+            cur.execute("ROLLBACK TO SAVEPOINT optional_ddl")
+        logger.warning("Optional migration statement skipped: %s (%s)", " ".join(sql.split())[:120], exc)
+
+
+def _drop_invalid_index(conn, sql: str) -> None:
+    """A failed CONCURRENTLY build leaves an INVALID index that IF NOT EXISTS would keep; drop it first."""
+    match = _CONCURRENT_INDEX_RE.search(sql)
+    if not match:
+        return
+    row = conn.execute(
+        """
+        SELECT NOT i.indisvalid AS invalid
+        FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+        WHERE c.relname = ? AND pg_table_is_visible(c.oid)
+        """,
+        (match.group(1),),
+    ).fetchone()
+    if row and row["invalid"]:
+        logger.warning("Dropping invalid index %s left by an interrupted build", match.group(1))
+        conn.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {match.group(1)}")
+
+
+def _apply(conn, migration: Migration) -> None:
+    started = time.monotonic()
+    if not migration.transactional:
+        conn.autocommit = True
+    try:
+        cur = conn.cursor()
+        for sql in migration.statements:
+            if not migration.transactional:
+                _drop_invalid_index(conn, sql)
+            cur.execute(sql)
+        for sql in migration.optional:
+            _run_optional(cur, sql, savepoint=migration.transactional)
+    finally:
+        if not migration.transactional:
+            conn.autocommit = False
+    conn.execute(
+        "INSERT INTO schema_migrations (version, name, checksum, duration_ms) VALUES (?, ?, ?, ?)",
+        (migration.version, migration.name, migration.checksum, int((time.monotonic() - started) * 1000)),
+    )
+    conn.commit()
+    logger.info("Applied migration %s_%s", migration.version, migration.name)
+
+
+def migrate(migrations: Sequence[Migration]) -> List[int]:
+    """Apply pending migrations; returns the versions applied by this call."""
+    _validate(migrations)
+    conn = get_db_connection()
+    try:
+        applied = _applied(conn)
+        conn.rollback()
+        if applied is not None and not _pending(migrations, applied):
+            return []
+
+        conn.execute("SELECT pg_advisory_lock(?)", (MIGRATION_LOCK_KEY,))
+        conn.commit()
+        try:
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS schema_migrations (
+                    version INTEGER PRIMARY KEY,
+                    name TEXT NOT NULL,
+                    checksum TEXT NOT NULL,
+                    duration_ms INTEGER,
+                    applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+                """
+            )
+            conn.commit()
+            # Another worker may have migrated while we waited for the lock.
+            pending = _pending(migrations, _applied(conn) or {})
+            conn.rollback()
+            for migration in pending:
+                _apply(conn, migration)
+            return [m.version for m in pending]
+        finally:
+            conn.rollback()
+            conn.execute("SELECT pg_advisory_unlock(?)", (MIGRATION_LOCK_KEY,))
+            conn.commit()
+    finally:
+        conn.close()
+
+
+def migration_status(migrations: Sequence[Migration]) -> List[dict]:
+    conn = get_db_connection()
+    try:
+        applied = _applied(conn) or {}
+    finally:
+        conn.close()
+    return [
+        {
+            "version": m.version,
+            "name": m.name,
+            "applied": m.version in applied,
+            "checksum_ok": applied.get(m.version) in (None, m.checksum),
+        }
+        for m in migrations
+    ]
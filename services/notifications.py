@@ -1,19 +1,54 @@
-import requests
+"""Expo push notifications: batched async delivery and receipt processing.
+
+Messages are sent to the Expo push API in batches of up to 100 (the Expo
+per-request limit), several batches concurrently, under a messages-per-second
+rate limit. Every accepted message returns a ticket; tickets are stored in
+``push_tickets`` and a background poller fetches their receipts later. Tokens
+that Expo reports as ``DeviceNotRegistered`` (on the ticket or the receipt)
+are removed from ``users.push_token``.
+
+``EXPO_PUSH_URL`` / ``EXPO_RECEIPTS_URL`` can point to a stand-in server, see
+``scripts/expo_push_stub.py``.
+"""
+
+from __future__ import annotations
+
+import asyncio
 import logging
+import os
+import time
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional
+
+from db import get_db_connection
+from services.http_clients import get_http_client
 
 logger = logging.getLogger(__name__)
 
-def send_expo_push(token: str, title: str, body: str, data: dict = None):
-    """
-    Отправляет push-уведомление через сервера Expo.
-    """
-    if not token or not token.startswith("ExponentPushToken"):
-        logger.warning(f"Неверный формат токена для пуша: {token}")
-        return
+EXPO_PUSH_URL = os.getenv("EXPO_PUSH_URL", "https://exp.host/--/api/v2/push/send")
+EXPO_RECEIPTS_URL = os.getenv("EXPO_RECEIPTS_URL", "https://exp.host/--/api/v2/push/getReceipts")
+EXPO_ACCESS_TOKEN = os.getenv("EXPO_ACCESS_TOKEN")
+
+EXPO_BATCH_SIZE = 100
+EXPO_RECEIPT_BATCH_SIZE = 1000
+EXPO_CONCURRENCY = int(os.getenv("EXPO_CONCURRENCY", "6"))
+EXPO_RATE_PER_SECOND = float(os.getenv("EXPO_RATE_PER_SECOND", "500"))
+# Expo recommends waiting ~15 minutes for receipts and keeps them for 24 hours.
+EXPO_RECEIPT_DELAY_SECONDS = int(os.getenv("EXPO_RECEIPT_DELAY_SECONDS", "900"))
+EXPO_RECEIPT_POLL_SECONDS = float(os.getenv("EXPO_RECEIPT_POLL_SECONDS", "300"))
+_RECEIPT_TTL = timedelta(hours=24)
+_CLAIM_TTL = timedelta(minutes=10)
+
+_receipt_task: Optional[asyncio.Task] = None
+_limiter = None
+
 
-    url = "https://exp.host/--/api/v2/push/send"
-    
-    payload = {
+def is_expo_token(token: Optional[str]) -> bool:
+    return bool(token) and token.startswith("ExponentPushToken")
+
+
+def build_message(token: str, title: str, body: str, data: dict = None) -> dict:
+    return {
         "to": token,
         "title": title,
         "body": body,
@@ -23,12 +58,257 @@ def send_expo_push(token: str, title: str, body: str, data: dict = None):
         "projectId": "66618f31-dc39-46f1-ba09-55c52d037f4a",
         "experienceId": "@katuz71/dikorosua",
         "_displayInForeground": True,
-        "data": data or {}
+        "data": data or {},
     }
 
+
+class _RateLimiter:
+    """Token bucket shared by concurrent batches (units are messages)."""
+
+    def __init__(self, rate: float):
+        self.rate = rate
+        self.capacity = max(rate, float(EXPO_BATCH_SIZE))
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self, amount: int) -> None:
+        if self.rate <= 0:
+            return
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= amount:
+                    self._tokens -= amount
+                    return
+                await asyncio.sleep((amount - self._tokens) / self.rate)
+
+
+def _get_limiter() -> _RateLimiter:
+    """Process-wide limiter, so concurrent sends share one Expo budget."""
+    global _limiter
+    if _limiter is None:
+        _limiter = _RateLimiter(EXPO_RATE_PER_SECOND)
+    return _limiter
+
+
+def _headers() -> dict:
+    headers = {"Accept": "application/json", "Accept-Encoding": "gzip, deflate"}
+    if EXPO_ACCESS_TOKEN:
+        headers["Authorization"] = f"Bearer {EXPO_ACCESS_TOKEN}"
+    return headers
+
+
+def _is_unregistered(ticket_or_receipt: dict) -> bool:
+    details = ticket_or_receipt.get("details") or {}
+    return ticket_or_receipt.get("status") == "error" and details.get("error") == "DeviceNotRegistered"
+
+
+# --- DB ---
+
+def prune_push_tokens(tokens: Iterable[str]) -> int:
+    """Forget tokens of uninstalled apps. Returns number of users updated."""
+    tokens = sorted(set(t for t in tokens if t))
+    if not tokens:
+        return 0
+    conn = get_db_connection()
     try:
-        response = requests.post(url, json=payload, timeout=5)
-        response.raise_for_status()
+        cur = conn.cursor()
+        cur.execute("UPDATE users SET push_token = NULL WHERE push_token = ANY(?)", (tokens,))
+        pruned = cur.rowcount
+        cur.execute("UPDATE orders SET push_token = NULL WHERE push_token = ANY(?)", (tokens,))
+        conn.commit()
+    finally:
+        conn.close()
+    logger.info("Expo push: pruned %s unregistered tokens (%s users)", len(tokens), pruned)
+    return pruned
+
+
+def _store_tickets(tickets: List[tuple]) -> None:
+    if not tickets:
+        return
+    conn = get_db_connection()
+    try:
+        conn.cursor().execute_values(
+            "INSERT INTO push_tickets (ticket_id, token, created_at) VALUES ? ON CONFLICT (ticket_id) DO NOTHING",
+            tickets,
+        )
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def _claim_tickets(limit: int) -> List[dict]:
+    now = datetime.now()
+    conn = get_db_connection()
+    try:
+        rows = conn.execute(
+            """
+            UPDATE push_tickets SET claimed_at = ?
+            WHERE ticket_id IN (
+                SELECT ticket_id FROM push_tickets
+                WHERE created_at <= ? AND (claimed_at IS NULL OR claimed_at < ?)
+                ORDER BY created_at
+                LIMIT ?
+                FOR UPDATE SKIP LOCKED
+            )
+            RETURNING ticket_id, token, created_at
+            """,
+            (now, now - timedelta(seconds=EXPO_RECEIPT_DELAY_SECONDS), now - _CLAIM_TTL, limit),
+        ).fetchall()
+        conn.commit()
+    finally:
+        conn.close()
+    return rows
+
+
+def _delete_tickets(ticket_ids: List[str]) -> None:
+    if not ticket_ids:
+        return
+    conn = get_db_connection()
+    try:
+        conn.execute("DELETE FROM push_tickets WHERE ticket_id = ANY(?)", (ticket_ids,))
+        conn.commit()
+    finally:
+        conn.close()
+
+
+# --- Sending ---
+
+async def _send_batch(batch: List[dict], semaphore: asyncio.Semaphore, limiter: _RateLimiter, result: dict) -> None:
+    async with semaphore:
+        await limiter.acquire(len(batch))
+        try:
+            response = await get_http_client("expo").post(EXPO_PUSH_URL, json=batch, headers=_headers())
+            response.raise_for_status()
+            tickets = response.json().get("data") or []
+        except Exception as exc:
+            logger.error("Expo push: batch of %s failed: %s", len(batch), exc)
+            result["failed"] += len(batch)
+            return
+
+    # Expo answers with one ticket per message; a short list means the request was rejected as a whole.
+    result["failed"] += max(0, len(batch) - len(tickets))
+    now = datetime.now()
+    for message, ticket in zip(batch, tickets):
+        if ticket.get("status") == "ok" and ticket.get("id"):
+            result["sent"] += 1
+            result["tickets"].append((ticket["id"], message["to"], now))
+        else:
+            result["failed"] += 1
+            if _is_unregistered(ticket):
+                result["unregistered"].add(message["to"])
+            else:
+                logger.warning("Expo push: rejected for %s: %s", message["to"], ticket.get("message"))
+
+
+async def send_push_messages(messages: List[dict]) -> dict:
+    """Send many messages in 100-message batches, concurrently and rate limited."""
+    messages = [m for m in messages if is_expo_token(m.get("to"))]
+    result = {"sent": 0, "failed": 0, "tickets": [], "unregistered": set()}
+    if not messages:
+        return {"sent": 0, "failed": 0, "unregistered": 0}
+
+    semaphore = asyncio.Semaphore(max(1, EXPO_CONCURRENCY))
+    limiter = _get_limiter()
+    await asyncio.gather(
+        *(
+            _send_batch(messages[start : start + EXPO_BATCH_SIZE], semaphore, limiter, result)
+            for start in range(0, len(messages), EXPO_BATCH_SIZE)
+        )
+    )
+
+    await asyncio.to_thread(_store_tickets, result["tickets"])
+    if result["unregistered"]:
+        await asyncio.to_thread(prune_push_tokens, result["unregistered"])
+    return {"sent": result["sent"], "failed": result["failed"], "unregistered": len(result["unregistered"])}
+
+
+async def send_expo_push(token: str, title: str, body: str, data: dict = None):
+    """
+    Отправляет push-уведомление через сервера Expo.
+    """
+    if not is_expo_token(token):
+        logger.warning(f"Неверный формат токена для пуша: {token}")
+        return
+    result = await send_push_messages([build_message(token, title, body, data)])
+    if result["sent"]:
         logger.info(f"Пуш успешно отправлен на токен {token}")
-    except requests.exceptions.RequestException as e:
-        logger.error(f"Ошибка при отправке Expo Push: {e}")
\ No newline at end of file
+
+
+# --- Receipts ---
+
+async def process_push_receipts() -> dict:
+    """Fetch receipts for due tickets, prune DeviceNotRegistered tokens, drop finished tickets."""
+    stats = {"checked": 0, "ok": 0, "errors": 0, "unregistered": 0, "expired": 0}
+    while True:
+        rows = await asyncio.to_thread(_claim_tickets, EXPO_RECEIPT_BATCH_SIZE)
+        if not rows:
+            return stats
+        tokens_by_ticket: Dict[str, str] = {row["ticket_id"]: row["token"] for row in rows}
+        response = await get_http_client("expo").post(
+            EXPO_RECEIPTS_URL, json={"ids": list(tokens_by_ticket)}, headers=_headers()
+        )
+        response.raise_for_status()
+        receipts = response.json().get("data") or {}
+
+        finished, unregistered = [], set()
+        now = datetime.now()
+        for row in rows:
+            receipt = receipts.get(row["ticket_id"])
+            if receipt is None:
+                # Not ready yet; give up once Expo no longer keeps the receipt.
+                if now - row["created_at"] > _RECEIPT_TTL:
+                    finished.append(row["ticket_id"])
+                    stats["expired"] += 1
+                continue
+            finished.append(row["ticket_id"])
+            if receipt.get("status") == "ok":
+                stats["ok"] += 1
+            else:
+                stats["errors"] += 1
+                if _is_unregistered(receipt):
+                    unregistered.add(row["token"])
+                else:
+                    logger.warning("Expo push receipt error for %s: %s", row["ticket_id"], receipt.get("message"))
+        stats["checked"] += len(rows)
+        stats["unregistered"] += len(unregistered)
+
+        if unregistered:
+            await asyncio.to_thread(prune_push_tokens, unregistered)
+        await asyncio.to_thread(_delete_tickets, finished)
+        if len(rows) < EXPO_RECEIPT_BATCH_SIZE:
+            return stats
+
+
+async def _receipt_loop() -> None:
+    while True:
+        try:
+            stats = await process_push_receipts()
+            if stats["checked"]:
+                logger.info("Expo push receipts: %s", stats)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Expo push receipt polling failed")
+        await asyncio.sleep(EXPO_RECEIPT_POLL_SECONDS)
+
+
+def start_receipt_poller() -> None:
+    """Start the periodic receipt poller (call from the app startup hook)."""
+    global _receipt_task
+    if _receipt_task is None or _receipt_task.done():
+        _receipt_task = asyncio.get_running_loop().create_task(_receipt_loop())
+
+
+async def stop_receipt_poller() -> None:
+    global _receipt_task
+    if _receipt_task is not None:
+        _receipt_task.cancel()
+        try:
+            await _receipt_task
+        except asyncio.CancelledError:
+            pass
+        _receipt_task = None
@@ -0,0 +1,354 @@
+"""Nova Poshta reference data: local city/warehouse store and typeahead index.
+
+Cities and warehouses are bulk-loaded from the Nova Poshta API into the
+``np_cities`` and ``np_warehouses`` tables and refreshed periodically by one
+worker (guarded by a Postgres advisory lock). Every worker keeps an in-memory
+prefix index built from those tables, so checkout typeahead is served without
+calling api.novaposhta.ua. Live API calls only happen on an index miss and go
+through the shared ``nova_poshta`` client from ``services.http_clients``.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import re
+from bisect import bisect_left
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+from db import get_db_connection
+from services.http_clients import get_http_client
+
+
+logger = logging.getLogger(__name__)
+
+NP_API_URL = "https://api.novaposhta.ua/v2.0/json/"
+NP_REFRESH_HOURS = float(os.getenv("NP_REFRESH_HOURS", "24"))
+NP_REFRESH_CHECK_SECONDS = float(os.getenv("NP_REFRESH_CHECK_SECONDS", "1800"))
+NP_PAGE_SIZE = 500
+NP_WAREHOUSE_LIMIT = 100
+
+# pg_try_advisory_lock key: only one worker runs the bulk refresh at a time.
+_REFRESH_LOCK_KEY = 730_001
+
+_refresh_task: Optional[asyncio.Task] = None
+
+
+def _nova_poshta_api_key() -> str:
+    api_key = os.getenv("NOVA_POSHTA_API_KEY")
+    if not api_key:
+        raise RuntimeError("NOVA_POSHTA_API_KEY is not set in environment")
+    return api_key
+
+
+def normalize_search(value: str) -> str:
+    """Lowercase and unify apostrophes so 'Кам’янець' matches 'кам'янець'."""
+    value = (value or "").strip().lower()
+    value = re.sub(r"[’ʼ`´]", "'", value)
+    return re.sub(r"\s+", " ", value)
+
+
+class ReferenceIndex:
+    """Immutable in-memory index; replaced as a whole after every reload or live-API miss."""
+
+    def __init__(self, cities: List[dict], warehouses: Dict[str, List[dict]]):
+        self.cities = {city["ref"]: city for city in cities}
+        self.warehouses = warehouses
+        keys = []
+        for city in cities:
+            name = normalize_search(city["name"])
+            keys.append((name, 0, city["ref"]))
+            for token in re.split(r"[\s\-()]+", name)[1:]:
+                if token:
+                    keys.append((token, 1, city["ref"]))
+        keys.sort()
+        self._keys = keys
+        self._prefixes = [key[0] for key in keys]
+
+    def __len__(self) -> int:
+        return len(self.cities)
+
+    def search_cities(self, query: str, limit: int = 20) -> List[dict]:
+        prefix = normalize_search(query)
+        if not prefix:
+            return [self.cities[key[2]] for key in self._keys if key[1] == 0][:limit]
+
+        full_matches, token_matches, seen = [], [], set()
+        position = bisect_left(self._prefixes, prefix)
+        while position < len(self._keys) and self._prefixes[position].startswith(prefix):
+            _name, kind, ref = self._keys[position]
+            position += 1
+            if ref in seen:
+                continue
+            seen.add(ref)
+            (full_matches if kind == 0 else token_matches).append(self.cities[ref])
+        full_matches.sort(key=lambda city: (len(city["name"]), city["name"]))
+        return (full_matches + token_matches)[:limit]
+
+    def find_city(self, name: str) -> Optional[dict]:
+        target = normalize_search(name)
+        for city in self.search_cities(name, limit=10):
+            if normalize_search(city["name"]) == target:
+                return city
+        return None
+
+    def add_cities(self, cities: List[dict]) -> "ReferenceIndex":
+        """Copy of the index with ``cities`` added (or replaced by ref)."""
+        merged = {**self.cities, **{city["ref"]: city for city in cities}}
+        return ReferenceIndex(list(merged.values()), self.warehouses)
+
+    def add_warehouses(self, city_ref: str, warehouses: List[dict]) -> "ReferenceIndex":
+        """Copy of the index with the warehouse list of ``city_ref`` set."""
+        return ReferenceIndex(list(self.cities.values()), {**self.warehouses, city_ref: warehouses})
+
+
+_index = ReferenceIndex([], {})
+
+
+def get_index() -> ReferenceIndex:
+    return _index
+
+
+# --- API ---
+
+async def _call(called_method: str, method_properties: dict, timeout: Optional[float] = None) -> List[dict]:
+    payload = {
+        "apiKey": _nova_poshta_api_key(),
+        "modelName": "Address",
+        "calledMethod": called_method,
+        "methodProperties": method_properties,
+    }
+    kwargs = {"json": payload}
+    if timeout is not None:
+        kwargs["timeout"] = timeout
+    response = await get_http_client("nova_poshta").post(NP_API_URL, **kwargs)
+    response_json = response.json()
+    if not response_json.get("success"):
+        raise RuntimeError(f"Nova Poshta API error ({called_method}): {response_json.get('errors')}")
+    return response_json.get("data", []) or []
+
+
+def _city_row(item: dict) -> tuple:
+    return (
+        item.get("Ref"),
+        item.get("Description") or "",
+        item.get("DescriptionRu") or "",
+        item.get("AreaDescription") or "",
+        item.get("SettlementTypeDescription") or "",
+    )
+
+
+def _warehouse_row(item: dict) -> tuple:
+    try:
+        number = int(item.get("Number") or 0)
+    except (TypeError, ValueError):
+        number = 0
+    return (
+        item.get("Ref"),
+        item.get("CityRef"),
+        item.get("Description") or "",
+        number,
+        item.get("CategoryOfWarehouse") or "",
+    )
+
+
+# --- DB store ---
+
+def _upsert_cities(cur, rows: List[tuple], refreshed_at: datetime) -> None:
+    cur.execute_values(
+        """
+        INSERT INTO np_cities (ref, description, description_ru, area, settlement_type, updated_at)
+        VALUES ?
+        ON CONFLICT (ref) DO UPDATE SET
+            description = EXCLUDED.description,
+            description_ru = EXCLUDED.description_ru,
+            area = EXCLUDED.area,
+            settlement_type = EXCLUDED.settlement_type,
+            updated_at = EXCLUDED.updated_at
+        """,
+        [row + (refreshed_at,) for row in rows if row[0]],
+    )
+
+
+def _upsert_warehouses(cur, rows: List[tuple], refreshed_at: datetime) -> None:
+    cur.execute_values(
+        """
+        INSERT INTO np_warehouses (ref, city_ref, description, number, category, updated_at)
+        VALUES ?
+        ON CONFLICT (ref) DO UPDATE SET
+            city_ref = EXCLUDED.city_ref,
+            description = EXCLUDED.description,
+            number = EXCLUDED.number,
+            category = EXCLUDED.category,
+            updated_at = EXCLUDED.updated_at
+        """,
+        [row + (refreshed_at,) for row in rows if row[0] and row[1]],
+    )
+
+
+def _store(city_rows: List[tuple], warehouse_rows: List[tuple], prune_before: Optional[datetime] = None) -> None:
+    refreshed_at = datetime.now()
+    conn = get_db_connection()
+    try:
+        cur = conn.cursor()
+        if city_rows:
+            _upsert_cities(cur, city_rows, refreshed_at)
+        if warehouse_rows:
+            _upsert_warehouses(cur, warehouse_rows, refreshed_at)
+        if prune_before is not None:
+            cur.execute("DELETE FROM np_warehouses WHERE updated_at < ?", (prune_before,))
+            cur.execute("DELETE FROM np_cities WHERE updated_at < ?", (prune_before,))
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def _load_index() -> ReferenceIndex:
+    conn = get_db_connection()
+    try:
+        city_rows = conn.execute("SELECT ref, description FROM np_cities ORDER BY description").fetchall()
+        warehouse_rows = conn.execute(
+            "SELECT ref, city_ref, description FROM np_warehouses ORDER BY city_ref, number, description"
+        ).fetchall()
+    finally:
+        conn.close()
+
+    cities = [{"ref": row["ref"], "name": row["description"]} for row in city_rows]
+    warehouses: Dict[str, List[dict]] = {}
+    for row in warehouse_rows:
+        warehouses.setdefault(row["city_ref"], []).append({"ref": row["ref"], "name": row["description"]})
+    return ReferenceIndex(cities, warehouses)
+
+
+def _last_refreshed_at() -> Optional[datetime]:
+    conn = get_db_connection()
+    try:
+        row = conn.execute("SELECT MAX(updated_at) AS refreshed_at FROM np_cities").fetchone()
+    finally:
+        conn.close()
+    return (row or {}).get("refreshed_at")
+
+
+def _try_lock(conn) -> bool:
+    row = conn.execute("SELECT pg_try_advisory_lock(?) AS locked", (_REFRESH_LOCK_KEY,)).fetchone()
+    return bool(row and row["locked"])
+
+
+# --- Bulk refresh ---
+
+async def _fetch_all(called_method: str) -> List[dict]:
+    items: List[dict] = []
+    page = 1
+    while True:
+        batch = await _call(called_method, {"Page": str(page), "Limit": str(NP_PAGE_SIZE)}, timeout=60.0)
+        items.extend(batch)
+        if len(batch) < NP_PAGE_SIZE:
+            return items
+        page += 1
+
+
+async def refresh_reference_data() -> bool:
+    """Bulk-download all cities and warehouses. Returns False if another worker holds the lock."""
+    lock_conn = await asyncio.to_thread(get_db_connection)
+    try:
+        if not await asyncio.to_thread(_try_lock, lock_conn):
+            return False
+        started_at = datetime.now()
+        cities = await _fetch_all("getCities")
+        warehouses = await _fetch_all("getWarehouses")
+        if not cities or not warehouses:
+            logger.warning("Nova Poshta refresh returned no data; keeping existing reference tables")
+            return True
+        await asyncio.to_thread(
+            _store,
+            [_city_row(item) for item in cities],
+            [_warehouse_row(item) for item in warehouses],
+            started_at,
+        )
+        logger.info("Nova Poshta reference data refreshed: cities=%s warehouses=%s", len(cities), len(warehouses))
+        return True
+    finally:
+        await asyncio.to_thread(lock_conn.close)
+
+
+async def reload_index() -> None:
+    global _index
+    _index = await asyncio.to_thread(_load_index)
+
+
+async def _refresh_loop() -> None:
+    while True:
+        try:
+            refreshed_at = await asyncio.to_thread(_last_refreshed_at)
+            stale = refreshed_at is None or datetime.now() - refreshed_at > timedelta(hours=NP_REFRESH_HOURS)
+            if stale and os.getenv("NOVA_POSHTA_API_KEY"):
+                await refresh_reference_data()
+            await reload_index()
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Nova Poshta reference refresh failed")
+        await asyncio.sleep(NP_REFRESH_CHECK_SECONDS)
+
+
+def start_reference_refresh() -> None:
+    """Start the periodic refresh/reload loop (call from the app startup hook)."""
+    global _refresh_task
+    if _refresh_task is None or _refresh_task.done():
+        _refresh_task = asyncio.get_running_loop().create_task(_refresh_loop())
+
+
+async def stop_reference_refresh() -> None:
+    global _refresh_task
+    if _refresh_task is not None:
+        _refresh_task.cancel()
+        try:
+            await _refresh_task
+        except asyncio.CancelledError:
+            pass
+        _refresh_task = None
+
+
+# --- Lookups (index first, live API on miss) ---
+
+async def search_cities(query: str, limit: int = 20) -> List[dict]:
+    global _index
+    cities = _index.search_cities(query, limit)
+    if cities:
+        return cities
+
+    items = await _call("getCities", {"FindByString": query, "Limit": str(limit)}, timeout=10.0)
+    rows = [_city_row(item) for item in items]
+    cities = [{"ref": row[0], "name": row[1]} for row in rows]
+    if rows:
+        await asyncio.to_thread(_store, rows, [])
+        # Serve the next keystrokes from memory instead of waiting for reload_index.
+        _index = _index.add_cities([city for city in cities if city["ref"]])
+    return cities
+
+
+async def find_city(name: str) -> Optional[dict]:
+    city = _index.find_city(name)
+    if city:
+        return city
+    cities = await search_cities(name, limit=1)
+    return cities[0] if cities else None
+
+
+async def list_warehouses(city_ref: str, limit: int = NP_WAREHOUSE_LIMIT) -> List[dict]:
+    global _index
+    warehouses = _index.warehouses.get(city_ref)
+    if warehouses:
+        return warehouses[:limit]
+
+    items = await _call("getWarehouses", {"CityRef": city_ref, "Limit": str(limit)}, timeout=10.0)
+    rows = [_warehouse_row(item) for item in items]
+    warehouses = [{"ref": row[0], "name": row[2]} for row in rows]
+    if rows:
+        await asyncio.to_thread(_store, [], rows)
+        indexed = [{"ref": row[0], "name": row[2]} for row in rows if row[0] and row[1] == city_ref]
+        if indexed:
+            _index = _index.add_warehouses(city_ref, indexed)
+    return warehouses
@@ -3,7 +3,6 @@ OneBox OS CRM — direct API v2 integration.
 """
 
 import asyncio
-import httpx
 import logging
 import os
 import time
@@ -13,6 +12,9 @@ import psycopg2
 from psycopg2.extras import RealDictCursor
 from dotenv import load_dotenv
 
+from db import PGConnAdapter
+from services.http_clients import get_http_client
+
 load_dotenv()
 logger = logging.getLogger(__name__)
 
@@ -32,14 +34,14 @@ async def get_onebox_token() -> str:
     if _cached_token and (time.time() - _token_timestamp < TOKEN_TTL):
         return _cached_token
     logger.info("[OneBox] Requesting new API token…")
-    async with httpx.AsyncClient() as client:
-        resp = await client.post(
-            f"{ONEBOX_URL}/api/v2/token/get/",
-            json={"login": ONEBOX_LOGIN, "restapipassword": ONEBOX_API_PASSWORD},
-            timeout=15.0,
-        )
-        resp.raise_for_status()
-        data = resp.json()
+    client = get_http_client("onebox")
+    resp = await client.post(
+        f"{ONEBOX_URL}/api/v2/token/get/",
+        json={"login": ONEBOX_LOGIN, "restapipassword": ONEBOX_API_PASSWORD},
+        timeout=15.0,
+    )
+    resp.raise_for_status()
+    data = resp.json()
     _cached_token = data.get("token") or data.get("dataArray", {}).get("token")
     _token_timestamp = time.time()
     return _cached_token
@@ -94,11 +96,9 @@ class OneBoxDbSession:
     def _sync_get_product(self, product_id: int | str):
         if not self._database_url or not product_id: return None
         try:
-            conn = psycopg2.connect(self._database_url)
-            cur = conn.cursor(cursor_factory=RealDictCursor)
-            cur.execute("SELECT id, sku FROM products WHERE id = %s LIMIT 1", (str(product_id),))
-            row = cur.fetchone()
-            cur.close()
+            # Through the adapter so per-item lookups count towards the request's query budget.
+            conn = PGConnAdapter(psycopg2.connect(self._database_url))
+            row = conn.execute("SELECT id, sku FROM products WHERE id = ? LIMIT 1", (str(product_id),)).fetchone()
             conn.close()
             if not row: return None
             return SimpleNamespace(id=row.get("id"), sku=row.get("sku"))
@@ -125,41 +125,41 @@ async def create_onebox_order(order_data: dict) -> dict:
         product_array = []
         total_sum = 0.0
 
-        async with httpx.AsyncClient() as client:
-            for item in raw_items:
-                item_dict = item if isinstance(item, dict) else vars(item)
-                
-                lookup_articul = str(item_dict.get("sku") or item_dict.get("articul") or item_dict.get("code") or "").strip()
-                if not lookup_articul:
-                    item_id = item_dict.get("id") or item_dict.get("product_id")
-                    if item_id:
-                        lookup_articul = await _fetch_sku(item_id)
-
-                product_id = None
-                if lookup_articul:
-                    product_id = await _onebox_find_product_id_by_articul(client, headers, lookup_articul)
-
-                amount_int = int(item_dict.get("amount") or item_dict.get("quantity") or 1)
-                price_val = float(item_dict.get("price") or 0.0)
-                total_sum += price_val * amount_int
-
-                # ТА САМАЯ ИДЕАЛЬНАЯ СТРУКТУРА ТОВАРА
-                p_obj = {
-                    "name": str(item_dict.get("name") or ""),
-                    "articul": lookup_articul,
-                    "amount": amount_int,
-                    "count": amount_int,          # Ванбокс любит count
-                    "price": price_val,
-                    "pricepurchase": price_val,
-                    "pricesale": price_val,
-                }
-                
-                # Если нашли ID, отдаем его строго в том виде, в котором просил Ванбокс (ошибка 400)
-                if product_id:
-                    p_obj["productid"] = product_id
-                    p_obj["productinfo"] = {"id": product_id}
-                
-                product_array.append(p_obj)
+        client = get_http_client("onebox")
+        for item in raw_items:
+            item_dict = item if isinstance(item, dict) else vars(item)
+            
+            lookup_articul = str(item_dict.get("sku") or item_dict.get("articul") or item_dict.get("code") or "").strip()
+            if not lookup_articul:
+                item_id = item_dict.get("id") or item_dict.get("product_id")
+                if item_id:
+                    lookup_articul = await _fetch_sku(item_id)
+
+            product_id = None
+            if lookup_articul:
+                product_id = await _onebox_find_product_id_by_articul(client, headers, lookup_articul)
+
+            amount_int = int(item_dict.get("amount") or item_dict.get("quantity") or 1)
+            price_val = float(item_dict.get("price") or 0.0)
+            total_sum += price_val * amount_int
+
+            # ТА САМАЯ ИДЕАЛЬНАЯ СТРУКТУРА ТОВАРА
+            p_obj = {
+                "name": str(item_dict.get("name") or ""),
+                "articul": lookup_articul,
+                "amount": amount_int,
+                "count": amount_int,          # Ванбокс любит count
+                "price": price_val,
+                "pricepurchase": price_val,
+                "pricesale": price_val,
+            }
+            
+            # Если нашли ID, отдаем его строго в том виде, в котором просил Ванбокс (ошибка 400)
+            if product_id:
+                p_obj["productid"] = product_id
+                p_obj["productinfo"] = {"id": product_id}
+            
+            product_array.append(p_obj)
 
         sum_str = "{:.4f}".format(total_sum)
 
@@ -210,13 +210,12 @@ async def create_onebox_order(order_data: dict) -> dict:
         logger.info("[OneBox] Final Payload (JSON):")
         logger.info(json.dumps(payload, ensure_ascii=False, indent=2))
 
-        async with httpx.AsyncClient() as client:
-            resp = await client.post(
-                f"{ONEBOX_URL}/api/v2/order/set/",
-                json=payload,
-                headers=headers,
-                timeout=30.0,
-            )
+        resp = await client.post(
+            f"{ONEBOX_URL}/api/v2/order/set/",
+            json=payload,
+            headers=headers,
+            timeout=30.0,
+        )
         
         logger.info(f"[OneBox] Response: {resp.text}")
         return resp.json()
@@ -0,0 +1,155 @@
+"""Normalized order lines (``order_items``) next to the ``orders.items`` JSONB.
+
+``create_order`` writes the lines in the order's transaction; historical orders
+are filled by ``backfill_order_items``. Per-product sales then run as indexed
+SQL instead of decoding every order's JSON in Python.
+"""
+
+from __future__ import annotations
+
+import logging
+from typing import Iterable, List, Optional
+
+from db import get_db_connection
+from services.json_columns import order_item_list
+from services.orders import order_date_bounds
+
+logger = logging.getLogger(__name__)
+
+BACKFILL_BATCH_SIZE = 1000
+
+# Orders that never turned into a sale are left out of sales totals.
+EXCLUDED_SALE_STATUSES = ("Cancelled", "Canceled", "Скасовано", "Отменен")
+
+
+def _as_int(value) -> Optional[int]:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _as_float(value) -> float:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def item_rows(order_id: int, items: Iterable[dict]) -> List[tuple]:
+    """``order_items`` tuples for the parsed ``orders.items`` list."""
+    rows = []
+    for line_no, item in enumerate(items or [], start=1):
+        if not isinstance(item, dict):
+            continue
+        rows.append((
+            order_id,
+            line_no,
+            _as_int(item.get("product_id") or item.get("id")),
+            item.get("name"),
+            _as_int(item.get("quantity")) or 1,
+            _as_float(item.get("price")),
+            item.get("packSize"),
+            item.get("unit"),
+            item.get("variant_info"),
+        ))
+    return rows
+
+
+def insert_order_items(cur, order_id: int, items: Iterable[dict]) -> int:
+    """Write the lines of one order with the caller's cursor (no commit)."""
+    return _insert_rows(cur, item_rows(order_id, items))
+
+
+def _insert_rows(cur, rows: List[tuple]) -> int:
+    if not rows:
+        return 0
+    cur.execute_values(
+        """
+        INSERT INTO order_items (order_id, line_no, product_id, name, quantity, price, pack_size, unit, variant_info)
+        VALUES ?
+        ON CONFLICT (order_id, line_no) DO NOTHING
+        """,
+        rows,
+    )
+    # SKU is taken from the catalog at order time; the cart does not send it.
+    cur.execute(
+        """
+        UPDATE order_items oi SET sku = p.sku
+        FROM products p
+        WHERE oi.order_id = ANY(?) AND oi.sku IS NULL AND p.id = oi.product_id
+        """,
+        (sorted({row[0] for row in rows}),),
+    )
+    return len(rows)
+
+
+def backfill_order_items(batch_size: int = BACKFILL_BATCH_SIZE) -> dict:
+    """Fill ``order_items`` for orders that have none, in id order, one commit per batch."""
+    last_id, orders, lines = 0, 0, 0
+    conn = get_db_connection()
+    try:
+        cur = conn.cursor()
+        while True:
+            batch = cur.execute(
+                """
+                SELECT o.id, o.items FROM orders o
+                WHERE o.id > ? AND NOT EXISTS (SELECT 1 FROM order_items oi WHERE oi.order_id = o.id)
+                ORDER BY o.id
+                LIMIT ?
+                """,
+                (last_id, batch_size),
+            ).fetchall()
+            if not batch:
+                break
+            rows = []
+            for order in batch:
+                rows.extend(item_rows(order["id"], order_item_list(order["items"])))
+            lines += _insert_rows(cur, rows)
+            conn.commit()
+            orders += len(batch)
+            last_id = batch[-1]["id"]
+    finally:
+        conn.close()
+    logger.info("order_items backfill: orders=%s lines=%s", orders, lines)
+    return {"orders": orders, "lines": lines}
+
+
+def product_sales(
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    limit: int = 50,
+    order_by: str = "quantity",
+) -> List[dict]:
+    """Units, revenue and order count per product (bestsellers / revenue per SKU)."""
+    conditions = ["NOT (COALESCE(o.status, '') = ANY(?))"]
+    params: list = [list(EXCLUDED_SALE_STATUSES)]
+    date_from, date_to = order_date_bounds(date_from, date_to)
+    if date_from:
+        conditions.append("o.date >= ?")
+        params.append(date_from)
+    if date_to:
+        conditions.append("o.date < ?")
+        params.append(date_to)
+    sort_column = "revenue" if order_by == "revenue" else "quantity"
+    params.append(limit)
+
+    conn = get_db_connection()
+    try:
+        rows = conn.execute(
+            f"""
+            SELECT oi.product_id, MAX(oi.sku) AS sku, MAX(oi.name) AS name,
+                   SUM(oi.quantity) AS quantity, SUM(oi.quantity * oi.price) AS revenue,
+                   COUNT(DISTINCT oi.order_id) AS orders
+            FROM order_items oi
+            JOIN orders o ON o.id = oi.order_id
+            WHERE {" AND ".join(conditions)}
+            GROUP BY oi.product_id
+            ORDER BY {sort_column} DESC
+            LIMIT ?
+            """,
+            tuple(params),
+        ).fetchall()
+    finally:
+        conn.close()
+    return [dict(row) for row in rows]
@@ -0,0 +1,148 @@
+"""Admin order listing: keyset pages over ``orders`` with filters.
+
+Pages are ordered by ``id DESC`` and continue from ``cursor`` (the last id of
+the previous page), so every page costs the same no matter how long the
+history is. The list projection leaves out the ``items`` JSON; when asked, the
+lines of the page's orders are read from ``order_items`` in one query.
+"""
+
+from __future__ import annotations
+
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import List, Optional, Tuple
+
+from fastapi import HTTPException
+
+from db import get_db_connection
+from services.json_columns import order_item_list
+from services.users import normalize_phone
+
+ORDER_LIST_COLUMNS = (
+    "id", "date", "name", "phone", "user_phone", "email", "contact_preference", "city", "warehouse",
+    "delivery_method", "user_ukrposhta", "total_price", "payment_method", "bonus_used", "status",
+)
+ORDER_PAGE_MAX = 200
+
+
+def _order_date(value: str, name: str, end: bool = False) -> str:
+    text = value.strip()
+    try:
+        parsed = datetime.fromisoformat(text)
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Invalid {name}: expected YYYY-MM-DD or YYYY-MM-DD HH:MM:SS")
+    if len(text) <= 10:
+        day = parsed.date() + timedelta(days=1) if end else parsed.date()
+        return day.isoformat()
+    return parsed.strftime("%Y-%m-%d %H:%M:%S")
+
+
+def order_date_bounds(date_from: Optional[str], date_to: Optional[str]) -> Tuple[Optional[str], Optional[str]]:
+    """``[lower, upper)`` bounds on ``orders.date`` ('YYYY-MM-DD HH:MM:SS' text).
+
+    A plain ``date_to`` is inclusive (upper bound is the next day). Malformed
+    dates are a 400, not a failed query.
+    """
+    lower = _order_date(date_from, "date_from") if date_from else None
+    upper = _order_date(date_to, "date_to", end=True) if date_to else None
+    return lower, upper
+
+
+def build_order_filters(
+    status: Optional[str],
+    date_from: Optional[str],
+    date_to: Optional[str],
+    phone: Optional[str],
+    payment_method: Optional[str],
+    delivery_method: Optional[str],
+) -> tuple:
+    """WHERE conditions and params over ``orders``, shared by the list and the export."""
+    conditions, params = [], []
+    if status:
+        conditions.append("status = ?")
+        params.append(status)
+    date_from, date_to = order_date_bounds(date_from, date_to)
+    if date_from:
+        conditions.append("date >= ?")
+        params.append(date_from)
+    if date_to:
+        conditions.append("date < ?")
+        params.append(date_to)
+    clean_phone = normalize_phone(phone) if phone else ""
+    if clean_phone:
+        conditions.append("(user_phone = ? OR phone = ?)")
+        params.extend([clean_phone, clean_phone])
+    if payment_method:
+        conditions.append("payment_method = ?")
+        params.append(payment_method)
+    if delivery_method:
+        conditions.append("delivery_method = ?")
+        params.append(delivery_method)
+    return conditions, params
+
+
+def _lines_by_order(conn, order_ids: List[int]) -> dict:
+    rows = conn.execute(
+        """
+        SELECT order_id, product_id, name, quantity, price, pack_size, unit, variant_info
+        FROM order_items WHERE order_id = ANY(?)
+        ORDER BY order_id, line_no
+        """,
+        (order_ids,),
+    ).fetchall()
+    lines = defaultdict(list)
+    for row in rows:
+        lines[row["order_id"]].append({
+            "product_id": row["product_id"],
+            "name": row["name"],
+            "quantity": row["quantity"],
+            "price": row["price"],
+            "packSize": row["pack_size"],
+            "unit": row["unit"],
+            "variant_info": row["variant_info"],
+        })
+    return lines
+
+
+def list_orders_page(
+    limit: int = 50,
+    cursor: Optional[int] = None,
+    status: Optional[str] = None,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    phone: Optional[str] = None,
+    payment_method: Optional[str] = None,
+    delivery_method: Optional[str] = None,
+    include_items: bool = False,
+) -> dict:
+    """One page of orders (newest first) and the cursor for the next page."""
+    limit = max(1, min(int(limit), ORDER_PAGE_MAX))
+    conditions, params = build_order_filters(status, date_from, date_to, phone, payment_method, delivery_method)
+    if cursor:
+        conditions.append("id < ?")
+        params.append(int(cursor))
+    where_sql = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+    conn = get_db_connection()
+    try:
+        rows = conn.execute(
+            f"SELECT {', '.join(ORDER_LIST_COLUMNS)} FROM orders {where_sql} ORDER BY id DESC LIMIT ?",
+            tuple(params) + (limit + 1,),
+        ).fetchall()
+        orders = [dict(row) for row in rows[:limit]]
+        if include_items and orders:
+            lines = _lines_by_order(conn, [order["id"] for order in orders])
+            missing = [order["id"] for order in orders if order["id"] not in lines]
+            if missing:
+                # Orders not yet backfilled into order_items: fall back to orders.items.
+                for row in conn.execute("SELECT id, items FROM orders WHERE id = ANY(?)", (missing,)).fetchall():
+                    lines[row["id"]] = order_item_list(row["items"])
+            for order in orders:
+                order["items"] = lines.get(order["id"], [])
+    finally:
+        conn.close()
+
+    for order in orders:
+        order["totalPrice"] = order.get("total_price") or 0
+    next_cursor = orders[-1]["id"] if len(rows) > limit else None
+    return {"orders": orders, "next_cursor": next_cursor}
@@ -5,6 +5,11 @@ from __future__ import annotations
 from typing import List
 
 from db import get_db_connection
+from services.json_columns import images_text, variant_list
+
+# Catalog grouping key (variants share parent_sku). Served by the expression index
+# idx_products_group_key; the planner only uses it if this text matches exactly.
+PRODUCT_GROUP_KEY_SQL = "COALESCE(NULLIF(parent_sku, ''), NULLIF(sku, ''), CAST(id AS TEXT))"
 
 
 def get_products_by_ids(ids: List[int]) -> List[dict]:
@@ -30,23 +35,7 @@ def normalize_product_row(d: dict) -> dict:
     """Normalize product DB row for API responses."""
     d["discount"] = d.get("discount", 0) if d.get("discount") is not None else 0
 
-    variants_value = d.get("variants")
-    if isinstance(variants_value, str):
-        try:
-            import json
-            d["variants"] = json.loads(variants_value)
-        except (json.JSONDecodeError, TypeError):
-            d["variants"] = []
-    elif isinstance(variants_value, list):
-        d["variants"] = variants_value
-    else:
-        d["variants"] = []
-
-    images_value = d.get("images")
-    if isinstance(images_value, str):
-        d["images"] = images_value
-    elif isinstance(images_value, list):
-        d["images"] = ",".join(str(x) for x in images_value)
-    elif images_value is None:
-        d["images"] = ""
+    d["variants"] = variant_list(d.get("variants"))
+    # Stored as a JSONB array; the API keeps serving the comma-joined string.
+    d["images"] = images_text(d.get("images"))
     return d
@@ -0,0 +1,138 @@
+"""Promo code validation and redemption.
+
+Validation (checkout typing) is answered from an in-process map of active
+codes, reloaded after ``PROMO_CACHE_TTL`` seconds or as soon as an admin
+creates, toggles or deletes a code in this worker. Its ``current_uses`` is only
+a snapshot: the authoritative check is ``redeem_promo_code``, a single
+conditional UPDATE, so concurrent orders cannot push a code past ``max_uses``.
+"""
+
+from __future__ import annotations
+
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Dict, Optional
+
+from db import get_db_connection
+
+PROMO_CACHE_TTL = float(os.getenv("PROMO_CACHE_TTL", "60"))
+
+_cache_lock = threading.Lock()
+_active_codes: Optional[Dict[str, dict]] = None
+_loaded_at = 0.0
+
+
+class PromoCodeError(ValueError):
+    def __init__(self, message: str, status_code: int = 400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def normalize_code(code: str) -> str:
+    return (code or "").strip().upper()
+
+
+def invalidate_promo_cache() -> None:
+    global _active_codes
+    with _cache_lock:
+        _active_codes = None
+
+
+def _load_active_codes() -> Dict[str, dict]:
+    conn = get_db_connection()
+    try:
+        rows = conn.execute(
+            """
+            SELECT code, discount_percent, discount_amount, max_uses, current_uses, expires_at
+            FROM promo_codes WHERE active = 1
+            """
+        ).fetchall()
+    finally:
+        conn.close()
+    return {row["code"]: dict(row) for row in rows}
+
+
+def _active_code_map() -> Dict[str, dict]:
+    global _active_codes, _loaded_at
+    with _cache_lock:
+        if _active_codes is not None and time.monotonic() - _loaded_at < PROMO_CACHE_TTL:
+            return _active_codes
+    codes = _load_active_codes()
+    with _cache_lock:
+        _active_codes, _loaded_at = codes, time.monotonic()
+    return codes
+
+
+def _is_expired(expires_at: Optional[str]) -> bool:
+    if not expires_at:
+        return False
+    try:
+        return datetime.now() > datetime.fromisoformat(expires_at)
+    except ValueError:
+        return False
+
+
+def _is_exhausted(promo: dict) -> bool:
+    max_uses = promo.get("max_uses") or 0
+    return max_uses > 0 and (promo.get("current_uses") or 0) >= max_uses
+
+
+def _discount(promo: dict) -> dict:
+    return {
+        "valid": True,
+        "code": promo["code"],
+        "discount_percent": promo.get("discount_percent") or 0,
+        "discount_amount": promo.get("discount_amount") or 0,
+    }
+
+
+def check_promo_code(code: str) -> dict:
+    """Discount details of an active code (from the cache); raises ``PromoCodeError``."""
+    promo = _active_code_map().get(normalize_code(code))
+    if not promo:
+        raise PromoCodeError("Промокод не знайдено", status_code=404)
+    if _is_expired(promo.get("expires_at")):
+        raise PromoCodeError("Термін дії промокоду закінчився")
+    if _is_exhausted(promo):
+        raise PromoCodeError("Промокод вичерпано")
+    return _discount(promo)
+
+
+def redeem_promo_code(cur, code: str) -> dict:
+    """Count one use of ``code`` with the caller's cursor (no commit); raises ``PromoCodeError``.
+
+    The row is only updated while it is active, unexpired and under ``max_uses``
+    (0 = unlimited); the row lock makes concurrent redemptions queue on it.
+    """
+    clean_code = normalize_code(code)
+    row = cur.execute(
+        """
+        UPDATE promo_codes SET current_uses = COALESCE(current_uses, 0) + 1
+        WHERE code = ? AND active = 1
+          AND (COALESCE(max_uses, 0) <= 0 OR COALESCE(current_uses, 0) < max_uses)
+          AND (COALESCE(expires_at, '') = '' OR expires_at > ?)
+        RETURNING code, discount_percent, discount_amount, max_uses, current_uses
+        """,
+        (clean_code, datetime.now().isoformat()),
+    ).fetchone()
+    if row:
+        promo = dict(row)
+        if _is_exhausted(promo):
+            invalidate_promo_cache()
+        return _discount(promo)
+
+    # Not redeemed: say why, the same way validation does.
+    current = cur.execute(
+        "SELECT code, active, max_uses, current_uses, expires_at FROM promo_codes WHERE code = ?",
+        (clean_code,),
+    ).fetchone()
+    if not current:
+        raise PromoCodeError("Промокод не знайдено", status_code=404)
+    if not current["active"]:
+        raise PromoCodeError("Промокод неактивний")
+    if _is_exhausted(dict(current)):
+        invalidate_promo_cache()
+        raise PromoCodeError("Промокод вичерпано")
+    raise PromoCodeError("Термін дії промокоду закінчився")
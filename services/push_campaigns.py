@@ -0,0 +1,256 @@
+"""Marketing push campaigns sent to a segment of users.
+
+A campaign row in ``push_campaigns`` stores the message, the segment filter and
+progress counters. The runner streams matching ``users.push_token`` values with
+a server-side cursor (never loading the whole segment), and sends them in
+chunks through ``services.notifications.send_push_messages``, which batches
+and throttles delivery. Progress and a keyset checkpoint (``last_token``) are
+saved after every chunk, so a campaign can be cancelled between chunks and an
+interrupted one can be resumed.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import contextvars
+import json
+import logging
+import os
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from db import get_db_connection
+from services.notifications import build_message, send_push_messages
+
+logger = logging.getLogger(__name__)
+
+PUSH_CAMPAIGN_CHUNK_SIZE = int(os.getenv("PUSH_CAMPAIGN_CHUNK_SIZE", "500"))
+
+RESUMABLE_STATUSES = ("failed", "interrupted", "cancelled")
+
+_tasks: Dict[int, asyncio.Task] = {}
+
+
+def build_segment_where(segment: dict) -> Tuple[str, list]:
+    """Translate a segment filter into a WHERE clause over ``users u``."""
+    conditions = ["u.push_token LIKE ?"]
+    params: list = ["ExponentPushToken%"]
+
+    city = (segment.get("city") or "").strip()
+    if city:
+        conditions.append("u.city ILIKE ?")
+        params.append(city)
+    levels = segment.get("cashback_levels")
+    if levels:
+        conditions.append("COALESCE(u.cashback_percent, 0) = ANY(?)")
+        params.append([int(level) for level in levels])
+    if segment.get("has_bonuses") is True:
+        conditions.append("COALESCE(u.bonus_balance, 0) > 0")
+    elif segment.get("has_bonuses") is False:
+        conditions.append("COALESCE(u.bonus_balance, 0) <= 0")
+
+    # orders.date is stored as 'YYYY-MM-DD HH:MM:SS' text, so string comparison orders correctly.
+    last_order_sql = "(SELECT MAX(o.date) FROM orders o WHERE o.user_phone = u.phone)"
+    if segment.get("last_order_after"):
+        conditions.append(f"{last_order_sql} >= ?")
+        params.append(segment["last_order_after"])
+    if segment.get("last_order_before"):
+        conditions.append(f"COALESCE({last_order_sql}, '') < ?")
+        params.append(segment["last_order_before"])
+
+    return " AND ".join(conditions), params
+
+
+def count_segment(segment: dict) -> int:
+    where_sql, params = build_segment_where(segment)
+    conn = get_db_connection()
+    try:
+        row = conn.execute(
+            f"SELECT COUNT(DISTINCT u.push_token) AS total FROM users u WHERE {where_sql}",
+            tuple(params),
+        ).fetchone()
+    finally:
+        conn.close()
+    return int((row or {}).get("total") or 0)
+
+
+def _campaign_row(row: dict) -> dict:
+    campaign = dict(row)
+    for key in ("data", "segment"):
+        try:
+            campaign[key] = json.loads(campaign.get(key) or "{}")
+        except (TypeError, ValueError):
+            campaign[key] = {}
+    return campaign
+
+
+def get_campaign(campaign_id: int) -> Optional[dict]:
+    conn = get_db_connection()
+    try:
+        row = conn.execute("SELECT * FROM push_campaigns WHERE id = ?", (campaign_id,)).fetchone()
+    finally:
+        conn.close()
+    return _campaign_row(row) if row else None
+
+
+def list_campaigns(limit: int = 50) -> List[dict]:
+    conn = get_db_connection()
+    try:
+        rows = conn.execute("SELECT * FROM push_campaigns ORDER BY id DESC LIMIT ?", (limit,)).fetchall()
+    finally:
+        conn.close()
+    return [_campaign_row(row) for row in rows]
+
+
+def create_campaign(title: str, body: str, data: dict, segment: dict) -> dict:
+    total = count_segment(segment)
+    conn = get_db_connection()
+    try:
+        row = conn.execute(
+            """
+            INSERT INTO push_campaigns (title, body, data, segment, status, total, created_at)
+            VALUES (?, ?, ?, ?, 'pending', ?, ?)
+            RETURNING *
+            """,
+            (title, body, json.dumps(data or {}, ensure_ascii=False), json.dumps(segment, ensure_ascii=False), total, datetime.now()),
+        ).fetchone()
+        conn.commit()
+    finally:
+        conn.close()
+    return _campaign_row(row)
+
+
+def _set_status(campaign_id: int, status: str, error: Optional[str] = None) -> None:
+    conn = get_db_connection()
+    try:
+        finished = datetime.now() if status in ("completed", "failed", "cancelled") else None
+        conn.execute(
+            """
+            UPDATE push_campaigns
+            SET status = ?, error = ?,
+                started_at = CASE WHEN ? = 'running' THEN COALESCE(started_at, ?) ELSE started_at END,
+                finished_at = ?
+            WHERE id = ?
+            """,
+            (status, error, status, datetime.now(), finished, campaign_id),
+        )
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def _save_progress(campaign_id: int, processed: int, result: dict, last_token: str) -> str:
+    """Add chunk counters, store the checkpoint and return the current status (to see cancellation)."""
+    conn = get_db_connection()
+    try:
+        row = conn.execute(
+            """
+            UPDATE push_campaigns
+            SET processed = processed + ?, sent = sent + ?, failed = failed + ?,
+                unregistered = unregistered + ?, last_token = ?
+            WHERE id = ?
+            RETURNING status
+            """,
+            (processed, result["sent"], result["failed"], result["unregistered"], last_token, campaign_id),
+        ).fetchone()
+        conn.commit()
+    finally:
+        conn.close()
+    return (row or {}).get("status") or "running"
+
+
+def cancel_campaign(campaign_id: int) -> bool:
+    conn = get_db_connection()
+    try:
+        cur = conn.execute(
+            "UPDATE push_campaigns SET status = 'cancelled', finished_at = ? WHERE id = ? AND status IN ('pending', 'running')",
+            (datetime.now(), campaign_id),
+        )
+        conn.commit()
+        return cur.rowcount > 0
+    finally:
+        conn.close()
+
+
+def resume_campaign(campaign_id: int) -> bool:
+    """Move a stopped campaign back to 'pending'; it continues after ``last_token``."""
+    conn = get_db_connection()
+    try:
+        cur = conn.execute(
+            "UPDATE push_campaigns SET status = 'pending', error = NULL, finished_at = NULL WHERE id = ? AND status = ANY(?)",
+            (campaign_id, list(RESUMABLE_STATUSES)),
+        )
+        conn.commit()
+        return cur.rowcount > 0
+    finally:
+        conn.close()
+
+
+async def run_campaign(campaign_id: int) -> None:
+    """Stream the segment's tokens and send the campaign chunk by chunk."""
+    campaign = await asyncio.to_thread(get_campaign, campaign_id)
+    if not campaign or campaign["status"] != "pending":
+        return
+
+    where_sql, params = build_segment_where(campaign["segment"])
+    if campaign.get("last_token"):
+        where_sql += " AND u.push_token > ?"
+        params.append(campaign["last_token"])
+
+    await asyncio.to_thread(_set_status, campaign_id, "running")
+    conn = await asyncio.to_thread(get_db_connection)
+    try:
+        cursor = conn.named_cursor(f"push_campaign_{campaign_id}", itersize=PUSH_CAMPAIGN_CHUNK_SIZE)
+        await asyncio.to_thread(
+            cursor.execute,
+            f"SELECT DISTINCT u.push_token FROM users u WHERE {where_sql} ORDER BY u.push_token",
+            tuple(params),
+        )
+        while True:
+            rows = await asyncio.to_thread(cursor.fetchmany, PUSH_CAMPAIGN_CHUNK_SIZE)
+            if not rows:
+                break
+            tokens = [row["push_token"] for row in rows]
+            messages = [build_message(token, campaign["title"], campaign["body"], campaign["data"]) for token in tokens]
+            result = await send_push_messages(messages)
+            status = await asyncio.to_thread(_save_progress, campaign_id, len(tokens), result, tokens[-1])
+            if status != "running":
+                logger.info("Push campaign %s stopped (status=%s)", campaign_id, status)
+                return
+        await asyncio.to_thread(_set_status, campaign_id, "completed")
+        logger.info("Push campaign %s completed", campaign_id)
+    except asyncio.CancelledError:
+        await asyncio.to_thread(_set_status, campaign_id, "interrupted")
+        raise
+    except Exception as exc:
+        logger.exception("Push campaign %s failed", campaign_id)
+        await asyncio.to_thread(_set_status, campaign_id, "failed", str(exc))
+    finally:
+        await asyncio.to_thread(conn.close)
+
+
+def start_campaign(campaign_id: int) -> None:
+    """Run the campaign in the background of this worker's event loop.
+
+    The task gets an empty context rather than a copy of the calling request's,
+    so the campaign and its ``to_thread`` calls are not attributed to that
+    request (metrics, query budgets).
+    """
+    task = _tasks.get(campaign_id)
+    if task is not None and not task.done():
+        return
+    task = asyncio.get_running_loop().create_task(run_campaign(campaign_id), context=contextvars.Context())
+    _tasks[campaign_id] = task
+    task.add_done_callback(lambda _task: _tasks.pop(campaign_id, None))
+
+
+async def stop_campaigns() -> None:
+    """Stop running campaigns on shutdown; they are left 'interrupted' for resume."""
+    tasks = list(_tasks.values())
+    for task in tasks:
+        task.cancel()
+    for task in tasks:
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
@@ -0,0 +1,122 @@
+"""N+1 detector and per-route query budgets (debug/CI mode of the DB adapter).
+
+With ``QUERY_BUDGET_MODE`` set to ``warn`` or ``raise``, ``db.PGCursorAdapter``
+calls ``check_query_budget`` before every statement run inside an HTTP request.
+The check fingerprints the SQL (literals, numbers and ``IN`` lists collapsed,
+whitespace normalized) and counts shapes per request:
+
+* a shape repeated ``QUERY_REPEAT_LIMIT`` times is logged as a likely N+1,
+  with the route and the shape;
+* a request issuing more statements than its route's budget is logged once
+  (``warn``) or stopped with ``QueryBudgetExceeded`` before the statement runs
+  (``raise``, for tests and CI), naming the most repeated shapes.
+
+Budgets are keyed by ``"METHOD /route/template"``: ``ROUTE_QUERY_BUDGETS``
+below, extended or overridden by ``QUERY_BUDGETS``
+(``"POST /create_order=15,GET /api/products=8"``); other routes get
+``QUERY_BUDGET_DEFAULT``. Statements outside requests (startup, background
+loops, scripts) are not checked, nor are those issued after the response is
+sent by tasks the request spawned (``BackgroundTasks``, ``create_task``,
+``to_thread``). Counting relies on the per-request stats of
+``services.metrics``.
+"""
+
+from __future__ import annotations
+
+import logging
+import os
+import re
+from functools import lru_cache
+from typing import Dict, List, Tuple
+
+from services.metrics import current_request_stats, route_label
+
+logger = logging.getLogger(__name__)
+
+QUERY_BUDGET_MODE = os.getenv("QUERY_BUDGET_MODE", "off").strip().lower()
+QUERY_BUDGET_DEFAULT = int(os.getenv("QUERY_BUDGET_DEFAULT", "50"))
+QUERY_REPEAT_LIMIT = int(os.getenv("QUERY_REPEAT_LIMIT", "10"))
+
+# Expected statements per request for the routes known to be query-heavy.
+ROUTE_QUERY_BUDGETS: Dict[str, int] = {
+    "POST /create_order": 15,
+    "POST /api/recalculate-cashback": 5,
+    "GET /api/catalog/changes": 10,
+    "GET /api/catalog/snapshot": 10,
+}
+
+_COMMENT_RE = re.compile(r"--[^\n]*|/\*.*?\*/", re.DOTALL)
+_STRING_RE = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_RE = re.compile(r"(?<![\w.$])\d+(?:\.\d+)?\b")
+_IN_LIST_RE = re.compile(r"\bIN\s*\(\s*\?(?:\s*,\s*\?)*\s*\)", re.IGNORECASE)
+_VALUES_RE = re.compile(r"\bVALUES\s*\([^()]*\)(?:\s*,\s*\([^()]*\))+", re.IGNORECASE)
+_SPACE_RE = re.compile(r"\s+")
+
+
+class QueryBudgetExceeded(RuntimeError):
+    """A request ran more statements than its route's budget (``QUERY_BUDGET_MODE=raise``)."""
+
+
+def _parse_budgets(raw: str) -> Dict[str, int]:
+    budgets = {}
+    for part in raw.split(","):
+        route, _, value = part.strip().rpartition("=")
+        if not route:
+            continue
+        try:
+            budgets[_SPACE_RE.sub(" ", route.strip())] = int(value)
+        except ValueError:
+            logger.warning("QUERY_BUDGETS: ignoring %r", part)
+    return budgets
+
+
+QUERY_BUDGETS = {**ROUTE_QUERY_BUDGETS, **_parse_budgets(os.getenv("QUERY_BUDGETS", ""))}
+
+
+@lru_cache(maxsize=2048)
+def fingerprint(sql: str) -> str:
+    """Statement shape: same query with different parameters or literals -> same fingerprint."""
+    text = _COMMENT_RE.sub(" ", sql)
+    text = _STRING_RE.sub("?", text)
+    text = _NUMBER_RE.sub("?", text.replace("%s", "?"))
+    text = _IN_LIST_RE.sub("IN (...)", text)
+    text = _VALUES_RE.sub("VALUES (...)", text)
+    return _SPACE_RE.sub(" ", text).strip()
+
+
+def budget_for(method: str, route: str) -> int:
+    return QUERY_BUDGETS.get(f"{method} {route}", QUERY_BUDGET_DEFAULT)
+
+
+def _top_shapes(shapes: Dict[str, int], limit: int = 3) -> List[Tuple[int, str]]:
+    ranked = sorted(((count, shape) for shape, count in shapes.items()), reverse=True)
+    return ranked[:limit]
+
+
+def _describe(shapes: Dict[str, int]) -> str:
+    return "; ".join(f"{count}x {shape[:200]}" for count, shape in _top_shapes(shapes))
+
+
+def check_query_budget(sql: str) -> None:
+    """Count ``sql`` against the current request; warn or raise per ``QUERY_BUDGET_MODE``."""
+    if QUERY_BUDGET_MODE not in ("warn", "raise"):
+        return
+    stats = current_request_stats()
+    if stats is None:
+        return
+    shape = fingerprint(sql)
+    count = stats.shapes[shape] = stats.shapes.get(shape, 0) + 1
+    route = route_label(stats.scope)
+    if count == QUERY_REPEAT_LIMIT:
+        logger.warning("Possible N+1 in %s %s: %d x %s", stats.method, route, count, shape[:300])
+
+    issued = stats.queries + 1
+    budget = budget_for(stats.method, route)
+    if issued <= budget:
+        return
+    message = f"{stats.method} {route} issued {issued} statements, budget {budget}. Top shapes: {_describe(stats.shapes)}"
+    if QUERY_BUDGET_MODE == "raise":
+        raise QueryBudgetExceeded(message)
+    if not stats.over_budget:
+        stats.over_budget = True
+        logger.warning("Query budget exceeded: %s", message)
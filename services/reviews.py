@@ -0,0 +1,121 @@
+"""Review listing and the per-product rating aggregate.
+
+``product_rating_stats`` keeps count, sum and a 1..5 histogram per product and
+is updated in the same transaction as the review insert/delete, so catalog
+responses read ratings from one indexed row per product instead of scanning
+``reviews``. Review pages are keyset pages over ``id DESC`` (``cursor`` is the
+last id of the previous page).
+"""
+
+from __future__ import annotations
+
+from typing import Dict, Iterable, List, Optional
+
+REVIEW_PAGE_MAX = 200
+RATING_BUCKETS = (1, 2, 3, 4, 5)
+
+_BUCKET_COLUMNS = ", ".join(f"rating_{b}" for b in RATING_BUCKETS)
+
+
+def _bucket(rating: int) -> int:
+    return min(max(int(rating), RATING_BUCKETS[0]), RATING_BUCKETS[-1])
+
+
+def add_rating(cur, product_id: int, rating: int) -> None:
+    """Count one new review in the aggregate (caller commits with the review insert)."""
+    histogram = tuple(1 if _bucket(rating) == b else 0 for b in RATING_BUCKETS)
+    updates = ", ".join(f"rating_{b} = product_rating_stats.rating_{b} + EXCLUDED.rating_{b}" for b in RATING_BUCKETS)
+    cur.execute(
+        f"""
+        INSERT INTO product_rating_stats (product_id, review_count, rating_sum, {_BUCKET_COLUMNS}, updated_at)
+        VALUES (?, 1, ?, {", ".join("?" for _ in RATING_BUCKETS)}, CURRENT_TIMESTAMP)
+        ON CONFLICT (product_id) DO UPDATE SET
+            review_count = product_rating_stats.review_count + 1,
+            rating_sum = product_rating_stats.rating_sum + EXCLUDED.rating_sum,
+            {updates},
+            updated_at = CURRENT_TIMESTAMP
+        """,
+        (product_id, int(rating)) + histogram,
+    )
+
+
+def remove_rating(cur, product_id: int, rating: int) -> None:
+    """Take a deleted review out of the aggregate (caller commits with the delete)."""
+    bucket = f"rating_{_bucket(rating)}"
+    cur.execute(
+        f"""
+        UPDATE product_rating_stats SET
+            review_count = GREATEST(review_count - 1, 0),
+            rating_sum = GREATEST(rating_sum - ?, 0),
+            {bucket} = GREATEST({bucket} - 1, 0),
+            updated_at = CURRENT_TIMESTAMP
+        WHERE product_id = ?
+        """,
+        (int(rating), product_id),
+    )
+
+
+def _summary(count: int, total: int) -> dict:
+    return {
+        "average_rating": round(total / count, 1) if count else 0,
+        "review_count": count,
+    }
+
+
+def rating_stats(conn, product_ids: Iterable[int]) -> Dict[int, dict]:
+    """Raw aggregate rows by product id (products without reviews are absent)."""
+    ids = sorted({int(pid) for pid in product_ids if pid is not None})
+    if not ids:
+        return {}
+    rows = conn.execute(
+        f"""
+        SELECT product_id, review_count, rating_sum, {_BUCKET_COLUMNS}
+        FROM product_rating_stats WHERE product_id = ANY(?)
+        """,
+        (ids,),
+    ).fetchall()
+    return {int(row["product_id"]): dict(row) for row in rows}
+
+
+def combined_rating(stats: Dict[int, dict], product_ids: Iterable[int]) -> dict:
+    """``average_rating`` / ``review_count`` over several products (variants of one card)."""
+    count = total = 0
+    for pid in product_ids:
+        row = stats.get(int(pid)) if pid is not None else None
+        if row:
+            count += row["review_count"] or 0
+            total += row["rating_sum"] or 0
+    return _summary(count, total)
+
+
+def product_rating(conn, product_id: int) -> dict:
+    """Rating summary with the histogram for one product."""
+    row = rating_stats(conn, [product_id]).get(int(product_id)) or {}
+    summary = _summary(row.get("review_count") or 0, row.get("rating_sum") or 0)
+    summary["rating_histogram"] = {str(b): row.get(f"rating_{b}") or 0 for b in RATING_BUCKETS}
+    return summary
+
+
+def list_reviews_page(conn, product_id: int, limit: int = 50, cursor: Optional[int] = None) -> dict:
+    """One page of a product's reviews (newest first) and the cursor for the next page."""
+    limit = max(1, min(int(limit), REVIEW_PAGE_MAX))
+    params: list = [product_id]
+    cursor_sql = ""
+    if cursor:
+        cursor_sql = "AND id < ?"
+        params.append(int(cursor))
+    rows = conn.execute(
+        f"""
+        SELECT id, product_id, user_name, user_phone, rating, comment, created_at
+        FROM reviews
+        WHERE product_id = ? {cursor_sql}
+        ORDER BY id DESC
+        LIMIT ?
+        """,
+        tuple(params) + (limit + 1,),
+    ).fetchall()
+    reviews: List[dict] = [dict(row) for row in rows[:limit]]
+    return {
+        "reviews": reviews,
+        "next_cursor": reviews[-1]["id"] if len(rows) > limit else None,
+    }
@@ -43,6 +43,8 @@ ADMIN_EXACT_ROUTES: set[tuple[str, str]] = {
 
 
 ADMIN_PREFIX_ROUTES: tuple[tuple[str, str], ...] = (
+    ("GET", "/api/admin/"),
+    ("POST", "/api/admin/"),
     ("GET", "/api/orders/"),
     ("PUT", "/orders/"),
     ("PUT", "/api/orders/"),
@@ -0,0 +1,261 @@
+"""Storage backends for uploaded images and resized derivatives.
+
+Objects are addressed by keys relative to the uploads root, for example
+``<sha256>.jpg`` for an original or ``.cache/img_<digest>.webp`` for a derivative.
+
+``STORAGE_BACKEND=local`` (default) keeps objects in ``UPLOADS_DIR`` of this
+container. ``STORAGE_BACKEND=s3`` stores them in an S3-compatible bucket (AWS S3,
+MinIO, ...) so every node reads the same originals and derivatives directly.
+"""
+
+from __future__ import annotations
+
+import logging
+import mimetypes
+import os
+import shutil
+import uuid
+from io import BytesIO
+from typing import BinaryIO, Iterator, Optional
+
+from fastapi.responses import FileResponse, Response, StreamingResponse
+
+
+logger = logging.getLogger(__name__)
+
+UPLOADS_DIR = os.path.abspath(os.getenv("UPLOADS_DIR", "uploads"))
+STORAGE_BACKEND = (os.getenv("STORAGE_BACKEND", "local") or "local").strip().lower()
+
+S3_BUCKET = os.getenv("S3_BUCKET")
+S3_PREFIX = (os.getenv("S3_PREFIX") or "").strip("/")
+S3_ENDPOINT_URL = os.getenv("S3_ENDPOINT_URL") or None
+S3_REGION = os.getenv("S3_REGION") or None
+S3_ACCESS_KEY_ID = os.getenv("S3_ACCESS_KEY_ID") or None
+S3_SECRET_ACCESS_KEY = os.getenv("S3_SECRET_ACCESS_KEY") or None
+
+_STREAM_CHUNK_SIZE = 256 * 1024
+
+
+def normalize_key(key: str) -> str:
+    """Validate a storage key and return it in canonical ``a/b.ext`` form."""
+    value = (key or "").replace("\\", "/").lstrip("/")
+    norm = os.path.normpath(value).replace("\\", "/")
+    if not value or norm in (".", "") or norm.startswith("..") or os.path.isabs(norm):
+        raise ValueError(f"Invalid storage key: {key!r}")
+    return norm
+
+
+def _content_type(key: str) -> str:
+    return mimetypes.guess_type(key)[0] or "application/octet-stream"
+
+
+class LocalStorage:
+    """Objects stored as plain files under one directory."""
+
+    is_local = True
+
+    def __init__(self, root: str):
+        self.root = os.path.abspath(root)
+        os.makedirs(self.root, exist_ok=True)
+
+    @property
+    def tmp_dir(self) -> str:
+        """Directory for upload staging files (same filesystem, so moves are atomic)."""
+        return self.root
+
+    def path(self, key: str) -> str:
+        full_path = os.path.abspath(os.path.join(self.root, normalize_key(key)))
+        if os.path.commonpath([self.root, full_path]) != self.root:
+            raise ValueError(f"Invalid storage key: {key!r}")
+        return full_path
+
+    def exists(self, key: str) -> bool:
+        return os.path.isfile(self.path(key))
+
+    def size(self, key: str) -> int:
+        return os.path.getsize(self.path(key))
+
+    def mtime(self, key: str) -> int:
+        return int(os.path.getmtime(self.path(key)))
+
+    def open(self, key: str) -> BinaryIO:
+        return open(self.path(key), "rb")
+
+    def put_bytes(self, key: str, data: bytes) -> None:
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, "wb") as file_handle:
+            file_handle.write(data)
+        os.replace(tmp_path, path)
+
+    def put_file(self, key: str, src_path: str) -> None:
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        shutil.move(src_path, path)
+
+    def delete(self, key: str) -> None:
+        try:
+            os.remove(self.path(key))
+        except FileNotFoundError:
+            pass
+
+    def list_keys(self, prefix: str = "") -> Iterator[str]:
+        base = self.path(prefix) if prefix else self.root
+        if not os.path.isdir(base):
+            return
+        for dirpath, _dirnames, filenames in os.walk(base):
+            for filename in filenames:
+                full_path = os.path.join(dirpath, filename)
+                yield os.path.relpath(full_path, self.root).replace(os.sep, "/")
+
+    def response(self, key: str, media_type: Optional[str] = None, headers: Optional[dict] = None) -> Response:
+        """Return a response streaming the object; raises FileNotFoundError if missing."""
+        path = self.path(key)
+        if not os.path.isfile(path):
+            raise FileNotFoundError(key)
+        return FileResponse(path, media_type=media_type or _content_type(key), headers=headers)
+
+
+class S3Storage:
+    """Objects stored in an S3-compatible bucket."""
+
+    is_local = False
+    tmp_dir = None
+
+    def __init__(
+        self,
+        bucket: str,
+        prefix: str = "",
+        endpoint_url: Optional[str] = None,
+        region: Optional[str] = None,
+        access_key_id: Optional[str] = None,
+        secret_access_key: Optional[str] = None,
+    ):
+        try:
+            import boto3
+            from botocore.config import Config
+        except ImportError as exc:
+            raise RuntimeError("STORAGE_BACKEND=s3 requires the boto3 package") from exc
+        if not bucket:
+            raise RuntimeError("S3_BUCKET is required when STORAGE_BACKEND=s3")
+
+        self.bucket = bucket
+        self.prefix = prefix.strip("/")
+        self._client = boto3.client(
+            "s3",
+            endpoint_url=endpoint_url,
+            region_name=region,
+            aws_access_key_id=access_key_id,
+            aws_secret_access_key=secret_access_key,
+            config=Config(
+                signature_version="s3v4",
+                s3={"addressing_style": "path" if endpoint_url else "auto"},
+                retries={"max_attempts": 3, "mode": "standard"},
+                max_pool_connections=int(os.getenv("S3_MAX_POOL_CONNECTIONS", "20")),
+            ),
+        )
+
+    def _object_key(self, key: str) -> str:
+        norm = normalize_key(key)
+        return f"{self.prefix}/{norm}" if self.prefix else norm
+
+    @staticmethod
+    def _is_missing(exc: Exception) -> bool:
+        error = getattr(exc, "response", {}).get("Error", {})
+        return str(error.get("Code")) in {"404", "NoSuchKey", "NotFound"}
+
+    def _head(self, key: str) -> dict:
+        try:
+            return self._client.head_object(Bucket=self.bucket, Key=self._object_key(key))
+        except Exception as exc:
+            if self._is_missing(exc):
+                raise FileNotFoundError(key) from exc
+            raise
+
+    def _get(self, key: str) -> dict:
+        try:
+            return self._client.get_object(Bucket=self.bucket, Key=self._object_key(key))
+        except Exception as exc:
+            if self._is_missing(exc):
+                raise FileNotFoundError(key) from exc
+            raise
+
+    def exists(self, key: str) -> bool:
+        try:
+            self._head(key)
+            return True
+        except FileNotFoundError:
+            return False
+
+    def size(self, key: str) -> int:
+        return int(self._head(key)["ContentLength"])
+
+    def mtime(self, key: str) -> int:
+        return int(self._head(key)["LastModified"].timestamp())
+
+    def open(self, key: str) -> BinaryIO:
+        return BytesIO(self._get(key)["Body"].read())
+
+    def put_bytes(self, key: str, data: bytes) -> None:
+        self._client.put_object(
+            Bucket=self.bucket,
+            Key=self._object_key(key),
+            Body=data,
+            ContentType=_content_type(key),
+        )
+
+    def put_file(self, key: str, src_path: str) -> None:
+        self._client.upload_file(
+            src_path,
+            self.bucket,
+            self._object_key(key),
+            ExtraArgs={"ContentType": _content_type(key)},
+        )
+        os.remove(src_path)
+
+    def delete(self, key: str) -> None:
+        self._client.delete_object(Bucket=self.bucket, Key=self._object_key(key))
+
+    def list_keys(self, prefix: str = "") -> Iterator[str]:
+        full_prefix = self._object_key(prefix) if prefix else self.prefix
+        strip = f"{self.prefix}/" if self.prefix else ""
+        paginator = self._client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=full_prefix):
+            for item in page.get("Contents", []):
+                yield item["Key"][len(strip):] if strip else item["Key"]
+
+    def response(self, key: str, media_type: Optional[str] = None, headers: Optional[dict] = None) -> Response:
+        """Return a response streaming the object; raises FileNotFoundError if missing."""
+        obj = self._get(key)
+        response_headers = dict(headers or {})
+        response_headers["Content-Length"] = str(obj["ContentLength"])
+        return StreamingResponse(
+            obj["Body"].iter_chunks(_STREAM_CHUNK_SIZE),
+            media_type=media_type or obj.get("ContentType") or _content_type(key),
+            headers=response_headers,
+        )
+
+
+_storage = None
+
+
+def get_storage():
+    """Return the process-wide storage backend configured by STORAGE_BACKEND."""
+    global _storage
+    if _storage is None:
+        if STORAGE_BACKEND == "s3":
+            _storage = S3Storage(
+                bucket=S3_BUCKET,
+                prefix=S3_PREFIX,
+                endpoint_url=S3_ENDPOINT_URL,
+                region=S3_REGION,
+                access_key_id=S3_ACCESS_KEY_ID,
+                secret_access_key=S3_SECRET_ACCESS_KEY,
+            )
+        elif STORAGE_BACKEND == "local":
+            _storage = LocalStorage(UPLOADS_DIR)
+        else:
+            raise RuntimeError(f"Unknown STORAGE_BACKEND: {STORAGE_BACKEND}")
+        logger.info("Storage backend: %s", STORAGE_BACKEND)
+    return _storage
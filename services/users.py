@@ -3,7 +3,12 @@
 from __future__ import annotations
 
 import re
-from typing import Optional
+from typing import Optional, Tuple
+
+
+# (minimum lifetime spend, cashback percent), highest tier first.
+CASHBACK_TIERS: Tuple[Tuple[int, int], ...] = ((25000, 20), (10000, 15), (5000, 10), (2000, 5))
+CASHBACK_RECALC_CHUNK_SIZE = 5000
 
 
 def clean_warehouse_value(value: Optional[str]) -> Optional[str]:
@@ -30,12 +35,43 @@ def normalize_phone(phone: str) -> str:
 
 def calculate_cashback_percent(total_spent: float) -> int:
     """Calculate cashback percent from lifetime spend."""
-    if total_spent < 2000:
-        return 0
-    if total_spent < 5000:
-        return 5
-    if total_spent < 10000:
-        return 10
-    if total_spent < 25000:
-        return 15
-    return 20
+    for min_spent, percent in CASHBACK_TIERS:
+        if total_spent >= min_spent:
+            return percent
+    return 0
+
+
+def cashback_percent_sql(column: str = "total_spent") -> str:
+    """SQL CASE expression equivalent to calculate_cashback_percent()."""
+    branches = " ".join(f"WHEN COALESCE({column}, 0) >= {min_spent} THEN {percent}" for min_spent, percent in CASHBACK_TIERS)
+    return f"(CASE {branches} ELSE 0 END)"
+
+
+def recalculate_all_cashback_percents(conn, chunk_size: int = CASHBACK_RECALC_CHUNK_SIZE) -> int:
+    """Set-based cashback recalculation in phone-keyset chunks.
+
+    Each chunk is one UPDATE (committed separately, so row locks are short) that
+    only touches rows whose percent actually changes. Returns the changed row count.
+    """
+    expected = cashback_percent_sql("total_spent")
+    changed = 0
+    last_phone = ""
+    while True:
+        boundary = conn.execute(
+            "SELECT phone FROM users WHERE phone > ? ORDER BY phone OFFSET ? LIMIT 1",
+            (last_phone, chunk_size - 1),
+        ).fetchone()
+        upper_sql, params = ("AND phone <= ?", [last_phone, boundary["phone"]]) if boundary else ("", [last_phone])
+        cur = conn.execute(
+            f"""
+            UPDATE users SET cashback_percent = {expected}
+            WHERE phone > ? {upper_sql}
+              AND cashback_percent IS DISTINCT FROM {expected}
+            """,
+            tuple(params),
+        )
+        changed += max(cur.rowcount, 0)
+        conn.commit()
+        if not boundary:
+            return changed
+        last_phone = boundary["phone"]